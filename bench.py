@@ -9,12 +9,30 @@ Changes vs previous:
       * one sequential WRITE stream
     running in parallel (2 threads total).
 
+Optional open-loop mode (--mode open):
+  - asyncio load generator that fires requests on a fixed schedule
+    (--rate 2000/s, --arrivals poisson|uniform) regardless of how fast the
+    Gateway answers, with up to --max-conns requests in flight.
+  - latency is measured from the *scheduled* send time, so queueing on the
+    client side is charged to the request (corrects coordinated omission).
+
+Multi-process mode (--procs N, optional --remote-workers K):
+  - N local load-generating processes (plus K started on other hosts with
+    `bench.py worker --coordinator HOST:PORT`) share a start barrier and
+    stream their per-second histograms/counters back to this coordinator,
+    which merges them into the same output files.
+
 Generates ONLY graphs that can be produced from this client-side program:
   - TPS vs time (1s buckets), split READ/WRITE
   - Latency vs time (1s buckets), split READ/WRITE (mean/p50/p95/p99/max)
   - Summary counts (sent vs ok) per phase and combined
   - raw_requests.csv (audit/debug; optional)
 
+If the Gateway sends a Server-Timing header (auth, validate, pool, execute,
+fetch, serialize, total), the per-stage durations are kept in raw_requests.*
+and latency_timeseries.csv gets server/db mean columns, so client latency can
+be split into network, gateway overhead and proxy/database time.
+
 Does NOT prove routing correctness (manager vs workers) unless your Gateway returns a JSON
 field "target". If present, it is logged in raw_requests.csv for later use, but no routing
 graphs are generated here.
@@ -23,7 +41,10 @@ Outputs (in --outdir):
   - summary.csv
   - tps_timeseries.csv
   - latency_timeseries.csv
-  - raw_requests.csv   (unless --no-raw)
+  - latency_histograms.json  (whole-run, mergeable latency histograms per kind)
+  - template_latency.csv     (per workload template; only with --workload)
+  - raw_requests.csv   (unless --no-raw; streamed to disk during the run,
+                        or raw_requests.bin with --raw-format bin)
 
 Usage:
   python3 bench.py \
@@ -32,19 +53,58 @@ Usage:
     --strategy random \
     --reads 1000 --writes 1000 \
     --outdir ./benchmarking/random
+
+  python3 bench.py \
+    --gateway-url http://<GATEWAY_PUBLIC_IP> \
+    --strategy random --mode open --rate 2000/s --arrivals poisson \
+    --reads 50000 --writes 50000 \
+    --outdir ./benchmarking/random_open
+
+  python3 bench.py \
+    --gateway-url http://<GATEWAY_PUBLIC_IP> \
+    --strategy random --mode open --rate 8000/s --procs 4 \
+    --reads 200000 --writes 200000 \
+    --outdir ./benchmarking/random_4procs
+
+  python3 bench.py compare ./benchmarking/directhit ./benchmarking/random --threshold 5
+
+  python3 bench.py stream --gateway-url http://<GATEWAY_PUBLIC_IP> --api-key <KEY> \
+    --sql "SELECT * FROM sakila.rental" --requests 50 --outdir ./benchmarking/stream
+
+  python3 bench.py batch --gateway-url http://<GATEWAY_PUBLIC_IP> --api-key <KEY> \
+    --sizes 1,10,100 --statements 5000 --transaction --outdir ./benchmarking/batch
 """
 
 import argparse
+import asyncio
+import bisect
 import csv
+import http.client
+import itertools
 import json
+import math
+import multiprocessing
+import multiprocessing.connection as mp_connection
 import os
+import random
+import re
+import socket
+import struct
+import sys
 import time
 import threading
+import urllib.parse
 import urllib.request
 import urllib.error
-from dataclasses import dataclass
+from array import array
+from dataclasses import asdict, astuple, dataclass
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:  # only needed for --aggregator numpy / `bench.py aggregate`
+    np = None
 
 
 # ------------------------
@@ -59,26 +119,15 @@ def ensure_dir(path: str) -> None:
     os.makedirs(path, exist_ok=True)
 
 
-def percentile(values: List[float], p: float) -> Optional[float]:
-    """Simple deterministic percentile with linear interpolation."""
-    if not values:
-        return None
-    if p <= 0:
-        return min(values)
-    if p >= 100:
-        return max(values)
-    s = sorted(values)
-    k = (p / 100.0) * (len(s) - 1)
-    lo = int(k)
-    hi = min(lo + 1, len(s) - 1)
-    if hi == lo:
-        return s[lo]
-    frac = k - lo
-    return s[lo] * (1.0 - frac) + s[hi] * frac
-
-
-def http_post_json(url: str, api_key: str, payload: Dict[str, Any], timeout_s: float = 10.0) -> Tuple[int, str]:
-    data = json.dumps(payload).encode("utf-8")
+def http_post_json(url: str, api_key: str, payload: Dict[str, Any], timeout_s: float = 10.0) -> Tuple[int, str, str]:
+    return http_post_bytes(url, api_key, json.dumps(payload).encode("utf-8"), timeout_s=timeout_s)
+
+
+def http_post_bytes(url: str, api_key: str, data: bytes, timeout_s: float = 10.0) -> Tuple[int, str, str]:
+    """
+    POST an already-encoded JSON body on a fresh connection (urllib).
+    Returns (status, body, Server-Timing header or "").
+    """
     req = urllib.request.Request(
         url,
         data=data,
@@ -91,12 +140,402 @@ def http_post_json(url: str, api_key: str, payload: Dict[str, Any], timeout_s: f
     try:
         with urllib.request.urlopen(req, timeout=timeout_s) as resp:
             body = resp.read().decode("utf-8", errors="replace")
-            return resp.getcode(), body
+            return resp.getcode(), body, resp.headers.get("Server-Timing", "")
     except urllib.error.HTTPError as e:
         body = e.read().decode("utf-8", errors="replace") if e.fp else str(e)
-        return e.code, body
+        return e.code, body, e.headers.get("Server-Timing", "") if e.headers else ""
     except Exception as e:
-        return 0, str(e)
+        return 0, str(e), ""
+
+
+class FreshTransport:
+    """Opens a new TCP connection for every request (the historical behaviour)."""
+
+    def __init__(self, url: str, api_key: str, timeout_s: float) -> None:
+        self.url = url
+        self.api_key = api_key
+        self.timeout_s = timeout_s
+
+    def post(self, body: bytes) -> Tuple[int, str, str]:
+        return http_post_bytes(self.url, self.api_key, body, timeout_s=self.timeout_s)
+
+    def close(self) -> None:
+        pass
+
+
+class KeepAliveTransport:
+    """
+    One persistent HTTP/1.1 connection to the Gateway, owned by a single worker
+    thread (http.client connections are not thread-safe).
+
+    A request that fails on a reused connection (server closed it while idle)
+    is retried once on a new connection.
+    """
+
+    def __init__(self, url: str, api_key: str, timeout_s: float) -> None:
+        u = urllib.parse.urlsplit(url)
+        self._conn_cls = http.client.HTTPSConnection if u.scheme == "https" else http.client.HTTPConnection
+        self._netloc = u.netloc
+        self._path = (u.path or "/") + (f"?{u.query}" if u.query else "")
+        self._headers = {
+            "Content-Type": "application/json",
+            "X-API-Key": api_key,
+            "Connection": "keep-alive",
+        }
+        self.timeout_s = timeout_s
+        self._conn: Optional[http.client.HTTPConnection] = None
+
+    def post(self, body: bytes) -> Tuple[int, str, str]:
+        for attempt in (0, 1):
+            reused = self._conn is not None
+            if self._conn is None:
+                self._conn = self._conn_cls(self._netloc, timeout=self.timeout_s)
+            try:
+                self._conn.request("POST", self._path, body=body, headers=self._headers)
+                resp = self._conn.getresponse()
+                data = resp.read()
+                if resp.will_close:
+                    self.close()
+                return resp.status, data.decode("utf-8", errors="replace"), resp.getheader("Server-Timing", "")
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                self.close()
+                if reused and attempt == 0:
+                    continue
+                return 0, str(e), ""
+            except Exception as e:
+                self.close()
+                return 0, str(e), ""
+        return 0, "unreachable", ""
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def make_transport(kind: str, url: str, api_key: str, timeout_s: float):
+    if kind == "fresh":
+        return FreshTransport(url, api_key, timeout_s)
+    if kind == "pooled":
+        return KeepAliveTransport(url, api_key, timeout_s)
+    raise ValueError(f"Unknown transport: {kind}")
+
+
+# ------------------------
+# Server-Timing (per-stage durations reported by the Gateway)
+# ------------------------
+
+SERVER_TIMING_STAGES = ("auth", "validate", "pool", "execute", "fetch", "serialize", "total")
+# Stages spent waiting on ProxySQL/MySQL; the rest of "total" is Gateway overhead.
+SERVER_TIMING_DB_STAGES = ("execute", "fetch")
+
+
+def parse_server_timing(header: str) -> Optional[Tuple[float, ...]]:
+    """
+    'auth;dur=0.01, execute;dur=2.5, ...' -> durations (ms) in
+    SERVER_TIMING_STAGES order, NaN for stages the header does not mention.
+    None when there is no header.
+    """
+    if not header:
+        return None
+    durs: Dict[str, float] = {}
+    for metric in header.split(","):
+        name, *params = metric.strip().split(";")
+        for p in params:
+            k, _, v = p.strip().partition("=")
+            if k == "dur":
+                try:
+                    durs[name.strip()] = float(v)
+                except ValueError:
+                    pass
+    if not durs:
+        return None
+    return tuple(durs.get(stage, float("nan")) for stage in SERVER_TIMING_STAGES)
+
+
+def server_db_ms(timing: Optional[Tuple[float, ...]]) -> Tuple[Optional[float], Optional[float]]:
+    """(server total, proxy/database time) in ms from a parsed Server-Timing tuple."""
+    if timing is None:
+        return None, None
+    by_stage = dict(zip(SERVER_TIMING_STAGES, timing))
+    if math.isnan(by_stage["total"]):
+        return None, None
+    return by_stage["total"], sum(by_stage[s] for s in SERVER_TIMING_DB_STAGES if not math.isnan(by_stage[s]))
+
+
+# ------------------------
+# Streaming latency histograms
+# ------------------------
+
+class LatencyHistogram:
+    """
+    HDR-style log-linear latency histogram with microsecond resolution.
+
+    Values below 2**(SUB_BITS+1) us are stored exactly; above that every power
+    of two is split into 2**SUB_BITS sub-buckets, so any percentile is within
+    2**-SUB_BITS (~0.8%) of the true value. record() is O(1), memory is bounded
+    by the number of distinct buckets (a few thousand at most), and two
+    histograms merge by adding counts.
+    """
+
+    SUB_BITS = 7
+    __slots__ = ("counts", "count", "total_ms", "max_ms")
+
+    def __init__(self) -> None:
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    @classmethod
+    def _index(cls, us: int) -> int:
+        sub = 1 << cls.SUB_BITS
+        if us < 2 * sub:
+            return us
+        shift = us.bit_length() - cls.SUB_BITS - 1
+        return shift * sub + (us >> shift)
+
+    @classmethod
+    def _value_ms(cls, idx: int) -> float:
+        """Midpoint of bucket idx, in ms."""
+        sub = 1 << cls.SUB_BITS
+        if idx < 2 * sub:
+            return idx / 1000.0
+        shift = idx // sub - 1
+        lo = (idx - shift * sub) << shift
+        return (lo + ((1 << shift) - 1) / 2.0) / 1000.0
+
+    def record(self, lat_ms: float) -> None:
+        idx = self._index(max(0, int(lat_ms * 1000.0)))
+        self.counts[idx] = self.counts.get(idx, 0) + 1
+        self.count += 1
+        self.total_ms += lat_ms
+        if lat_ms > self.max_ms:
+            self.max_ms = lat_ms
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        for idx, c in other.counts.items():
+            self.counts[idx] = self.counts.get(idx, 0) + c
+        self.count += other.count
+        self.total_ms += other.total_ms
+        self.max_ms = max(self.max_ms, other.max_ms)
+
+    def mean_ms(self) -> Optional[float]:
+        return self.total_ms / self.count if self.count else None
+
+    def percentiles(self, ps: List[float]) -> List[Optional[float]]:
+        """Nearest-rank percentiles for each p in ps (single pass over buckets)."""
+        if not self.count:
+            return [None for _ in ps]
+        ranks = sorted((max(1, int(-(-p * self.count // 100))), i) for i, p in enumerate(ps))
+        out: List[Optional[float]] = [None] * len(ps)
+        seen = 0
+        j = 0
+        for idx in sorted(self.counts):
+            seen += self.counts[idx]
+            while j < len(ranks) and ranks[j][0] <= seen:
+                out[ranks[j][1]] = min(self._value_ms(idx), self.max_ms)
+                j += 1
+            if j == len(ranks):
+                break
+        return out
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "sub_bits": self.SUB_BITS,
+            "count": self.count,
+            "total_ms": self.total_ms,
+            "max_ms": self.max_ms,
+            "counts": {str(k): v for k, v in self.counts.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "LatencyHistogram":
+        if d.get("sub_bits", cls.SUB_BITS) != cls.SUB_BITS:
+            raise ValueError("histogram was recorded with a different SUB_BITS")
+        h = cls()
+        h.counts = {int(k): int(v) for k, v in d["counts"].items()}
+        h.count = int(d["count"])
+        h.total_ms = float(d["total_ms"])
+        h.max_ms = float(d["max_ms"])
+        return h
+
+
+class KindStats:
+    """
+    Counters + latency histogram (HTTP 200 only) for one kind in one bucket,
+    plus Server-Timing sums for the successful requests that carried one.
+    """
+
+    __slots__ = ("sent", "ok", "hist", "timed", "server_ms", "db_ms")
+
+    def __init__(self) -> None:
+        self.sent = 0
+        self.ok = 0
+        self.hist = LatencyHistogram()
+        self.timed = 0
+        self.server_ms = 0.0
+        self.db_ms = 0.0
+
+    def add(self, ok: int, lat_ms: float, server_ms: Optional[float] = None, db_ms: Optional[float] = None) -> None:
+        self.sent += 1
+        if ok:
+            self.ok += 1
+            self.hist.record(lat_ms)
+            if server_ms is not None:
+                self.timed += 1
+                self.server_ms += server_ms
+                self.db_ms += db_ms or 0.0
+
+    def merge(self, other: "KindStats") -> None:
+        self.sent += other.sent
+        self.ok += other.ok
+        self.hist.merge(other.hist)
+        self.timed += other.timed
+        self.server_ms += other.server_ms
+        self.db_ms += other.db_ms
+
+
+class StatsRecorder:
+    """
+    Streaming per-bucket aggregates (1 s buckets unless bucket_ms says
+    otherwise) for one load-generating worker.
+
+    Each thread/task owns its recorder (no locking on the hot path); recorders
+    are merged once the run is over.
+    """
+
+    KINDS = ("read", "write")
+
+    def __init__(self, bucket_ms: int = 1000) -> None:
+        self.bucket_ms = bucket_ms
+        self.buckets: Dict[int, Dict[str, KindStats]] = {}
+        # Whole-run stats per workload template (not bucketed).
+        self.templates: Dict[str, KindStats] = {}
+        self.template_kinds: Dict[str, str] = {}
+
+    def bucket_of(self, t: float) -> int:
+        if self.bucket_ms == 1000:
+            return int(t)
+        return int(t * 1000.0) // self.bucket_ms
+
+    def record(
+        self,
+        kind: str,
+        ok: int,
+        lat_ms: float,
+        t_end: float,
+        template: Optional[str] = None,
+        server_ms: Optional[float] = None,
+        db_ms: Optional[float] = None,
+    ) -> None:
+        b = self.bucket_of(t_end)
+        per_kind = self.buckets.get(b)
+        if per_kind is None:
+            per_kind = self.buckets[b] = {k: KindStats() for k in self.KINDS}
+        per_kind[kind].add(ok, lat_ms, server_ms, db_ms)
+
+        if template is not None:
+            tst = self.templates.get(template)
+            if tst is None:
+                tst = self.templates[template] = KindStats()
+                self.template_kinds[template] = kind
+            tst.add(ok, lat_ms, server_ms, db_ms)
+
+    def record_request(self, rec: "RequestRecord") -> None:
+        server_ms, db_ms = server_db_ms(rec.server_timing)
+        self.record(rec.kind, rec.ok, rec.lat_ms, rec.t_wall_end, rec.template, server_ms, db_ms)
+
+    def merge(self, other: "StatsRecorder") -> None:
+        if other.bucket_ms != self.bucket_ms:
+            raise ValueError(f"cannot merge {other.bucket_ms} ms buckets into {self.bucket_ms} ms buckets")
+        for b, per_kind in other.buckets.items():
+            mine = self.buckets.get(b)
+            if mine is None:
+                mine = self.buckets[b] = {k: KindStats() for k in self.KINDS}
+            for k, st in per_kind.items():
+                mine[k].merge(st)
+        for name, st in other.templates.items():
+            mine_t = self.templates.get(name)
+            if mine_t is None:
+                mine_t = self.templates[name] = KindStats()
+                self.template_kinds[name] = other.template_kinds[name]
+            mine_t.merge(st)
+
+    def drain(self, before_t: Optional[float] = None) -> "StatsRecorder":
+        """
+        Move buckets that end before wall time `before_t` (all buckets if None)
+        into a new recorder. Safe to call from another thread while this
+        recorder is still being fed, as long as `before_t` is in the past.
+        Per-template stats only move on the final drain (before_t=None).
+        """
+        out = StatsRecorder(self.bucket_ms)
+        before = None if before_t is None else self.bucket_of(before_t)
+        for b in list(self.buckets):
+            if before is None or b < before:
+                out.buckets[b] = self.buckets.pop(b)
+        if before is None:
+            out.templates, self.templates = self.templates, {}
+            out.template_kinds, self.template_kinds = self.template_kinds, {}
+        return out
+
+    @staticmethod
+    def _kind_to_dict(st: KindStats) -> Dict[str, Any]:
+        return {
+            "sent": st.sent,
+            "ok": st.ok,
+            "hist": st.hist.to_dict(),
+            "timed": st.timed,
+            "server_ms": st.server_ms,
+            "db_ms": st.db_ms,
+        }
+
+    @staticmethod
+    def _kind_from_dict(v: Dict[str, Any]) -> KindStats:
+        st = KindStats()
+        st.sent = int(v["sent"])
+        st.ok = int(v["ok"])
+        st.hist = LatencyHistogram.from_dict(v["hist"])
+        st.timed = int(v.get("timed", 0))
+        st.server_ms = float(v.get("server_ms", 0.0))
+        st.db_ms = float(v.get("db_ms", 0.0))
+        return st
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "bucket_ms": self.bucket_ms,
+            "buckets": {
+                str(b): {k: self._kind_to_dict(st) for k, st in per_kind.items()}
+                for b, per_kind in self.buckets.items()
+            },
+            "templates": {
+                name: {"kind": self.template_kinds[name], **self._kind_to_dict(st)}
+                for name, st in self.templates.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "StatsRecorder":
+        rec = cls(int(d["bucket_ms"]))
+        for b, per_kind in d["buckets"].items():
+            rec.buckets[int(b)] = {k: cls._kind_from_dict(v) for k, v in per_kind.items()}
+        for name, v in d.get("templates", {}).items():
+            rec.templates[name] = cls._kind_from_dict(v)
+            rec.template_kinds[name] = v["kind"]
+        return rec
+
+    def totals(self) -> Dict[str, KindStats]:
+        out = {k: KindStats() for k in self.KINDS}
+        for per_kind in self.buckets.values():
+            for k, st in per_kind.items():
+                out[k].merge(st)
+        return out
+
+    def bucket_range(self) -> List[int]:
+        """Every bucket from first to last (gaps filled)."""
+        if not self.buckets:
+            return []
+        return list(range(min(self.buckets), max(self.buckets) + 1))
 
 
 # ------------------------
@@ -105,14 +544,207 @@ def http_post_json(url: str, api_key: str, payload: Dict[str, Any], timeout_s: f
 
 @dataclass
 class RequestRecord:
+    # Slots keep a record at ~100 bytes; the ISO timestamp is only built when
+    # the record is written out (see RawRecordSink).
+    __slots__ = ("phase", "kind", "ok", "http_code", "lat_ms", "t_wall_end", "target", "template", "server_timing")
+
     phase: str           # "parallel_rw"
     kind: str            # "read" or "write"
     ok: int              # 1 if HTTP 200 else 0
     http_code: int
     lat_ms: float
     t_wall_end: float    # time.time() end timestamp (bucketing)
-    iso_end: str
     target: str          # optional from response JSON, else "unknown"
+    template: str        # workload template name ("fixed_read"/"fixed_write" without --workload)
+    server_timing: Optional[Tuple[float, ...]]  # Gateway stage durations (SERVER_TIMING_STAGES), if sent
+
+
+# Where runners put finished records: a plain list or a RecordSink.
+RecordOut = Union[List[RequestRecord], "RecordSink"]
+
+
+def make_record(
+    phase: str,
+    kind: str,
+    code: int,
+    body: str,
+    lat_ms: float,
+    template: str,
+    server_timing: str = "",
+) -> RequestRecord:
+    ok = 1 if code == 200 else 0
+
+    target = "unknown"
+    if ok and body:
+        # Optional: if your gateway returns {"target":"manager|worker1|worker2"}.
+        try:
+            j = json.loads(body)
+            if isinstance(j, dict):
+                target = str(j.get("target", "unknown"))
+        except Exception:
+            pass
+
+    t_wall_end = time.time()
+    return RequestRecord(
+        phase=phase,
+        kind=kind,
+        ok=ok,
+        http_code=code,
+        lat_ms=lat_ms,
+        t_wall_end=t_wall_end,
+        target=target,
+        template=template,
+        server_timing=parse_server_timing(server_timing),
+    )
+
+
+# ------------------------
+# Workloads (what each request sends)
+# ------------------------
+
+def parse_rw_ratio(text: str) -> float:
+    """'95/5' -> 0.95 read fraction; a single number is taken as the read percentage."""
+    try:
+        if "/" in text:
+            r, w = (float(x) for x in text.split("/", 1))
+        else:
+            r = float(text)
+            w = 100.0 - r
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid read/write ratio: {text!r}")
+    if r < 0 or w < 0 or r + w <= 0:
+        raise argparse.ArgumentTypeError(f"invalid read/write ratio: {text!r}")
+    return r / (r + w)
+
+
+class FixedQueries:
+    """The two fixed statements (FIXED_READ_SQL / FIXED_WRITE_SQL), pre-encoded once."""
+
+    fixed = True
+
+    def __init__(self, read_sql: str, write_sql: str) -> None:
+        self._bodies = {
+            "read": ("fixed_read", json.dumps({"query": read_sql}).encode("utf-8")),
+            "write": ("fixed_write", json.dumps({"query": write_sql}).encode("utf-8")),
+        }
+
+    def next_body(self, kind: str, rng: random.Random) -> Tuple[str, bytes]:
+        return self._bodies[kind]
+
+
+class ParamGen:
+    """
+    Key generator for one template parameter:
+      uniform    - integers in [min, max]
+      zipf       - integers in [min, max], P(min + k) ~ 1 / (k+1)**s (hot keys first)
+      sequential - min, min+1, ... max, then wraps (shared by all threads in a process)
+      choice     - one of "values"
+    """
+
+    def __init__(self, spec: Dict[str, Any]) -> None:
+        self.dist = spec.get("dist", "uniform")
+        if self.dist == "choice":
+            self.values = list(spec["values"])
+            if not self.values:
+                raise ValueError("choice parameter needs at least one value")
+            return
+        self.lo = int(spec["min"])
+        self.hi = int(spec["max"])
+        if self.hi < self.lo:
+            raise ValueError(f"max < min in parameter spec: {spec}")
+        if self.dist == "zipf":
+            s = float(spec.get("s", 1.0))
+            self._cum = list(itertools.accumulate(1.0 / (k ** s) for k in range(1, self.hi - self.lo + 2)))
+        elif self.dist == "sequential":
+            self._seq = itertools.count()
+        elif self.dist != "uniform":
+            raise ValueError(f"Unknown parameter distribution: {self.dist}")
+
+    def next(self, rng: random.Random) -> Any:
+        if self.dist == "uniform":
+            return rng.randint(self.lo, self.hi)
+        if self.dist == "zipf":
+            return self.lo + bisect.bisect_left(self._cum, rng.random() * self._cum[-1])
+        if self.dist == "sequential":
+            return self.lo + next(self._seq) % (self.hi - self.lo + 1)
+        return rng.choice(self.values)
+
+
+# {name} or '{name}' in a template; with bound parameters both become %s.
+PLACEHOLDER_RE = re.compile(r"'\{(\w+)\}'|\{(\w+)\}")
+
+
+class QueryTemplate:
+    def __init__(self, spec: Dict[str, Any]) -> None:
+        self.name = str(spec["name"])
+        self.kind = spec["kind"]
+        if self.kind not in ("read", "write"):
+            raise ValueError(f"template {self.name}: kind must be read or write")
+        self.weight = float(spec.get("weight", 1.0))
+        self.sql = spec["sql"]
+        self.params = {k: ParamGen(v) for k, v in spec.get("params", {}).items()}
+        # Bound form: the SQL text never changes, values travel in "params".
+        self.bind_order = [m.group(1) or m.group(2) for m in PLACEHOLDER_RE.finditer(self.sql)]
+        self.bind_sql = PLACEHOLDER_RE.sub("%s", self.sql)
+        unknown = set(self.bind_order) - set(self.params)
+        if unknown:
+            raise ValueError(f"template {self.name}: no params spec for {sorted(unknown)}")
+
+    def render(self, rng: random.Random) -> str:
+        return self.sql.format(**{k: g.next(rng) for k, g in self.params.items()})
+
+    def render_bound(self, rng: random.Random) -> Tuple[str, List[Any]]:
+        values = {k: g.next(rng) for k, g in self.params.items()}
+        return self.bind_sql, [values[k] for k in self.bind_order]
+
+
+class Workload:
+    """
+    Weighted query templates loaded from a workload file (see
+    workloads/sakila_mix.json). Kinds are split by the read/write ratio;
+    within a kind a template is drawn by weight and its parameters rendered.
+    """
+
+    fixed = False
+
+    def __init__(self, spec: Dict[str, Any]) -> None:
+        self.name = spec.get("name", "workload")
+        self.read_ratio = spec.get("read_ratio")
+        # Set by --query-params: send "params" instead of inlining the values.
+        self.bind_params = spec.get("bind_params", False)
+        self.templates = [QueryTemplate(t) for t in spec["templates"]]
+        names = [t.name for t in self.templates]
+        if len(set(names)) != len(names):
+            raise ValueError("template names must be unique")
+        self._by_kind: Dict[str, Tuple[List[QueryTemplate], List[float]]] = {}
+        for kind in ("read", "write"):
+            ts = [t for t in self.templates if t.kind == kind and t.weight > 0]
+            self._by_kind[kind] = (ts, list(itertools.accumulate(t.weight for t in ts)))
+
+    @staticmethod
+    def load(path: str) -> Dict[str, Any]:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def pick(self, kind: str, rng: random.Random) -> QueryTemplate:
+        ts, cum = self._by_kind[kind]
+        if not ts:
+            raise ValueError(f"workload {self.name!r} has no {kind} templates")
+        return ts[bisect.bisect_left(cum, rng.random() * cum[-1])]
+
+    def next_body(self, kind: str, rng: random.Random) -> Tuple[str, bytes]:
+        t = self.pick(kind, rng)
+        if self.bind_params:
+            sql, params = t.render_bound(rng)
+            return t.name, json.dumps({"query": sql, "params": params}).encode("utf-8")
+        return t.name, json.dumps({"query": t.render(rng)}).encode("utf-8")
+
+
+RequestSource = Union[FixedQueries, Workload]
+
+
+def make_source(read_sql: str, write_sql: str, workload: Optional[Dict[str, Any]]) -> RequestSource:
+    return Workload(workload) if workload else FixedQueries(read_sql, write_sql)
 
 
 # ------------------------
@@ -124,43 +756,30 @@ def run_stream(
     n: int,
     endpoint: str,
     api_key: str,
-    sql: str,
+    source: RequestSource,
     timeout_s: float,
     phase: str,
-    out: List[RequestRecord],
+    out: RecordOut,
     lock: threading.Lock,
+    stats: StatsRecorder,
+    transport: str = "pooled",
+    seed: Optional[int] = None,
 ) -> None:
-    for _ in range(n):
-        t0 = time.perf_counter()
-        code, body = http_post_json(endpoint, api_key, {"query": sql}, timeout_s=timeout_s)
-        t1 = time.perf_counter()
-
-        lat_ms = (t1 - t0) * 1000.0
-        ok = 1 if code == 200 else 0
+    client = make_transport(transport, endpoint, api_key, timeout_s)
+    rng = random.Random(seed)
+    try:
+        for _ in range(n):
+            template, payload = source.next_body(kind, rng)
+            t0 = time.perf_counter()
+            code, body, timing = client.post(payload)
+            t1 = time.perf_counter()
 
-        target = "unknown"
-        if ok and body:
-            # Optional: if your gateway returns {"target":"manager|worker1|worker2"}.
-            try:
-                j = json.loads(body)
-                if isinstance(j, dict):
-                    target = str(j.get("target", "unknown"))
-            except Exception:
-                pass
-
-        t_wall_end = time.time()
-        rec = RequestRecord(
-            phase=phase,
-            kind=kind,
-            ok=ok,
-            http_code=code,
-            lat_ms=lat_ms,
-            t_wall_end=t_wall_end,
-            iso_end=iso_utc(t_wall_end),
-            target=target,
-        )
-        with lock:
-            out.append(rec)
+            rec = make_record(phase, kind, code, body, (t1 - t0) * 1000.0, template, timing)
+            stats.record_request(rec)
+            with lock:
+                out.append(rec)
+    finally:
+        client.close()
 
 
 def run_parallel_reads_writes(
@@ -171,9 +790,21 @@ def run_parallel_reads_writes(
     read_sql: str,
     write_sql: str,
     timeout_s: float,
-) -> Tuple[List[RequestRecord], float]:
-    records: List[RequestRecord] = []
+    transport: str = "pooled",
+    records: Optional[RecordOut] = None,
+    live_stats: Optional[List[StatsRecorder]] = None,
+    bucket_ms: int = 1000,
+    workload: Optional[Dict[str, Any]] = None,
+    seed: Optional[int] = None,
+) -> Tuple[RecordOut, StatsRecorder, float]:
+    if records is None:
+        records = []
+    source = make_source(read_sql, write_sql, workload)
     lock = threading.Lock()
+    stats_r = StatsRecorder(bucket_ms)
+    stats_w = StatsRecorder(bucket_ms)
+    if live_stats is not None:
+        live_stats.extend([stats_r, stats_w])
 
     phase = "parallel_rw"
 
@@ -181,12 +812,14 @@ def run_parallel_reads_writes(
 
     th_r = threading.Thread(
         target=run_stream,
-        args=("read", n_reads, endpoint, api_key, read_sql, timeout_s, phase, records, lock),
+        args=("read", n_reads, endpoint, api_key, source, timeout_s, phase, records, lock, stats_r, transport,
+              None if seed is None else seed * 2),
         daemon=True,
     )
     th_w = threading.Thread(
         target=run_stream,
-        args=("write", n_writes, endpoint, api_key, write_sql, timeout_s, phase, records, lock),
+        args=("write", n_writes, endpoint, api_key, source, timeout_s, phase, records, lock, stats_w, transport,
+              None if seed is None else seed * 2 + 1),
         daemon=True,
     )
 
@@ -196,127 +829,701 @@ def run_parallel_reads_writes(
     th_w.join()
 
     t1 = time.time()
-    return records, max(1e-9, t1 - t0)
+    stats = StatsRecorder(bucket_ms)
+    stats.merge(stats_r)
+    stats.merge(stats_w)
+    return records, stats, max(1e-9, t1 - t0)
 
 
 # ------------------------
-# Aggregations (Graph A + Graph B) + Summary
+# Open-loop runner (asyncio, constant arrival rate)
 # ------------------------
 
-def compute_tps_timeseries(records: List[RequestRecord]) -> List[Dict[str, Any]]:
-    if not records:
-        return []
+def parse_rate(text: str) -> float:
+    """Parse '2000', '2000/s' or '120000/m' into requests per second."""
+    t = text.strip().lower()
+    per = 1.0
+    if "/" in t:
+        t, unit = t.split("/", 1)
+        units = {"s": 1.0, "sec": 1.0, "m": 60.0, "min": 60.0, "h": 3600.0}
+        if unit not in units:
+            raise argparse.ArgumentTypeError(f"unknown rate unit: {unit!r}")
+        per = units[unit]
+    try:
+        rate = float(t) / per
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid rate: {text!r}")
+    if rate <= 0:
+        raise argparse.ArgumentTypeError("rate must be > 0")
+    return rate
 
-    rs = sorted(records, key=lambda r: r.t_wall_end)
-    t_start = int(rs[0].t_wall_end)
-    t_end = int(rs[-1].t_wall_end)
 
-    buckets: Dict[int, Dict[str, int]] = {}
-    for t in range(t_start, t_end + 1):
-        buckets[t] = {
-            "total": 0, "read": 0, "write": 0,
-            "ok_total": 0, "ok_read": 0, "ok_write": 0,
-        }
+def arrival_offsets(n: int, rate: float, arrivals: str, rng: random.Random):
+    """Yield n send offsets (seconds from start) for the given arrival process."""
+    t = 0.0
+    for _ in range(n):
+        yield t
+        if arrivals == "poisson":
+            t += rng.expovariate(rate)
+        else:
+            t += 1.0 / rate
+
+
+async def read_http_response(reader: asyncio.StreamReader) -> Tuple[int, str, bool, Dict[str, str]]:
+    """Read one HTTP/1.1 response. Returns (status, body, keep_alive, lower-cased headers)."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed by server")
+    parts = status_line.split(None, 2)
+    code = int(parts[1])
+
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        k, _, v = line.decode("latin-1").partition(":")
+        headers[k.strip().lower()] = v.strip()
+
+    keep_alive = headers.get("connection", "").lower() != "close"
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks: List[bytes] = []
+        while True:
+            size = int((await reader.readline()).split(b";", 1)[0], 16)
+            if size == 0:
+                await reader.readline()
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        raw = b"".join(chunks)
+    elif "content-length" in headers:
+        raw = await reader.readexactly(int(headers["content-length"]))
+    else:
+        raw = await reader.read()
+        keep_alive = False
+    return code, raw.decode("utf-8", errors="replace"), keep_alive, headers
+
+
+class AsyncHttpClient:
+    """
+    Minimal asyncio HTTP/1.1 client for the Gateway (plain http only).
+
+    Keeps up to max_conns keep-alive connections; requests beyond that wait
+    for a free connection (the wait counts towards their latency). With
+    keep_alive=False every request opens and closes its own connection.
+    """
+
+    def __init__(self, url: str, api_key: str, timeout_s: float, max_conns: int, keep_alive: bool = True) -> None:
+        u = urllib.parse.urlsplit(url)
+        if u.scheme != "http":
+            raise ValueError(f"only http:// gateway URLs are supported in open-loop mode: {url}")
+        self.host = u.hostname or "127.0.0.1"
+        self.port = u.port or 80
+        self.timeout_s = timeout_s
+        self.keep_alive = keep_alive
+        self._sem = asyncio.Semaphore(max_conns)
+        self._idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        path = (u.path or "/") + (f"?{u.query}" if u.query else "")
+        self._head = (
+            f"POST {path} HTTP/1.1\r\n"
+            f"Host: {u.netloc}\r\n"
+            "Content-Type: application/json\r\n"
+            f"X-API-Key: {api_key}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        ).encode("latin-1")
+
+    def encode(self, payload: Dict[str, Any]) -> bytes:
+        """Pre-encode a full POST request (headers + JSON body)."""
+        return self.frame(json.dumps(payload).encode("utf-8"))
+
+    def frame(self, body: bytes) -> bytes:
+        """Full POST request (headers + already-encoded JSON body)."""
+        return self._head + b"Content-Length: %d\r\n\r\n" % len(body) + body
+
+    async def post(self, raw_request: bytes) -> Tuple[int, str, str]:
+        """Send one framed request. Returns (status, body, Server-Timing header or "")."""
+        async with self._sem:
+            conn = self._idle.pop() if self._idle else None
+            try:
+                if conn is None:
+                    conn = await asyncio.wait_for(
+                        asyncio.open_connection(self.host, self.port), self.timeout_s
+                    )
+                reader, writer = conn
+                writer.write(raw_request)
+                code, body, keep_alive, headers = await asyncio.wait_for(read_http_response(reader), self.timeout_s)
+            except Exception as e:
+                if conn is not None:
+                    conn[1].close()
+                return 0, str(e) or type(e).__name__, ""
+            if keep_alive and self.keep_alive:
+                self._idle.append(conn)
+            else:
+                conn[1].close()
+            return code, body, headers.get("server-timing", "")
+
+    async def close(self) -> None:
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+
+async def _open_loop(
+    endpoint: str,
+    api_key: str,
+    kinds: List[str],
+    source: RequestSource,
+    timeout_s: float,
+    rate: float,
+    arrivals: str,
+    max_conns: int,
+    rng: random.Random,
+    out: RecordOut,
+    stats: StatsRecorder,
+    transport: str,
+) -> None:
+    client = AsyncHttpClient(endpoint, api_key, timeout_s, max_conns, keep_alive=(transport == "pooled"))
+    framed: Dict[str, Tuple[str, bytes]] = {}
+    if source.fixed:
+        for k in ("read", "write"):
+            name, body = source.next_body(k, rng)
+            framed[k] = (name, client.frame(body))
+    phase = "open_loop"
+    pending = set()
+
+    async def one(kind: str, t_sched: float) -> None:
+        if source.fixed:
+            template, raw = framed[kind]
+        else:
+            template, body = source.next_body(kind, rng)
+            raw = client.frame(body)
+        code, body, timing = await client.post(raw)
+        # Latency from the scheduled send time, not from when we got to send it.
+        rec = make_record(phase, kind, code, body, (time.perf_counter() - t_sched) * 1000.0, template, timing)
+        stats.record_request(rec)
+        out.append(rec)
+
+    t0 = time.perf_counter()
+    for kind, offset in zip(kinds, arrival_offsets(len(kinds), rate, arrivals, rng)):
+        t_sched = t0 + offset
+        delay = t_sched - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.create_task(one(kind, t_sched))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+    if pending:
+        await asyncio.gather(*pending)
+    await client.close()
+
+
+def run_open_loop(
+    endpoint: str,
+    api_key: str,
+    n_reads: int,
+    n_writes: int,
+    read_sql: str,
+    write_sql: str,
+    timeout_s: float,
+    rate: float,
+    arrivals: str = "poisson",
+    max_conns: int = 1000,
+    seed: Optional[int] = None,
+    transport: str = "pooled",
+    records: Optional[RecordOut] = None,
+    live_stats: Optional[List[StatsRecorder]] = None,
+    bucket_ms: int = 1000,
+    workload: Optional[Dict[str, Any]] = None,
+) -> Tuple[RecordOut, StatsRecorder, float]:
+    """
+    Open-loop load: n_reads + n_writes requests (randomly interleaved) sent at
+    `rate` req/s total, independently of response times.
+    """
+    rng = random.Random(seed)
+    kinds = ["read"] * n_reads + ["write"] * n_writes
+    rng.shuffle(kinds)
+
+    if records is None:
+        records = []
+    stats = StatsRecorder(bucket_ms)
+    if live_stats is not None:
+        live_stats.append(stats)
+    t0 = time.time()
+    asyncio.run(_open_loop(
+        endpoint, api_key, kinds, make_source(read_sql, write_sql, workload), timeout_s,
+        rate, arrivals, max_conns, rng, records, stats, transport,
+    ))
+    t1 = time.time()
+    return records, stats, max(1e-9, t1 - t0)
+
+
+# ------------------------
+# Load spec (one run, possibly split across processes)
+# ------------------------
+
+@dataclass
+class LoadSpec:
+    """What one load-generating process should send. Travels as a plain dict."""
+    mode: str            # "closed" or "open"
+    endpoint: str
+    api_key: str
+    n_reads: int
+    n_writes: int
+    read_sql: str
+    write_sql: str
+    timeout_s: float
+    transport: str
+    rate: Optional[float] = None
+    arrivals: str = "poisson"
+    max_conns: int = 1000
+    seed: Optional[int] = None
+    bucket_ms: int = 1000
+    workload: Optional[Dict[str, Any]] = None   # parsed workload file, if any
+
+    @property
+    def phase(self) -> str:
+        return "open_loop" if self.mode == "open" else "parallel_rw"
+
+    def split(self, n: int) -> List["LoadSpec"]:
+        """Divide request counts, arrival rate and connections over n processes."""
+        parts: List[LoadSpec] = []
+        for i in range(n):
+            d = asdict(self)
+            d["n_reads"] = self.n_reads // n + (1 if i < self.n_reads % n else 0)
+            d["n_writes"] = self.n_writes // n + (1 if i < self.n_writes % n else 0)
+            if self.rate is not None:
+                d["rate"] = self.rate / n
+            d["max_conns"] = max(1, -(-self.max_conns // n))
+            if self.seed is not None:
+                d["seed"] = self.seed + i
+            parts.append(LoadSpec(**d))
+        return parts
+
+
+def run_load(
+    spec: LoadSpec,
+    records: Optional[RecordOut] = None,
+    live_stats: Optional[List[StatsRecorder]] = None,
+) -> Tuple[RecordOut, StatsRecorder, float]:
+    common = dict(
+        endpoint=spec.endpoint,
+        api_key=spec.api_key,
+        n_reads=spec.n_reads,
+        n_writes=spec.n_writes,
+        read_sql=spec.read_sql,
+        write_sql=spec.write_sql,
+        timeout_s=spec.timeout_s,
+        transport=spec.transport,
+        records=records,
+        live_stats=live_stats,
+        bucket_ms=spec.bucket_ms,
+        workload=spec.workload,
+        seed=spec.seed,
+    )
+    if spec.mode == "open":
+        return run_open_loop(
+            rate=spec.rate,
+            arrivals=spec.arrivals,
+            max_conns=spec.max_conns,
+            **common,
+        )
+    # One run: READ stream and WRITE stream in parallel
+    return run_parallel_reads_writes(**common)
+
+
+# ------------------------
+# Multi-process / multi-host load generation
+# ------------------------
+#
+# Coordinator (bench.py --procs N [--remote-workers K]) listens on --listen,
+# spawns N local worker processes and waits for K more started on other hosts
+# with `bench.py worker --coordinator HOST:PORT`. Once everyone has said hello
+# it broadcasts a start time (shared barrier). Workers stream finished 1-second
+# buckets (counters + histograms) and raw records back while running; the
+# coordinator merges them into the usual outputs.
+
+STREAM_INTERVAL_S = 1.0
+
+
+def _send_progress(
+    conn,
+    live_stats: List[StatsRecorder],
+    records: List[RequestRecord],
+    before_t: Optional[float],
+    with_raw: bool,
+    bucket_ms: int,
+) -> None:
+    delta = StatsRecorder(bucket_ms)
+    for st in list(live_stats):
+        delta.merge(st.drain(before_t))
+    n = len(records)
+    batch = [astuple(r) for r in records[:n]] if with_raw else []
+    del records[:n]
+    if delta.buckets or batch:
+        conn.send(("stats", delta.to_dict(), batch))
+
+
+def run_worker(address: Tuple[str, int], authkey: bytes) -> None:
+    """Worker process: wait for the start barrier, run its share, stream results."""
+    conn = mp_connection.Client(address, authkey=authkey)
+    try:
+        conn.send(("hello", socket.gethostname(), os.getpid()))
+        _, spec_dict, start_at, with_raw = conn.recv()
+        spec = LoadSpec(**spec_dict)
+
+        delay = start_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+        records: List[RequestRecord] = []
+        live_stats: List[StatsRecorder] = []
+        result: Dict[str, float] = {}
+
+        def target() -> None:
+            _, _, dur = run_load(spec, records, live_stats)
+            result["duration_s"] = dur
+
+        th = threading.Thread(target=target, daemon=True)
+        th.start()
+        while th.is_alive():
+            th.join(STREAM_INTERVAL_S)
+            # Only ship buckets that are well over; the current one may still grow.
+            _send_progress(conn, live_stats, records, time.time() - 1.0, with_raw, spec.bucket_ms)
+        _send_progress(conn, live_stats, records, None, with_raw, spec.bucket_ms)
+        conn.send(("done", result.get("duration_s", 0.0)))
+    finally:
+        conn.close()
+
+
+def parse_hostport(text: str) -> Tuple[str, int]:
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def run_distributed(
+    spec: LoadSpec,
+    procs: int,
+    remote_workers: int = 0,
+    listen: str = "127.0.0.1:0",
+    authkey: bytes = b"bench",
+    records: Optional[RecordOut] = None,
+) -> Tuple[RecordOut, StatsRecorder, float]:
+    listener = mp_connection.Listener(parse_hostport(listen), authkey=authkey)
+    host, port = listener.address
+    n_workers = procs + remote_workers
+
+    ctx = multiprocessing.get_context("spawn")
+    local = [
+        ctx.Process(target=run_worker, args=(("127.0.0.1", port), authkey), daemon=True)
+        for _ in range(procs)
+    ]
+    for p in local:
+        p.start()
+
+    if remote_workers:
+        print(f"  waiting for {remote_workers} remote worker(s): bench.py worker --coordinator <THIS_HOST>:{port}")
+
+    conns = []
+    try:
+        while len(conns) < n_workers:
+            c = listener.accept()
+            _, hostname, pid = c.recv()
+            conns.append(c)
+            print(f"  worker {len(conns)}/{n_workers} ready ({hostname} pid={pid})")
+    finally:
+        listener.close()
+
+    if records is None:
+        records = []
+    with_raw = type(records) is not RecordSink
+
+    start_at = time.time() + 1.0
+    for c, part in zip(conns, spec.split(n_workers)):
+        c.send(("start", asdict(part), start_at, with_raw))
+
+    stats = StatsRecorder(spec.bucket_ms)
+    pending = list(conns)
+    while pending:
+        for c in mp_connection.wait(pending):
+            try:
+                msg = c.recv()
+            except EOFError:
+                print("WARNING: a worker disconnected before finishing.")
+                pending.remove(c)
+                continue
+            if msg[0] == "stats":
+                stats.merge(StatsRecorder.from_dict(msg[1]))
+                for t in msg[2]:
+                    records.append(RequestRecord(*t))
+            elif msg[0] == "done":
+                pending.remove(c)
+                c.close()
+    t_end = time.time()
+
+    for p in local:
+        p.join(timeout=5)
+    return records, stats, max(1e-9, t_end - start_at)
+
+
+def worker_main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(prog="bench.py worker", description="Remote load-generating worker")
+    ap.add_argument("--coordinator", required=True, help="HOST:PORT printed by the coordinator")
+    ap.add_argument("--authkey", default="bench", help="Shared secret (must match the coordinator)")
+    args = ap.parse_args(argv)
+    run_worker(parse_hostport(args.coordinator), args.authkey.encode("utf-8"))
+    return 0
+
+
+# ------------------------
+# Concurrency sweep (saturation knee finder)
+# ------------------------
+
+DEFAULT_SWEEP_STEPS = "1,2,4,8,16,32,64,128,256,512"
+
+
+async def _sweep_measure(
+    endpoint: str,
+    api_key: str,
+    source: RequestSource,
+    read_ratio: float,
+    concurrency: int,
+    warmup_s: float,
+    hold_s: float,
+    timeout_s: float,
+    transport: str,
+    rng: random.Random,
+) -> Tuple[LatencyHistogram, Dict[str, int]]:
+    """Closed loop at `concurrency` for warmup_s + hold_s; returns (latency histogram, sent/ok) for the hold."""
+    client = AsyncHttpClient(endpoint, api_key, timeout_s, concurrency, keep_alive=(transport == "pooled"))
+    framed = {k: client.frame(source.next_body(k, rng)[1]) for k in ("read", "write")} if source.fixed else {}
+    hist = LatencyHistogram()
+    counts = {"sent": 0, "ok": 0}
+
+    t_measure = time.perf_counter() + warmup_s
+    t_stop = t_measure + hold_s
+
+    async def worker() -> None:
+        # Closed loop: each worker keeps exactly one request in flight.
+        while time.perf_counter() < t_stop:
+            kind = "read" if rng.random() < read_ratio else "write"
+            raw = framed[kind] if source.fixed else client.frame(source.next_body(kind, rng)[1])
+            t0 = time.perf_counter()
+            code, _, _ = await client.post(raw)
+            t1 = time.perf_counter()
+            if t_measure <= t1 < t_stop:
+                counts["sent"] += 1
+                if code == 200:
+                    counts["ok"] += 1
+                    hist.record((t1 - t0) * 1000.0)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    await client.close()
+    return hist, counts
+
+
+def sweep_row(concurrency: int, hold_s: float, hist: LatencyHistogram, counts: Dict[str, int]) -> Dict[str, Any]:
+    def fmt(v: Optional[float]) -> str:
+        return "" if v is None else f"{v:.3f}"
+
+    p50, p95, p99 = hist.percentiles([50.0, 95.0, 99.0])
+
+    return {
+        "concurrency": concurrency,
+        "hold_s": f"{hold_s:.3f}",
+        "sent": counts["sent"],
+        "ok": counts["ok"],
+        "errors": counts["sent"] - counts["ok"],
+        "tps_ok": f"{counts['ok'] / hold_s:.3f}",
+        "mean_ms": fmt(hist.mean_ms()),
+        "p50_ms": fmt(p50),
+        "p95_ms": fmt(p95),
+        "p99_ms": fmt(p99),
+    }
+
+
+def print_sweep_row(row: Dict[str, Any]) -> None:
+    print(f"  c={row['concurrency']:<4} tps_ok={row['tps_ok']:>10} p50={row['p50_ms']:>8} "
+          f"p95={row['p95_ms']:>8} p99={row['p99_ms']:>8} errors={row['errors']}")
 
-    for r in rs:
-        b = int(r.t_wall_end)
-        if b not in buckets:
-            buckets[b] = {"total": 0, "read": 0, "write": 0, "ok_total": 0, "ok_read": 0, "ok_write": 0}
-        buckets[b]["total"] += 1
-        buckets[b][r.kind] += 1
-        buckets[b]["ok_total"] += r.ok
-        buckets[b]["ok_" + r.kind] += r.ok
 
+def run_sweep(
+    endpoint: str,
+    api_key: str,
+    read_sql: str,
+    write_sql: str,
+    read_ratio: float,
+    steps: List[int],
+    warmup_s: float,
+    hold_s: float,
+    timeout_s: float,
+    transport: str = "pooled",
+    seed: Optional[int] = None,
+    workload: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """Closed-loop load at each concurrency in `steps`; one row per step."""
+    rng = random.Random(seed)
+    source = make_source(read_sql, write_sql, workload)
     rows: List[Dict[str, Any]] = []
-    for b in sorted(buckets.keys()):
-        c = buckets[b]
-        rows.append({
-            "iso": iso_utc(float(b)),
-            "t_sec": b,
-            "total_tps": c["total"],
-            "read_tps": c["read"],
-            "write_tps": c["write"],
-            "total_count": c["total"],
-            "read_count": c["read"],
-            "write_count": c["write"],
-            "ok_total": c["ok_total"],
-            "ok_read": c["ok_read"],
-            "ok_write": c["ok_write"],
-        })
+    for c in steps:
+        hist, counts = asyncio.run(_sweep_measure(
+            endpoint, api_key, source, read_ratio,
+            c, warmup_s, hold_s, timeout_s, transport, rng,
+        ))
+        row = sweep_row(c, hold_s, hist, counts)
+        rows.append(row)
+        print_sweep_row(row)
     return rows
 
 
-def compute_latency_timeseries(records: List[RequestRecord]) -> List[Dict[str, Any]]:
+def detect_knee(rows: List[Dict[str, Any]], plateau_gain: float = 0.10, p99_jump: float = 1.5) -> Optional[int]:
     """
-    1-second buckets, per kind, computed over successful requests (HTTP 200) only.
+    Index of the saturation point: the last step before throughput stops
+    growing (gain < plateau_gain) while p99 jumps by more than p99_jump x.
+    Returns None if the sweep never reached it.
     """
-    if not records:
-        return []
+    for i in range(1, len(rows)):
+        prev, cur = rows[i - 1], rows[i]
+        if not prev["p99_ms"] or not cur["p99_ms"]:
+            continue
+        tps_prev, tps_cur = float(prev["tps_ok"]), float(cur["tps_ok"])
+        gain = (tps_cur - tps_prev) / tps_prev if tps_prev > 0 else 0.0
+        if gain < plateau_gain and float(cur["p99_ms"]) > p99_jump * float(prev["p99_ms"]):
+            return i - 1
+    return None
 
-    rs = sorted(records, key=lambda r: r.t_wall_end)
-    t_start = int(rs[0].t_wall_end)
-    t_end = int(rs[-1].t_wall_end)
 
-    buckets: Dict[int, Dict[str, List[float]]] = {}
-    for t in range(t_start, t_end + 1):
-        buckets[t] = {"read": [], "write": []}
+# ------------------------
+# Aggregations (Graph A + Graph B) + Summary
+# ------------------------
 
-    for r in rs:
-        if r.ok != 1:
-            continue
-        b = int(r.t_wall_end)
-        if b not in buckets:
-            buckets[b] = {"read": [], "write": []}
-        buckets[b][r.kind].append(r.lat_ms)
-
-    def stats(prefix: str, vals: List[float]) -> Dict[str, Any]:
-        if not vals:
-            return {
-                f"{prefix}_count": 0,
-                f"{prefix}_mean_ms": "",
-                f"{prefix}_p50_ms": "",
-                f"{prefix}_p95_ms": "",
-                f"{prefix}_p99_ms": "",
-                f"{prefix}_max_ms": "",
-            }
-        mean = sum(vals) / len(vals)
-        p50 = percentile(vals, 50.0)
-        p95 = percentile(vals, 95.0)
-        p99 = percentile(vals, 99.0)
-        mx = max(vals)
+def bucket_time(b: int, bucket_ms: int) -> Dict[str, Any]:
+    """iso/t_sec columns for bucket b (t_sec stays an integer for 1 s buckets)."""
+    if bucket_ms == 1000:
+        return {"iso": iso_utc(float(b)), "t_sec": b}
+    t = b * bucket_ms / 1000.0
+    return {"iso": iso_utc(t), "t_sec": f"{t:.3f}"}
+
+
+def tps_row(b: int, bucket_ms: int, counts: Dict[str, int]) -> Dict[str, Any]:
+    """
+    One tps_timeseries row. counts: read/write/ok_read/ok_write for the bucket.
+    *_tps columns are per second, so they differ from *_count for sub-second buckets.
+    """
+    total = counts["read"] + counts["write"]
+
+    def rate(n: int) -> Any:
+        return n if bucket_ms == 1000 else f"{n * 1000.0 / bucket_ms:.3f}"
+
+    return {
+        **bucket_time(b, bucket_ms),
+        "total_tps": rate(total),
+        "read_tps": rate(counts["read"]),
+        "write_tps": rate(counts["write"]),
+        "total_count": total,
+        "read_count": counts["read"],
+        "write_count": counts["write"],
+        "ok_total": counts["ok_read"] + counts["ok_write"],
+        "ok_read": counts["ok_read"],
+        "ok_write": counts["ok_write"],
+    }
+
+
+def compute_tps_timeseries(stats: StatsRecorder) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    for b in stats.bucket_range():
+        per_kind = stats.buckets.get(b)
+        r = per_kind["read"] if per_kind else KindStats()
+        w = per_kind["write"] if per_kind else KindStats()
+        rows.append(tps_row(b, stats.bucket_ms, {
+            "read": r.sent, "write": w.sent, "ok_read": r.ok, "ok_write": w.ok,
+        }))
+    return rows
+
+
+def latency_cols(
+    prefix: str,
+    count: int,
+    mean: Optional[float] = None,
+    p50: Optional[float] = None,
+    p95: Optional[float] = None,
+    p99: Optional[float] = None,
+    mx: Optional[float] = None,
+) -> Dict[str, Any]:
+    if not count:
         return {
-            f"{prefix}_count": len(vals),
-            f"{prefix}_mean_ms": f"{mean:.3f}",
-            f"{prefix}_p50_ms": f"{(p50 if p50 is not None else 0.0):.3f}",
-            f"{prefix}_p95_ms": f"{(p95 if p95 is not None else 0.0):.3f}",
-            f"{prefix}_p99_ms": f"{(p99 if p99 is not None else 0.0):.3f}",
-            f"{prefix}_max_ms": f"{mx:.3f}",
+            f"{prefix}_count": 0,
+            f"{prefix}_mean_ms": "",
+            f"{prefix}_p50_ms": "",
+            f"{prefix}_p95_ms": "",
+            f"{prefix}_p99_ms": "",
+            f"{prefix}_max_ms": "",
         }
+    return {
+        f"{prefix}_count": count,
+        f"{prefix}_mean_ms": f"{mean:.3f}",
+        f"{prefix}_p50_ms": f"{p50:.3f}",
+        f"{prefix}_p95_ms": f"{p95:.3f}",
+        f"{prefix}_p99_ms": f"{p99:.3f}",
+        f"{prefix}_max_ms": f"{mx:.3f}",
+    }
+
+
+def latency_stats(prefix: str, hist: LatencyHistogram) -> Dict[str, Any]:
+    if not hist.count:
+        return latency_cols(prefix, 0)
+    p50, p95, p99 = hist.percentiles([50.0, 95.0, 99.0])
+    return latency_cols(prefix, hist.count, hist.mean_ms(), p50, p95, p99, hist.max_ms)
+
 
+def server_cols(prefix: str, timed: int, server_ms: float = 0.0, db_ms: float = 0.0) -> Dict[str, Any]:
+    """
+    Mean Gateway time (Server-Timing total) and proxy/database time (execute +
+    fetch) over the successful requests that reported them. Client mean minus
+    server mean is network + client overhead; server minus db is the Gateway's own cost.
+    """
+    if not timed:
+        return {f"{prefix}_server_mean_ms": "", f"{prefix}_db_mean_ms": ""}
+    return {
+        f"{prefix}_server_mean_ms": f"{server_ms / timed:.3f}",
+        f"{prefix}_db_mean_ms": f"{db_ms / timed:.3f}",
+    }
+
+
+def compute_latency_timeseries(stats: StatsRecorder) -> List[Dict[str, Any]]:
+    """
+    Per-bucket, per-kind latency computed over successful requests (HTTP 200) only.
+    """
+    empty = KindStats()
     rows: List[Dict[str, Any]] = []
-    for b in sorted(buckets.keys()):
-        row = {
-            "iso": iso_utc(float(b)),
-            "t_sec": b,
-            **stats("read", buckets[b]["read"]),
-            **stats("write", buckets[b]["write"]),
-        }
+    for b in stats.bucket_range():
+        per_kind = stats.buckets.get(b)
+        row = bucket_time(b, stats.bucket_ms)
+        for k in StatsRecorder.KINDS:
+            st = per_kind[k] if per_kind else empty
+            row.update(latency_stats(k, st.hist))
+            row.update(server_cols(k, st.timed, st.server_ms, st.db_ms))
         rows.append(row)
-
     return rows
 
 
-def compute_summary(records: List[RequestRecord], duration_s: float, strategy: str) -> Dict[str, Any]:
-    total = len(records)
-    reads = sum(1 for r in records if r.kind == "read")
-    writes = total - reads
-    ok_total = sum(r.ok for r in records)
-    ok_reads = sum(r.ok for r in records if r.kind == "read")
-    ok_writes = ok_total - ok_reads
+def compute_summary(
+    stats: StatsRecorder,
+    duration_s: float,
+    strategy: str,
+    phase: str = "parallel_rw",
+) -> Dict[str, Any]:
+    t = stats.totals()
+    reads = t["read"].sent
+    writes = t["write"].sent
+    total = reads + writes
+    ok_reads = t["read"].ok
+    ok_writes = t["write"].ok
+    ok_total = ok_reads + ok_writes
 
     return {
         "strategy": strategy,
-        "phase": "parallel_rw",
+        "phase": phase,
         "duration_s": f"{duration_s:.3f}",
         "total_sent": total,
         "read_sent": reads,
@@ -343,21 +1550,809 @@ def write_csv(path: str, rows: List[Dict[str, Any]]) -> None:
         w.writerows(rows)
 
 
-def write_raw_requests(path: str, records: List[RequestRecord], strategy: str) -> None:
+def compute_template_latency(stats: StatsRecorder, strategy: str) -> List[Dict[str, Any]]:
+    """Whole-run latency per workload template (HTTP 200 only)."""
     rows: List[Dict[str, Any]] = []
-    for r in records:
+    for name in sorted(stats.templates):
+        st = stats.templates[name]
         rows.append({
             "strategy": strategy,
-            "phase": r.phase,
-            "iso_end": r.iso_end,
-            "t_end": f"{r.t_wall_end:.6f}",
-            "kind": r.kind,
-            "ok": r.ok,
-            "http_code": r.http_code,
-            "lat_ms": f"{r.lat_ms:.3f}",
-            "target": r.target,
+            "template": name,
+            "kind": stats.template_kinds[name],
+            "sent": st.sent,
+            "ok": st.ok,
+            **{k.replace("lat_", ""): v for k, v in latency_stats("lat", st.hist).items() if k != "lat_count"},
         })
+    return rows
+
+
+def write_histograms(path: str, stats: StatsRecorder, strategy: str) -> None:
+    """Whole-run latency histograms per kind (mergeable, used for run comparison)."""
+    totals = stats.totals()
+    doc = {
+        "strategy": strategy,
+        "kinds": {k: totals[k].hist.to_dict() for k in StatsRecorder.KINDS},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(doc, f)
+
+
+# ------------------------
+# Streaming raw record sink
+# ------------------------
+
+RAW_SERVER_FIELDS = [f"srv_{stage}_ms" for stage in SERVER_TIMING_STAGES]
+RAW_CSV_FIELDS = [
+    "strategy", "phase", "iso_end", "t_end", "kind", "ok", "http_code", "lat_ms", "target", "template",
+] + RAW_SERVER_FIELDS
+
+# raw_requests.bin: a magic line followed by self-contained column blocks:
+#   b"BLK1" <u32 n> <u32 len> <len bytes: JSON list of strings new to the table>
+#   float64 t_end[n]  float64 lat_ms[n]  int16 http_code[n]
+#   uint8 kind[n] (0=read, 1=write)  uint16 phase[n]  uint16 target[n]  uint16 template[n]
+#   float32 srv_<stage>_ms[n] for each SERVER_TIMING_STAGES entry (NaN = not reported)
+# phase/target/template index a string table that grows block by block.
+RAW_BIN_MAGIC = b"BENCHRAW2\n"
+RAW_BIN_MAGIC_V1 = b"BENCHRAW1\n"  # same layout without the srv_* columns
+RAW_BIN_BLOCK = b"BLK1"
+RAW_KIND_CODES = {"read": 0, "write": 1}
+# (column, array typecode, numpy dtype) in on-disk order
+RAW_BIN_COLUMNS = [
+    ("t_end", "d", "<f8"),
+    ("lat_ms", "d", "<f8"),
+    ("http_code", "h", "<i2"),
+    ("kind", "B", "u1"),
+    ("phase", "H", "<u2"),
+    ("target", "H", "<u2"),
+    ("template", "H", "<u2"),
+] + [(name, "f", "<f4") for name in RAW_SERVER_FIELDS]
+
+
+class RecordSink:
+    """Discards records (used with --no-raw)."""
+
+    written = 0
+
+    def append(self, rec: RequestRecord) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class RawRecordSink(RecordSink):
+    """
+    Thread-safe raw record sink with bounded memory.
+
+    Producers append records to a small buffer; a background thread writes
+    them in batches (every batch_size records or flush_interval_s seconds) to
+    raw_requests.csv or the columnar raw_requests.bin. If the writer falls
+    behind by max_pending records, append() blocks until it catches up.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        strategy: str,
+        fmt: str = "csv",
+        batch_size: int = 10_000,
+        flush_interval_s: float = 1.0,
+        max_pending: int = 200_000,
+    ) -> None:
+        if fmt not in ("csv", "bin"):
+            raise ValueError(f"Unknown raw format: {fmt}")
+        self.path = path
+        self.strategy = strategy
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.max_pending = max_pending
+        self.written = 0
+
+        self._buf: List[RequestRecord] = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._strings: Dict[str, int] = {}
+        self._iso_sec = -1
+        self._iso_prefix = ""
+
+        if fmt == "csv":
+            self._f = open(path, "w", newline="")
+            self._csv = csv.writer(self._f)
+            self._csv.writerow(RAW_CSV_FIELDS)
+        else:
+            self._f = open(path, "wb")
+            self._f.write(RAW_BIN_MAGIC)
+
+        self._thread = threading.Thread(target=self._run, name="raw-sink", daemon=True)
+        self._thread.start()
+
+    def append(self, rec: RequestRecord) -> None:
+        with self._cond:
+            while len(self._buf) >= self.max_pending and not self._closed:
+                self._cond.wait()
+            self._buf.append(rec)
+            if len(self._buf) >= self.batch_size:
+                self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._f.close()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: len(self._buf) >= self.batch_size or self._closed,
+                    timeout=self.flush_interval_s,
+                )
+                batch, self._buf = self._buf, []
+                closed = self._closed
+                self._cond.notify_all()
+            if batch:
+                if self.fmt == "csv":
+                    self._write_csv(batch)
+                else:
+                    self._write_bin(batch)
+                self.written += len(batch)
+                self._f.flush()
+            elif closed:
+                return
+
+    def _iso(self, t: float) -> str:
+        # Records arrive roughly in time order: format the seconds part once.
+        sec = int(t)
+        if sec != self._iso_sec:
+            self._iso_sec = sec
+            self._iso_prefix = datetime.fromtimestamp(sec, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+        return f"{self._iso_prefix}.{int((t - sec) * 1e6):06d}+00:00"
+
+    def _write_csv(self, batch: List[RequestRecord]) -> None:
+        strategy = self.strategy
+        no_timing = [""] * len(SERVER_TIMING_STAGES)
+        self._csv.writerows(
+            [strategy, r.phase, self._iso(r.t_wall_end), f"{r.t_wall_end:.6f}", r.kind,
+             r.ok, r.http_code, f"{r.lat_ms:.3f}", r.target, r.template]
+            + (no_timing if r.server_timing is None else
+               ["" if math.isnan(v) else f"{v:.3f}" for v in r.server_timing])
+            for r in batch
+        )
+
+    def _string_id(self, value: str, new: List[str]) -> int:
+        idx = self._strings.get(value)
+        if idx is None:
+            idx = self._strings[value] = len(self._strings)
+            new.append(value)
+        return idx
+
+    def _write_bin(self, batch: List[RequestRecord]) -> None:
+        new: List[str] = []
+        values = {
+            "t_end": (r.t_wall_end for r in batch),
+            "lat_ms": (r.lat_ms for r in batch),
+            "http_code": (r.http_code for r in batch),
+            "kind": (RAW_KIND_CODES[r.kind] for r in batch),
+            "phase": [self._string_id(r.phase, new) for r in batch],
+            "target": [self._string_id(r.target, new) for r in batch],
+            "template": [self._string_id(r.template, new) for r in batch],
+        }
+        nan = float("nan")
+        for i, name in enumerate(RAW_SERVER_FIELDS):
+            values[name] = [nan if r.server_timing is None else r.server_timing[i] for r in batch]
+        table = json.dumps(new).encode("utf-8")
+        self._f.write(RAW_BIN_BLOCK + struct.pack("<II", len(batch), len(table)) + table)
+        for name, typecode, _ in RAW_BIN_COLUMNS:
+            col = array(typecode, values[name])
+            if sys.byteorder != "little":
+                col.byteswap()
+            self._f.write(col.tobytes())
+
+
+# ------------------------
+# Vectorised (NumPy) aggregation over raw records
+# ------------------------
+
+def require_numpy() -> None:
+    if np is None:
+        raise RuntimeError("numpy is required for this aggregation path (pip3 install numpy)")
+
+
+def read_raw_columns(path: str) -> Dict[str, Any]:
+    """
+    Load raw_requests.bin or raw_requests.csv into NumPy columns:
+    t_end (float64), lat_ms (float64), http_code (int16), kind (uint8, 0=read 1=write),
+    srv_<stage>_ms (float32, NaN when the Gateway did not report it).
+    """
+    require_numpy()
+    if path.endswith(".bin"):
+        with open(path, "rb") as f:
+            data = f.read()
+        if data.startswith(RAW_BIN_MAGIC):
+            layout = RAW_BIN_COLUMNS
+        elif data.startswith(RAW_BIN_MAGIC_V1):
+            layout = RAW_BIN_COLUMNS[:-len(RAW_SERVER_FIELDS)]
+        else:
+            raise ValueError(f"not a raw_requests.bin file: {path}")
+        parts: Dict[str, List[Any]] = {name: [] for name, _, _ in layout}
+        row_bytes = sum(np.dtype(dt).itemsize for _, _, dt in layout)
+        pos = len(RAW_BIN_MAGIC)
+        while pos + 12 <= len(data) and data[pos:pos + 4] == RAW_BIN_BLOCK:
+            n, table_len = struct.unpack_from("<II", data, pos + 4)
+            pos += 12 + table_len
+            if pos + n * row_bytes > len(data):
+                break  # truncated last block (run was killed mid-write)
+            for name, _, dt in layout:
+                col = np.frombuffer(data, dtype=dt, count=n, offset=pos)
+                parts[name].append(col)
+                pos += col.nbytes
+        cols = {
+            name: (np.concatenate(parts[name]) if parts[name] else np.empty(0, dtype=dt))
+            for name, _, dt in layout
+        }
+        for name in RAW_SERVER_FIELDS:
+            cols.setdefault(name, np.full(cols["t_end"].size, np.nan, np.float32))
+    else:
+        t_end, lat, code, kind = array("d"), array("d"), array("h"), array("B")
+        srv = {name: array("f") for name in RAW_SERVER_FIELDS}
+        with open(path, "r", newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            i_t, i_lat = header.index("t_end"), header.index("lat_ms")
+            i_code, i_kind = header.index("http_code"), header.index("kind")
+            i_srv = [(srv[name], header.index(name)) for name in RAW_SERVER_FIELDS if name in header]
+            nan = float("nan")
+            for row in reader:
+                t_end.append(float(row[i_t]))
+                lat.append(float(row[i_lat]))
+                code.append(int(row[i_code]))
+                kind.append(RAW_KIND_CODES[row[i_kind]])
+                for col, i in i_srv:
+                    col.append(float(row[i]) if row[i] else nan)
+        cols = {
+            "t_end": np.frombuffer(t_end, dtype=np.float64),
+            "lat_ms": np.frombuffer(lat, dtype=np.float64),
+            "http_code": np.frombuffer(code, dtype=np.int16),
+            "kind": np.frombuffer(kind, dtype=np.uint8),
+        }
+        for name, col in srv.items():
+            cols[name] = np.frombuffer(col, dtype=np.float32) if len(col) else np.full(len(t_end), np.nan, np.float32)
+    return cols
+
+
+def compute_timeseries_numpy(
+    cols: Dict[str, Any],
+    bucket_ms: int = 1000,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    tps_timeseries and latency_timeseries rows (same columns as the histogram
+    path) from column arrays. Percentiles are exact (nearest rank). Records
+    are bucketed with one integer division and sorted once per kind; only the
+    final per-bucket row formatting is a Python loop.
+    """
+    require_numpy()
+    if cols["t_end"].size == 0:
+        return [], []
+
+    bucket = (cols["t_end"] * 1000.0).astype(np.int64) // bucket_ms
+    b0 = int(bucket.min())
+    idx = bucket - b0
+    nb = int(idx.max()) + 1
+    ok = cols["http_code"] == 200
+    lat = cols["lat_ms"]
+
+    counts: Dict[str, Any] = {}
+    lat_cols: Dict[str, Dict[str, Any]] = {}
+    for kind_name, code in RAW_KIND_CODES.items():
+        is_kind = cols["kind"] == code
+        counts[kind_name] = np.bincount(idx[is_kind], minlength=nb)
+        sel = is_kind & ok
+        counts["ok_" + kind_name] = np.bincount(idx[sel], minlength=nb)
+
+        k_idx, k_lat = idx[sel], lat[sel]
+        order = np.lexsort((k_lat, k_idx))
+        s_lat = k_lat[order]
+        n = counts["ok_" + kind_name]
+        starts = np.concatenate(([0], np.cumsum(n)[:-1]))
+        has = n > 0
+        st = {"mean": np.zeros(nb)}
+        st["mean"][has] = np.bincount(k_idx, weights=k_lat, minlength=nb)[has] / n[has]
+        for name, p in (("p50", 50.0), ("p95", 95.0), ("p99", 99.0), ("max", 100.0)):
+            rank = np.maximum(1, np.ceil(p / 100.0 * n).astype(np.int64)) - 1
+            vals = np.zeros(nb)
+            vals[has] = s_lat[(starts + rank)[has]]
+            st[name] = vals
+
+        srv_total = cols["srv_total_ms"][sel].astype(np.float64)
+        timed = ~np.isnan(srv_total)
+        db = sum(np.nan_to_num(cols[f"srv_{s}_ms"][sel].astype(np.float64)) for s in SERVER_TIMING_DB_STAGES)
+        st["timed"] = np.bincount(k_idx[timed], minlength=nb)
+        st["server"] = np.bincount(k_idx[timed], weights=srv_total[timed], minlength=nb)
+        st["db"] = np.bincount(k_idx[timed], weights=db[timed], minlength=nb)
+        lat_cols[kind_name] = st
+
+    tps_rows: List[Dict[str, Any]] = []
+    lat_rows: List[Dict[str, Any]] = []
+    for i in range(nb):
+        b = b0 + i
+        tps_rows.append(tps_row(b, bucket_ms, {k: int(v[i]) for k, v in counts.items()}))
+        row = bucket_time(b, bucket_ms)
+        for kind_name in RAW_KIND_CODES:
+            st = lat_cols[kind_name]
+            row.update(latency_cols(
+                kind_name, int(counts["ok_" + kind_name][i]),
+                st["mean"][i], st["p50"][i], st["p95"][i], st["p99"][i], st["max"][i],
+            ))
+            row.update(server_cols(kind_name, int(st["timed"][i]), st["server"][i], st["db"][i]))
+        lat_rows.append(row)
+    return tps_rows, lat_rows
+
+
+def find_raw_file(outdir: str) -> Optional[str]:
+    for name in ("raw_requests.bin", "raw_requests.csv"):
+        path = os.path.join(outdir, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def read_strategy_label(outdir: str) -> str:
+    path = os.path.join(outdir, "summary.csv")
+    if os.path.exists(path):
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                return row.get("strategy", "")
+    return ""
+
+
+def aggregate_main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(
+        prog="bench.py aggregate",
+        description="Recompute TPS/latency time series from a run's raw records with NumPy",
+    )
+    ap.add_argument("rundir", help="Directory holding raw_requests.bin or raw_requests.csv")
+    ap.add_argument("--bucket-ms", type=int, default=1000, help="Bucket width in ms (default 1000)")
+    ap.add_argument("--outdir", default=None, help="Where to write the CSVs (default: rundir)")
+    args = ap.parse_args(argv)
+
+    raw_path = find_raw_file(args.rundir)
+    if raw_path is None:
+        ap.error(f"no raw_requests.bin/.csv in {args.rundir}")
+    outdir = args.outdir or args.rundir
+    ensure_dir(outdir)
+
+    t0 = time.perf_counter()
+    cols = read_raw_columns(raw_path)
+    t1 = time.perf_counter()
+    tps_rows, lat_rows = compute_timeseries_numpy(cols, args.bucket_ms)
+    t2 = time.perf_counter()
+
+    strategy = read_strategy_label(args.rundir)
+    for r in tps_rows + lat_rows:
+        r["strategy"] = strategy
+    suffix = "" if args.bucket_ms == 1000 else f"_{args.bucket_ms}ms"
+    tps_path = os.path.join(outdir, f"tps_timeseries{suffix}.csv")
+    lat_path = os.path.join(outdir, f"latency_timeseries{suffix}.csv")
+    write_csv(tps_path, tps_rows)
+    write_csv(lat_path, lat_rows)
+
+    print(f"aggregated {cols['t_end'].size} records from {raw_path} "
+          f"(load {t1 - t0:.2f}s, aggregate {t2 - t1:.2f}s, bucket={args.bucket_ms}ms)")
+    print(f"  wrote: {tps_path}")
+    print(f"  wrote: {lat_path}")
+    return 0
+
+
+# ------------------------
+# Run comparison (bootstrap confidence intervals)
+# ------------------------
+
+COMPARE_PERCENTILES = (("p50", 50.0), ("p95", 95.0), ("p99", 99.0))
+
+
+def load_run_hists(rundir: str) -> Dict[str, LatencyHistogram]:
+    """Whole-run latency histogram per kind: latency_histograms.json, else rebuilt from raw records."""
+    path = os.path.join(rundir, "latency_histograms.json")
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            doc = json.load(f)
+        return {k: LatencyHistogram.from_dict(v) for k, v in doc["kinds"].items()}
+
+    raw_path = find_raw_file(rundir)
+    if raw_path is None:
+        raise FileNotFoundError(f"{rundir}: neither latency_histograms.json nor raw_requests.* found")
+    cols = read_raw_columns(raw_path)
+    hists = {k: LatencyHistogram() for k in RAW_KIND_CODES}
+    ok = cols["http_code"] == 200
+    for kind_name, code in RAW_KIND_CODES.items():
+        h = hists[kind_name]
+        for v in cols["lat_ms"][ok & (cols["kind"] == code)].tolist():
+            h.record(v)
+    return hists
+
+
+def load_run_tps(rundir: str) -> Any:
+    """Per-second successful throughput samples from tps_timeseries.csv (partial edge buckets dropped)."""
+    path = os.path.join(rundir, "tps_timeseries.csv")
+    t, ok = [], []
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            t.append(float(row["t_sec"]))
+            ok.append(float(row["ok_total"]))
+    width = (t[1] - t[0]) if len(t) > 1 else 1.0
+    samples = np.asarray(ok) / width
+    return samples[1:-1] if samples.size > 2 else samples
+
+
+def bootstrap_hist_stats(hist: LatencyHistogram, iterations: int, rng: Any) -> Dict[str, Any]:
+    """
+    Resample the run's latencies (multinomial over histogram buckets, same n)
+    `iterations` times; returns arrays of mean/p50/p95/p99 per resample.
+    """
+    idx = sorted(hist.counts)
+    vals = np.array([LatencyHistogram._value_ms(i) for i in idx])
+    counts = np.array([hist.counts[i] for i in idx], dtype=np.float64)
+    n = int(counts.sum())
+    draws = rng.multinomial(n, counts / n, size=iterations)
+    cum = np.cumsum(draws, axis=1)
+    out = {"mean": draws @ vals / n}
+    for name, p in COMPARE_PERCENTILES:
+        rank = max(1, int(np.ceil(p / 100.0 * n)))
+        out[name] = vals[np.minimum((cum < rank).sum(axis=1), len(vals) - 1)]
+    return out
+
+
+def point_hist_stats(hist: LatencyHistogram) -> Dict[str, float]:
+    ps = hist.percentiles([p for _, p in COMPARE_PERCENTILES])
+    out = {"mean": hist.mean_ms()}
+    out.update({name: v for (name, _), v in zip(COMPARE_PERCENTILES, ps)})
+    return out
+
+
+def compare_runs(
+    dir_a: str,
+    dir_b: str,
+    threshold_pct: float = 5.0,
+    iterations: int = 2000,
+    confidence: float = 0.95,
+    seed: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    B vs A, one row per metric. A change is significant when the bootstrap CI
+    of the relative difference excludes 0, and a regression when it is also
+    in the bad direction (lower TPS, higher latency) by more than threshold_pct.
+    """
+    require_numpy()
+    rng = np.random.default_rng(seed)
+    lo_q, hi_q = (1.0 - confidence) / 2.0, 1.0 - (1.0 - confidence) / 2.0
+    rows: List[Dict[str, Any]] = []
+
+    def add(metric: str, kind: str, a: float, b: float, rel: Any, higher_is_worse: bool) -> None:
+        lo, hi = (float(x) * 100.0 for x in np.quantile(rel, [lo_q, hi_q]))
+        delta = (b - a) / a * 100.0 if a else 0.0
+        significant = lo > 0.0 or hi < 0.0
+        worse = delta > threshold_pct if higher_is_worse else delta < -threshold_pct
+        rows.append({
+            "metric": metric,
+            "kind": kind,
+            "a": f"{a:.3f}",
+            "b": f"{b:.3f}",
+            "delta_pct": f"{delta:+.2f}",
+            "ci_lo_pct": f"{lo:+.2f}",
+            "ci_hi_pct": f"{hi:+.2f}",
+            "significant": int(significant),
+            "regression": int(significant and worse),
+        })
+
+    tps_a, tps_b = load_run_tps(dir_a), load_run_tps(dir_b)
+    if tps_a.size and tps_b.size:
+        ba = rng.choice(tps_a, size=(iterations, tps_a.size)).mean(axis=1)
+        bb = rng.choice(tps_b, size=(iterations, tps_b.size)).mean(axis=1)
+        add("tps_ok", "total", float(tps_a.mean()), float(tps_b.mean()), (bb - ba) / ba, False)
+
+    hists_a, hists_b = load_run_hists(dir_a), load_run_hists(dir_b)
+    for kind in StatsRecorder.KINDS:
+        ha, hb = hists_a.get(kind), hists_b.get(kind)
+        if ha is None or hb is None or not ha.count or not hb.count:
+            continue
+        pa, pb = point_hist_stats(ha), point_hist_stats(hb)
+        sa = bootstrap_hist_stats(ha, iterations, rng)
+        sb = bootstrap_hist_stats(hb, iterations, rng)
+        for metric in ["mean"] + [name for name, _ in COMPARE_PERCENTILES]:
+            add(f"{metric}_ms", kind, pa[metric], pb[metric], (sb[metric] - sa[metric]) / sa[metric], True)
+    return rows
+
+
+def compare_main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(
+        prog="bench.py compare",
+        description="Compare two benchmark runs (B against baseline A) with bootstrap confidence intervals",
+    )
+    ap.add_argument("dir_a", help="Baseline run directory")
+    ap.add_argument("dir_b", help="Candidate run directory")
+    ap.add_argument("--threshold", type=float, default=5.0,
+                    help="Regression threshold in percent (default 5)")
+    ap.add_argument("--iterations", type=int, default=2000, help="Bootstrap resamples (default 2000)")
+    ap.add_argument("--confidence", type=float, default=0.95, help="Confidence level (default 0.95)")
+    ap.add_argument("--seed", type=int, default=None, help="RNG seed for reproducible intervals")
+    ap.add_argument("--out", default=None, help="Also write the comparison to this CSV file")
+    args = ap.parse_args(argv)
+
+    if np is None:
+        ap.error("compare needs numpy (pip3 install numpy)")
+
+    rows = compare_runs(args.dir_a, args.dir_b, args.threshold, args.iterations, args.confidence, args.seed)
+    print(f"compare: A={args.dir_a} B={args.dir_b} "
+          f"(CI {args.confidence:.0%}, threshold {args.threshold}%)")
+    print(f"  {'metric':<10} {'kind':<6} {'A':>10} {'B':>10} {'delta%':>8}  {'CI%':<18} flag")
+    for r in rows:
+        flag = "REGRESSION" if r["regression"] else ("significant" if r["significant"] else "")
+        ci = f"[{r['ci_lo_pct']}, {r['ci_hi_pct']}]"
+        print(f"  {r['metric']:<10} {r['kind']:<6} {r['a']:>10} {r['b']:>10} {r['delta_pct']:>8}  {ci:<18} {flag}")
+    if args.out:
+        write_csv(args.out, rows)
+        print(f"  wrote: {args.out}")
+
+    regressions = [r for r in rows if r["regression"]]
+    if regressions:
+        print(f"FAIL: {len(regressions)} significant regression(s) above {args.threshold}%")
+        return 1
+    print("OK: no significant regressions")
+    return 0
+
+
+# ------------------------
+# Streaming responses (time-to-first-row)
+# ------------------------
+
+STREAM_MODES = ("json", "ndjson")
+
+
+def timed_select(
+    conn: http.client.HTTPConnection, path: str, headers: Dict[str, str], body: bytes, ndjson: bool
+) -> Tuple[bool, float, Optional[float], float, int, int, bool]:
+    """
+    One SELECT. Returns (ok, ms to response headers, ms to first row, ms to end
+    of body, rows, body bytes, server closes the connection). A buffered JSON
+    response has no rows until the whole document is parsed.
+    """
+    t0 = time.perf_counter()
+    conn.request("POST", path, body=body, headers=headers)
+    resp = conn.getresponse()
+    t_headers = time.perf_counter()
+    t_first: Optional[float] = None
+    rows = nbytes = 0
+    ok = resp.status == 200
+    if not ok:
+        nbytes = len(resp.read())
+    elif ndjson:
+        for line in resp:
+            nbytes += len(line)
+            if line.startswith(b"["):
+                if t_first is None:
+                    t_first = time.perf_counter()
+                rows += 1
+            elif line.startswith(b'{"error"'):
+                ok = False
+    else:
+        data = resp.read()
+        nbytes = len(data)
+        rows = len(json.loads(data).get("rows") or [])
+        if rows:
+            t_first = time.perf_counter()
+    t_end = time.perf_counter()
+
+    def ms(t: float) -> float:
+        return (t - t0) * 1000.0
+
+    return ok, ms(t_headers), None if t_first is None else ms(t_first), ms(t_end), rows, nbytes, resp.will_close
+
+
+def run_stream_mode(
+    endpoint: str, api_key: str, sql: str, mode: str, n: int, concurrency: int, timeout_s: float
+) -> Dict[str, Any]:
+    """n requests for `sql` from `concurrency` keep-alive threads; one summary row."""
+    u = urllib.parse.urlsplit(endpoint)
+    conn_cls = http.client.HTTPSConnection if u.scheme == "https" else http.client.HTTPConnection
+    ndjson = mode == "ndjson"
+    body = json.dumps({"query": sql, "stream": ndjson}).encode("utf-8")
+    headers = {"Content-Type": "application/json", "X-API-Key": api_key, "Connection": "keep-alive"}
+    hists = {k: LatencyHistogram() for k in ("ttfb", "ttfr", "total")}
+    counts = {"sent": 0, "ok": 0, "rows": 0, "bytes": 0}
+    lock = threading.Lock()
+    remaining = itertools.count()
+
+    def worker() -> None:
+        conn: Optional[http.client.HTTPConnection] = None
+        while next(remaining) < n:
+            if conn is None:
+                conn = conn_cls(u.netloc, timeout=timeout_s)
+            try:
+                ok, ttfb, ttfr, total, rows, nbytes, will_close = timed_select(conn, u.path or "/", headers, body, ndjson)
+            except (OSError, http.client.HTTPException):
+                ok, will_close = False, True
+            with lock:
+                counts["sent"] += 1
+                if ok:
+                    counts["ok"] += 1
+                    counts["rows"] += rows
+                    counts["bytes"] += nbytes
+                    hists["ttfb"].record(ttfb)
+                    hists["total"].record(total)
+                    if ttfr is not None:
+                        hists["ttfr"].record(ttfr)
+            if will_close:
+                conn.close()
+                conn = None
+        if conn is not None:
+            conn.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    t0 = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    dur = max(1e-9, time.perf_counter() - t0)
+
+    ok = counts["ok"]
+    row: Dict[str, Any] = {
+        "mode": mode,
+        "concurrency": concurrency,
+        "sent": counts["sent"],
+        "ok": ok,
+        "errors": counts["sent"] - ok,
+        "rps_ok": f"{ok / dur:.3f}",
+        "rows_mean": f"{counts['rows'] / ok:.1f}" if ok else "",
+        "bytes_mean": f"{counts['bytes'] / ok:.0f}" if ok else "",
+    }
+    for name, hist in hists.items():
+        row.update(latency_stats(name, hist))
+    return row
+
+
+def stream_main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(
+        prog="bench.py stream",
+        description="Time-to-first-row vs total time for a SELECT, buffered JSON vs NDJSON streaming",
+    )
+    ap.add_argument("--gateway-url", required=True, help="e.g. http://<GATEWAY_PUBLIC_IP>")
+    ap.add_argument("--api-key", default="MY_API_KEY", help="API key for X-API-Key")
+    ap.add_argument("--endpoint", default="/query", help="Gateway endpoint path (default /query)")
+    ap.add_argument("--sql", default=FIXED_STREAM_SQL, help="SELECT to fetch (ideally a large result)")
+    ap.add_argument("--modes", default=",".join(STREAM_MODES),
+                    help="Comma-separated response modes to measure: json, ndjson (default both)")
+    ap.add_argument("--requests", type=int, default=100, help="Requests per mode (default 100)")
+    ap.add_argument("--concurrency", type=int, default=1, help="Keep-alive client threads (default 1)")
+    ap.add_argument("--timeout", type=float, default=30.0, help="HTTP timeout seconds (default 30)")
+    ap.add_argument("--outdir", default="./benchmarking/stream", help="Output directory")
+    args = ap.parse_args(argv)
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = sorted(set(modes) - set(STREAM_MODES))
+    if unknown:
+        ap.error(f"unknown mode(s) {unknown}; choose from {list(STREAM_MODES)}")
+
+    endpoint = args.gateway_url.rstrip("/") + args.endpoint
+    ensure_dir(args.outdir)
+    rows = []
+    for mode in modes:
+        r = run_stream_mode(endpoint, args.api_key, args.sql, mode, args.requests, args.concurrency, args.timeout)
+        rows.append(r)
+        print(f"  {mode:<7} ok={r['ok']:<6} rows/req={r['rows_mean']:>8} "
+              f"ttfr p50={r['ttfr_p50_ms']:>9} p99={r['ttfr_p99_ms']:>9}  "
+              f"total p50={r['total_p50_ms']:>9} p99={r['total_p99_ms']:>9}  errors={r['errors']}")
+
+    path = os.path.join(args.outdir, "stream.csv")
+    write_csv(path, rows)
+    print(f"  wrote: {path}")
+    return 0
+
+
+# ------------------------
+# Batched statements (/batch vs one /query per statement)
+# ------------------------
+
+def run_batch_size(
+    gateway_url: str, api_key: str, sql: str, size: int, total: int, concurrency: int,
+    transaction: bool, timeout_s: float,
+) -> Dict[str, Any]:
+    """
+    `total` statements sent `size` at a time from `concurrency` keep-alive
+    threads; size 1 uses plain /query. One summary row.
+    """
+    if size <= 1:
+        url = gateway_url + "/query"
+        body = json.dumps({"query": sql}).encode("utf-8")
+    else:
+        url = gateway_url + "/batch"
+        body = json.dumps({"statements": [{"query": sql}] * size, "transaction": transaction}).encode("utf-8")
+    n = max(1, total // max(1, size))
+    hist = LatencyHistogram()
+    counts = {"sent": 0, "ok": 0, "statements_ok": 0}
+    lock = threading.Lock()
+    remaining = itertools.count()
+
+    def worker() -> None:
+        transport = make_transport("pooled", url, api_key, timeout_s)
+        try:
+            while next(remaining) < n:
+                t0 = time.perf_counter()
+                code, text, _ = transport.post(body)
+                lat_ms = (time.perf_counter() - t0) * 1000.0
+                stmts_ok = 0
+                if code == 200:
+                    if size <= 1:
+                        stmts_ok = 1
+                    else:
+                        stmts_ok = sum(1 for r in json.loads(text).get("results") or [] if r.get("status") == 200)
+                with lock:
+                    counts["sent"] += 1
+                    if code == 200:
+                        counts["ok"] += 1
+                        counts["statements_ok"] += stmts_ok
+                        hist.record(lat_ms)
+        finally:
+            transport.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    t0 = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    dur = max(1e-9, time.perf_counter() - t0)
+
+    row: Dict[str, Any] = {
+        "batch_size": size,
+        "transaction": transaction and size > 1,
+        "concurrency": concurrency,
+        "requests": counts["sent"],
+        "ok": counts["ok"],
+        "errors": counts["sent"] - counts["ok"],
+        "statements_ok": counts["statements_ok"],
+        "stmts_per_s": f"{counts['statements_ok'] / dur:.3f}",
+    }
+    row.update(latency_stats("req", hist))
+    return row
+
+
+def batch_main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(
+        prog="bench.py batch",
+        description="Statements/s through /batch at several batch sizes (size 1 = one /query per statement)",
+    )
+    ap.add_argument("--gateway-url", required=True, help="e.g. http://<GATEWAY_PUBLIC_IP>")
+    ap.add_argument("--api-key", default="MY_API_KEY", help="API key for X-API-Key")
+    ap.add_argument("--sql", default=FIXED_WRITE_SQL, help="Statement repeated in every batch")
+    ap.add_argument("--sizes", default="1,10,50,100", help="Batch sizes, comma-separated (default 1,10,50,100)")
+    ap.add_argument("--statements", type=int, default=2000, help="Statements per batch size (default 2000)")
+    ap.add_argument("--concurrency", type=int, default=4, help="Keep-alive client threads (default 4)")
+    ap.add_argument("--transaction", action="store_true", help="Run each batch as one transaction")
+    ap.add_argument("--timeout", type=float, default=30.0, help="HTTP timeout seconds (default 30)")
+    ap.add_argument("--outdir", default="./benchmarking/batch", help="Output directory")
+    args = ap.parse_args(argv)
+
+    sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    gateway_url = args.gateway_url.rstrip("/")
+    ensure_dir(args.outdir)
+    rows = []
+    for size in sizes:
+        r = run_batch_size(
+            gateway_url, args.api_key, args.sql, size, args.statements, args.concurrency,
+            args.transaction, args.timeout,
+        )
+        rows.append(r)
+        print(f"  size={size:<5} requests={r['requests']:<6} stmts_ok={r['statements_ok']:<7} "
+              f"stmts/s={r['stmts_per_s']:>10}  req p50={r['req_p50_ms']:>9} p99={r['req_p99_ms']:>9}  "
+              f"errors={r['errors']}")
+
+    path = os.path.join(args.outdir, "batch.csv")
     write_csv(path, rows)
+    print(f"  wrote: {path}")
+    return 0
 
 
 # ------------------------
@@ -375,13 +2370,70 @@ FIXED_READ_SQL = (
     "WHERE actor_id = 1"
 )
 
+FIXED_STREAM_SQL = (
+    "SELECT rental_id, rental_date, inventory_id, customer_id, return_date "
+    "FROM sakila.rental"
+)
+
 
 # ------------------------
 # Main
 # ------------------------stats.stats_mysql_connection_pool
 
 
-def main() -> int:
+def main_sweep(args: argparse.Namespace, endpoint: str, workload: Optional[Dict[str, Any]] = None) -> int:
+    steps = [int(x) for x in args.sweep_steps.split(",") if x.strip()]
+    total = args.reads + args.writes
+    read_ratio = args.reads / total if total > 0 else 1.0
+
+    print(f"[{args.strategy}] sweep over concurrency {steps} "
+          f"(read_ratio={read_ratio:.2f} warmup={args.sweep_warmup}s hold={args.sweep_hold}s)")
+    rows = run_sweep(
+        endpoint=endpoint,
+        api_key=args.api_key,
+        read_sql=args.read_sql,
+        write_sql=args.write_sql,
+        read_ratio=read_ratio,
+        steps=steps,
+        warmup_s=args.sweep_warmup,
+        hold_s=args.sweep_hold,
+        timeout_s=args.timeout,
+        transport=args.transport,
+        seed=args.seed,
+        workload=workload,
+    )
+
+    knee = detect_knee(rows)
+    for i, r in enumerate(rows):
+        r["knee"] = 1 if i == knee else 0
+        r["strategy"] = args.strategy
+
+    sweep_path = os.path.join(args.outdir, "sweep.csv")
+    write_csv(sweep_path, rows)
+
+    if knee is None:
+        print("  saturation knee: not reached (throughput still growing or p99 flat)")
+    else:
+        k = rows[knee]
+        print(f"  saturation knee: concurrency={k['concurrency']} tps_ok={k['tps_ok']} p99_ms={k['p99_ms']}")
+    print(f"  wrote: {sweep_path}")
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] == "worker":
+        return worker_main(argv[1:])
+    if argv and argv[0] == "aggregate":
+        return aggregate_main(argv[1:])
+    if argv and argv[0] == "compare":
+        return compare_main(argv[1:])
+    if argv and argv[0] == "stream":
+        return stream_main(argv[1:])
+    if argv and argv[0] == "batch":
+        return batch_main(argv[1:])
+
     ap = argparse.ArgumentParser(description="Benchmark: 2 parallel streams (READ + WRITE), TPS + latency series")
     ap.add_argument("--gateway-url", required=True, help="e.g. http://<GATEWAY_PUBLIC_IP>")
     ap.add_argument("--api-key", default="MY_API_KEY", help="API key for X-API-Key")
@@ -392,17 +2444,95 @@ def main() -> int:
     ap.add_argument("--endpoint", default="/query", help="Gateway endpoint path (default /query)")
     ap.add_argument("--read-sql", default=FIXED_READ_SQL, help="READ query")
     ap.add_argument("--write-sql", default=FIXED_WRITE_SQL, help="WRITE query (INSERT/UPDATE/DELETE)")
+    ap.add_argument("--workload", default=None,
+                    help="Workload file with weighted query templates (e.g. workloads/sakila_mix.json); "
+                         "replaces --read-sql/--write-sql")
+    ap.add_argument("--query-params", choices=["bind", "inline"], default="bind",
+                    help="Workload values: bind = send them as \"params\" (prepared statements on the "
+                         "Gateway, default); inline = format them into the SQL text")
+    ap.add_argument("--rw-ratio", type=parse_rw_ratio, default=None,
+                    help="Read/write split, e.g. 95/5 or 50/50 (default: workload's read_ratio, "
+                         "else --reads/--writes)")
+    ap.add_argument("--requests", type=int, default=None,
+                    help="Total requests split by --rw-ratio, or in the --reads/--writes proportion "
+                         "(default --reads + --writes)")
     ap.add_argument("--outdir", default="./benchmarking", help="Output directory")
     ap.add_argument("--no-raw", action="store_true", help="Do not write raw_requests.csv")
-    args = ap.parse_args()
+    ap.add_argument("--raw-format", choices=["csv", "bin"], default="csv",
+                    help="raw_requests.csv (default) or compact columnar raw_requests.bin")
+    ap.add_argument("--mode", choices=["closed", "open"], default="closed",
+                    help="closed = 2 sequential streams (default); open = constant arrival rate")
+    ap.add_argument("--rate", type=parse_rate, default=None,
+                    help="Open-loop total arrival rate, e.g. 2000/s (required with --mode open)")
+    ap.add_argument("--arrivals", choices=["poisson", "uniform"], default="poisson",
+                    help="Open-loop inter-arrival distribution (default poisson)")
+    ap.add_argument("--max-conns", type=int, default=1000,
+                    help="Open-loop max concurrent connections / in-flight sends (default 1000)")
+    ap.add_argument("--transport", choices=["pooled", "fresh"], default="pooled",
+                    help="pooled = persistent keep-alive connection per worker (default); "
+                         "fresh = new TCP connection per request, as bench.py measured before --transport "
+                         "existed (use it to compare with the results in report/)")
+    ap.add_argument("--seed", type=int, default=None, help="RNG seed for arrivals and read/write interleaving")
+    ap.add_argument("--sweep", action="store_true",
+                    help="Ramp closed-loop concurrency through --sweep-steps and write sweep.csv")
+    ap.add_argument("--sweep-steps", default=DEFAULT_SWEEP_STEPS,
+                    help=f"Comma-separated concurrency levels (default {DEFAULT_SWEEP_STEPS})")
+    ap.add_argument("--sweep-warmup", type=float, default=2.0, help="Seconds discarded at each step (default 2)")
+    ap.add_argument("--sweep-hold", type=float, default=10.0, help="Steady-state seconds measured per step (default 10)")
+    ap.add_argument("--procs", type=int, default=1,
+                    help="Local load-generating processes; load and rate are split evenly (default 1)")
+    ap.add_argument("--remote-workers", type=int, default=0,
+                    help="Extra workers to wait for on other hosts (bench.py worker --coordinator ...)")
+    ap.add_argument("--listen", default="127.0.0.1:0",
+                    help="Coordinator HOST:PORT (use 0.0.0.0:<port> with --remote-workers)")
+    ap.add_argument("--authkey", default="bench", help="Shared secret between coordinator and workers")
+    ap.add_argument("--bucket-ms", type=int, default=1000,
+                    help="Time-series bucket width in ms, e.g. 100 to see short spikes (default 1000)")
+    ap.add_argument("--aggregator", choices=["hist", "numpy"], default="hist",
+                    help="hist = streaming histograms (default); numpy = exact, vectorised pass "
+                         "over the raw records after the run (needs numpy and raw output)")
+    args = ap.parse_args(argv)
+
+    if args.mode == "open" and args.rate is None:
+        ap.error("--mode open requires --rate")
+    if args.sweep and (args.procs > 1 or args.remote_workers > 0):
+        ap.error("--sweep runs in a single process; drop --procs/--remote-workers")
+    if args.aggregator == "numpy":
+        if args.no_raw:
+            ap.error("--aggregator numpy reads the raw records; drop --no-raw")
+        if np is None:
+            ap.error("--aggregator numpy needs numpy (pip3 install numpy)")
+    if args.bucket_ms <= 0:
+        ap.error("--bucket-ms must be > 0")
+
+    workload = None
+    if args.workload:
+        workload = Workload.load(args.workload)
+        try:
+            Workload(workload)
+        except (KeyError, ValueError) as e:
+            ap.error(f"invalid workload {args.workload}: {e}")
+        workload["bind_params"] = args.query_params == "bind"
+        if args.rw_ratio is None and workload.get("read_ratio") is not None:
+            args.rw_ratio = float(workload["read_ratio"])
+    if args.rw_ratio is None and args.requests is not None:
+        # No ratio given: keep the --reads/--writes split, scaled to --requests.
+        args.rw_ratio = args.reads / (args.reads + args.writes) if args.reads + args.writes > 0 else 1.0
+    if args.rw_ratio is not None:
+        total = args.requests if args.requests is not None else args.reads + args.writes
+        args.reads = int(round(total * args.rw_ratio))
+        args.writes = total - args.reads
 
     base = args.gateway_url.rstrip("/")
     endpoint = base + args.endpoint
 
     ensure_dir(args.outdir)
 
-    # One run: READ stream and WRITE stream in parallel
-    records, dur = run_parallel_reads_writes(
+    if args.sweep:
+        return main_sweep(args, endpoint, workload)
+
+    spec = LoadSpec(
+        mode=args.mode,
         endpoint=endpoint,
         api_key=args.api_key,
         n_reads=args.reads,
@@ -410,40 +2540,79 @@ def main() -> int:
         read_sql=args.read_sql,
         write_sql=args.write_sql,
         timeout_s=args.timeout,
+        transport=args.transport,
+        rate=args.rate,
+        arrivals=args.arrivals,
+        max_conns=args.max_conns,
+        seed=args.seed,
+        bucket_ms=args.bucket_ms,
+        workload=workload,
     )
+    phase = spec.phase
 
     # Outputs
     summary_path = os.path.join(args.outdir, "summary.csv")
     tps_path = os.path.join(args.outdir, "tps_timeseries.csv")
     lat_path = os.path.join(args.outdir, "latency_timeseries.csv")
-    raw_path = os.path.join(args.outdir, "raw_requests.csv")
+    raw_path = os.path.join(args.outdir, f"raw_requests.{args.raw_format}")
+    hist_path = os.path.join(args.outdir, "latency_histograms.json")
+    tpl_path = os.path.join(args.outdir, "template_latency.csv")
 
-    summary_row = compute_summary(records, dur, args.strategy)
+    # Raw records are streamed to disk while the run is in progress.
+    sink = RecordSink() if args.no_raw else RawRecordSink(raw_path, args.strategy, args.raw_format)
+    try:
+        if args.procs > 1 or args.remote_workers > 0:
+            _, stats, dur = run_distributed(
+                spec,
+                procs=args.procs,
+                remote_workers=args.remote_workers,
+                listen=args.listen,
+                authkey=args.authkey.encode("utf-8"),
+                records=sink,
+            )
+        else:
+            _, stats, dur = run_load(spec, records=sink)
+    finally:
+        sink.close()
+
+    summary_row = compute_summary(stats, dur, args.strategy, phase)
     write_csv(summary_path, [summary_row])
 
-    tps_rows = compute_tps_timeseries(records)
+    if args.aggregator == "numpy":
+        tps_rows, lat_rows = compute_timeseries_numpy(read_raw_columns(raw_path), args.bucket_ms)
+    else:
+        tps_rows = compute_tps_timeseries(stats)
+        lat_rows = compute_latency_timeseries(stats)
+
     for r in tps_rows:
         r["strategy"] = args.strategy
     write_csv(tps_path, tps_rows)
 
-    lat_rows = compute_latency_timeseries(records)
     for r in lat_rows:
         r["strategy"] = args.strategy
     write_csv(lat_path, lat_rows)
 
-    if not args.no_raw:
-        write_raw_requests(raw_path, records, args.strategy)
+    write_histograms(hist_path, stats, args.strategy)
+
+    tpl_rows = compute_template_latency(stats, args.strategy)
+    if workload:
+        write_csv(tpl_path, tpl_rows)
 
     # Console report + hard alignment checks
-    print(f"[{args.strategy}] done.")
+    print(f"[{args.strategy}] done. (mode={args.mode} transport={args.transport} procs={args.procs + args.remote_workers})")
     print(f"  sent: total={summary_row['total_sent']} reads={summary_row['read_sent']} writes={summary_row['write_sent']}")
     print(f"  ok:   total={summary_row['ok_total']} reads={summary_row['ok_read']} writes={summary_row['ok_write']}")
     print(f"  duration_s={summary_row['duration_s']} avg_tps_ok={summary_row['avg_tps_ok']}")
     print(f"  wrote: {summary_path}")
     print(f"  wrote: {tps_path}")
     print(f"  wrote: {lat_path}")
+    print(f"  wrote: {hist_path}")
+    if workload:
+        for r in tpl_rows:
+            print(f"    {r['template']:<28} {r['kind']:<5} ok={r['ok']:<7} p50={r['p50_ms']:>8} p99={r['p99_ms']:>8}")
+        print(f"  wrote: {tpl_path}")
     if not args.no_raw:
-        print(f"  wrote: {raw_path}")
+        print(f"  wrote: {raw_path} ({sink.written} records)")
 
     if int(summary_row["read_sent"]) != args.reads or int(summary_row["write_sent"]) != args.writes:
         print("WARNING: sent counts do not match requested reads/writes (unexpected).")
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+bench_fetch.py — Microbenchmark of the Gatekeeper's buffered fetch path
+
+Generates server.py with def_server_code(), imports it, and times
+fetch_all_limited() against the previous implementation (fetchone() per
+row, len(str(v)) per value) on in-memory cursors, for a narrow and a wide
+result set. No database or network is involved: this is the CPU cost per
+request of turning a result into rows, before serialisation.
+
+Needs the Gatekeeper's own dependencies (fastapi, mysql-connector-python).
+
+Usage:
+  python3 bench_fetch.py
+  python3 bench_fetch.py --rows 100,501,5000 --repeat 7 --out ./benchmarking/fetch.csv
+"""
+
+import argparse
+import datetime as dt
+import decimal
+import importlib.util
+import itertools
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import bench
+from deployment.setup_instances import def_server_code
+
+
+# ------------------------
+# Result shapes
+# ------------------------
+
+def narrow_row(i: int) -> Tuple[Any, ...]:
+    return (i, f"name{i}", i * 1.5)
+
+
+def wide_row(i: int) -> Tuple[Any, ...]:
+    ts = dt.datetime(2024, 1, 1) + dt.timedelta(seconds=i)
+    return (
+        i, i * 7, i % 3, f"first{i}", f"last{i}", f"user{i}@example.com",
+        decimal.Decimal(i) / 100, decimal.Decimal("4.99"), i * 0.25, None, None,
+        ts, ts.date(), ts.time(), dt.timedelta(minutes=i % 90),
+        "x" * 40, "lorem ipsum dolor sit amet " * 12, b"\x00\x01" * 8, True, i * 3,
+    )
+
+
+SHAPES: Dict[str, Callable[[int], Tuple[Any, ...]]] = {"narrow": narrow_row, "wide": wide_row}
+
+
+class ListCursor:
+    """Unbuffered-style cursor over in-memory rows (pure Python, like mysql-connector's)."""
+
+    def __init__(self, description: List[Tuple[str]], rows: List[Tuple[Any, ...]]) -> None:
+        self.description = description
+        self._rows = rows
+        self._pos = 0
+
+    def fetchone(self) -> Any:
+        if self._pos >= len(self._rows):
+            return None
+        row = self._rows[self._pos]
+        self._pos += 1
+        return row
+
+    def fetchmany(self, size: int = 1) -> List[Tuple[Any, ...]]:
+        out = self._rows[self._pos:self._pos + size]
+        self._pos += len(out)
+        return out
+
+
+# ------------------------
+# Implementations
+# ------------------------
+
+def load_server() -> Any:
+    code = def_server_code("bench", "127.0.0.1", 3306, "bench", "bench")
+    workdir = tempfile.mkdtemp(prefix="gatekeeper_fetch_")
+    path = os.path.join(workdir, "server.py")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(code)
+    spec = importlib.util.spec_from_file_location("gatekeeper_server", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def legacy_fetch(server: Any) -> Callable[[Any], Tuple[List[str], List[List[Any]], bool]]:
+    """The fetch path before batching: fetchone() per row, str() of every value."""
+
+    def fetch(cur: Any) -> Tuple[List[str], List[List[Any]], bool]:
+        columns = [desc[0] for desc in (cur.description or [])]
+        rows: List[List[Any]] = []
+        truncated = False
+        approx_bytes = 0
+        for row in itertools.islice(iter(cur.fetchone, None), server.MAX_ROWS + 1):
+            if len(rows) >= server.MAX_ROWS:
+                truncated = True
+                break
+            row_list = list(row)
+            rows.append(row_list)
+            approx_bytes += sum(len(str(v)) for v in row_list)
+            if approx_bytes > server.MAX_RESULT_BYTES:
+                truncated = True
+                break
+        return columns, rows, truncated
+
+    return fetch
+
+
+def time_fetch(
+    fetch: Callable[[Any], Any], description: List[Tuple[str]], rows: List[Tuple[Any, ...]], repeat: int
+) -> Tuple[float, int]:
+    """Best-of-`repeat` microseconds per call, and rows returned."""
+    loops = max(1, 20_000 // max(1, len(rows)))
+    best = float("inf")
+    returned = 0
+    for _ in range(repeat):
+        cursors = [ListCursor(description, rows) for _ in range(loops)]
+        t0 = time.perf_counter()
+        for cur in cursors:
+            _, out, _ = fetch(cur)
+        best = min(best, (time.perf_counter() - t0) / loops)
+        returned = len(out)
+    return best * 1e6, returned
+
+
+# ------------------------
+# Main
+# ------------------------
+
+def main(argv: Sequence[str] = None) -> int:
+    ap = argparse.ArgumentParser(description="Microbenchmark the Gatekeeper fetch path (no database needed)")
+    ap.add_argument("--rows", default="10,501,5000",
+                    help="Result sizes in rows, comma-separated (default 10,501,5000)")
+    ap.add_argument("--repeat", type=int, default=5, help="Timing repeats; the best one is kept (default 5)")
+    ap.add_argument("--out", default=None, help="Also write the results to this CSV file")
+    args = ap.parse_args(argv)
+
+    server = load_server()
+    impls = {"legacy": legacy_fetch(server), "batched": server.fetch_all_limited}
+    sizes = [int(x) for x in args.rows.split(",") if x.strip()]
+
+    results: List[Dict[str, Any]] = []
+    print(f"MAX_ROWS={server.MAX_ROWS} FETCH_BATCH_ROWS={server.FETCH_BATCH_ROWS}")
+    print(f"  {'shape':<7} {'rows':>6} {'impl':<8} {'us/call':>10} {'rows/s':>12} {'speedup':>8}")
+    for shape, make_row in SHAPES.items():
+        description = [(f"c{i}",) for i in range(len(make_row(0)))]
+        for n in sizes:
+            rows = [make_row(i) for i in range(n)]
+            base_us = None
+            for name, fetch in impls.items():
+                us, returned = time_fetch(fetch, description, rows, args.repeat)
+                base_us = base_us or us
+                row = {
+                    "shape": shape,
+                    "columns": len(description),
+                    "rows": n,
+                    "returned": returned,
+                    "impl": name,
+                    "us_per_call": f"{us:.1f}",
+                    "rows_per_s": f"{returned / us * 1e6:.0f}" if returned else "",
+                    "speedup": f"{base_us / us:.2f}",
+                }
+                results.append(row)
+                print(f"  {shape:<7} {n:>6} {name:<8} {row['us_per_call']:>10} {row['rows_per_s']:>12} "
+                      f"{row['speedup']:>7}x")
+
+    if args.out:
+        bench.ensure_dir(os.path.dirname(args.out) or ".")
+        bench.write_csv(args.out, results)
+        print(f"wrote: {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
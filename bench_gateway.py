@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+bench_gateway.py — Local A/B benchmark of Gatekeeper builds
+
+For each --variant, generates server.py with def_server_code(), starts it with
+uvicorn on 127.0.0.1 (connected to the ProxySQL/MySQL given by --proxy-host),
+runs a bench.py closed-loop concurrency sweep against it and stops it again.
+Every variant sees the same database and the same load, so the differences
+come from the Gatekeeper build alone.
+
+A variant is NAME:key=value,key=value
+  - keys accepted by def_server_code() (e.g. mode=async) change the generated code
+  - workers=N, loop=auto|asyncio|uvloop, http=auto|h11|httptools are uvicorn options;
+    with N workers each one gets POOL_SIZE = --db-connections // N, as on the Gateway
+  - UPPERCASE keys are passed to the server as environment variables (e.g. POOL_SIZE=50)
+
+Outputs (in --outdir):
+  - gateway_bench.csv  (one row per variant and concurrency step)
+
+Usage (on the Gateway host, or any host that can reach ProxySQL):
+  python3 bench_gateway.py \
+    --proxy-host <PROXY_PRIVATE_IP> --db-user <USER> --db-password <PASS> \
+    --variant sync:mode=sync --variant async:mode=async,POOL_SIZE=50 \
+    --steps 16,64,256,512 --hold 10 \
+    --outdir ./benchmarking/gateway_modes
+
+  python3 bench_gateway.py ... --variant w1:workers=1 --variant w4:workers=4 --procs 4
+"""
+
+import argparse
+import asyncio
+import inspect
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Any, Dict, List, Tuple
+
+import bench
+from deployment.setup_instances import def_server_code
+
+
+BENCH_API_KEY = "gateway-bench"
+CODE_PARAMS = set(inspect.signature(def_server_code).parameters) - {
+    "api_key", "proxy_host", "proxy_port", "db_user", "db_password",
+}
+UVICORN_OPTS = {"workers", "loop", "http"}
+
+
+# ------------------------
+# Variants
+# ------------------------
+
+Variant = Tuple[str, Dict[str, str], Dict[str, str], Dict[str, str]]
+
+
+def parse_variant(text: str) -> Variant:
+    """'async:mode=async,workers=2,POOL_SIZE=50' -> (name, def_server_code kwargs, uvicorn options, env)."""
+    name, _, opts = text.partition(":")
+    code_kwargs: Dict[str, str] = {}
+    uvicorn_opts: Dict[str, str] = {}
+    env: Dict[str, str] = {}
+    for opt in filter(None, opts.split(",")):
+        key, sep, value = opt.partition("=")
+        if not sep:
+            raise argparse.ArgumentTypeError(f"expected key=value in variant {text!r}: {opt!r}")
+        if key.isupper():
+            env[key] = value
+        elif key in CODE_PARAMS:
+            code_kwargs[key] = value
+        elif key in UVICORN_OPTS:
+            uvicorn_opts[key] = value
+        else:
+            raise argparse.ArgumentTypeError(
+                f"unknown variant option {key!r} (code: {sorted(CODE_PARAMS)}, uvicorn: {sorted(UVICORN_OPTS)})"
+            )
+    return name, code_kwargs, uvicorn_opts, env
+
+
+# ------------------------
+# Server lifecycle
+# ------------------------
+
+def wait_healthy(url: str, timeout_s: float) -> None:
+    deadline = time.time() + timeout_s
+    last = ""
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=2) as resp:
+                if resp.getcode() == 200:
+                    return
+        except Exception as e:
+            last = str(e)
+        time.sleep(0.3)
+    raise RuntimeError(f"gateway did not become healthy at {url}: {last}")
+
+
+def start_server(
+    code: str,
+    workdir: str,
+    port: int,
+    uvicorn_opts: Dict[str, str],
+    env: Dict[str, str],
+    log_path: str,
+) -> subprocess.Popen:
+    with open(os.path.join(workdir, "server.py"), "w", encoding="utf-8") as f:
+        f.write(code)
+    cmd = [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port)]
+    for key, value in uvicorn_opts.items():
+        cmd += [f"--{key}", value]
+    log = open(log_path, "w")
+    return subprocess.Popen(cmd, cwd=workdir, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT)
+
+
+def stop_server(proc: subprocess.Popen) -> None:
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+# ------------------------
+# Main
+# ------------------------
+
+def run_variant(args: argparse.Namespace, variant: Variant) -> List[Dict[str, Any]]:
+    name, code_kwargs, uvicorn_opts, env = variant
+    if "workers" in uvicorn_opts and "POOL_SIZE" not in env:
+        env = {**env, "POOL_SIZE": str(max(1, args.db_connections // int(uvicorn_opts["workers"])))}
+    code = def_server_code(
+        BENCH_API_KEY, args.proxy_host, args.proxy_port, args.db_user, args.db_password, **code_kwargs
+    )
+    base = f"http://127.0.0.1:{args.port}"
+    with tempfile.TemporaryDirectory(prefix=f"gatekeeper_{name}_") as workdir:
+        proc = start_server(
+            code, workdir, args.port, uvicorn_opts, env, os.path.join(args.outdir, f"server_{name}.log")
+        )
+        try:
+            wait_healthy(base + "/health?deep=true", args.startup_timeout)
+            opts = {**code_kwargs, **uvicorn_opts, **env}
+            print(f"--- variant {name} ({', '.join(f'{k}={v}' for k, v in opts.items())})")
+            rows = [run_step(args, base + "/query", c) for c in args.steps]
+        finally:
+            stop_server(proc)
+    return [{"variant": name, **r} for r in rows]
+
+
+def run_step(args: argparse.Namespace, endpoint: str, concurrency: int) -> Dict[str, Any]:
+    """
+    One closed-loop step. With --procs > 1 the concurrency is split across
+    load-generating processes, so a multi-worker Gatekeeper is not measured
+    against a single-core client.
+    """
+    if args.procs <= 1:
+        return bench.run_sweep(
+            endpoint, BENCH_API_KEY, args.read_sql, args.write_sql, args.read_ratio,
+            [concurrency], args.warmup, args.hold, args.timeout,
+        )[0]
+    shares = [concurrency // args.procs + (1 if i < concurrency % args.procs else 0) for i in range(args.procs)]
+    shares = [c for c in shares if c > 0]
+    with multiprocessing.get_context("spawn").Pool(len(shares)) as pool:
+        parts = pool.starmap(sweep_part, [(args, endpoint, c) for c in shares])
+    hist = bench.LatencyHistogram()
+    counts = {"sent": 0, "ok": 0}
+    for h, c in parts:
+        hist.merge(bench.LatencyHistogram.from_dict(h))
+        counts["sent"] += c["sent"]
+        counts["ok"] += c["ok"]
+    row = bench.sweep_row(concurrency, args.hold, hist, counts)
+    bench.print_sweep_row(row)
+    return row
+
+
+def sweep_part(args: argparse.Namespace, endpoint: str, concurrency: int) -> Tuple[Dict[str, Any], Dict[str, int]]:
+    """One load process's share of a step: (histogram dict, sent/ok)."""
+    source = bench.make_source(args.read_sql, args.write_sql, None)
+    hist, counts = asyncio.run(bench._sweep_measure(
+        endpoint, BENCH_API_KEY, source, args.read_ratio, concurrency,
+        args.warmup, args.hold, args.timeout, "pooled", random.Random(),
+    ))
+    return hist.to_dict(), counts
+
+
+def print_comparison(rows: List[Dict[str, Any]], names: List[str]) -> None:
+    by_key = {(r["variant"], r["concurrency"]): r for r in rows}
+    steps = sorted({r["concurrency"] for r in rows})
+    print("\nconcurrency " + "".join(f"| {n:^30} " for n in names))
+    print("            " + "".join(f"| {'tps_ok':>9} {'p50':>9} {'p99':>9} " for _ in names))
+    for c in steps:
+        line = f"{c:<11} "
+        for n in names:
+            r = by_key.get((n, c))
+            line += f"| {r['tps_ok']:>9} {r['p50_ms']:>9} {r['p99_ms']:>9} " if r else f"| {'':>29} "
+        print(line)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark Gatekeeper variants locally against the same ProxySQL/MySQL")
+    ap.add_argument("--proxy-host", required=True, help="ProxySQL (or MySQL) host the Gatekeeper connects to")
+    ap.add_argument("--proxy-port", type=int, default=3306)
+    ap.add_argument("--db-user", required=True)
+    ap.add_argument("--db-password", required=True)
+    ap.add_argument("--variant", action="append", type=parse_variant, default=None,
+                    help="NAME:key=value,... (repeatable; default: sync:mode=sync and async:mode=async)")
+    ap.add_argument("--port", type=int, default=8080, help="Local port for the Gatekeeper under test")
+    ap.add_argument("--steps", default="16,64,256", help="Sweep concurrency steps (comma-separated)")
+    ap.add_argument("--warmup", type=float, default=3.0, help="Seconds of warmup per step")
+    ap.add_argument("--hold", type=float, default=10.0, help="Seconds measured per step")
+    ap.add_argument("--timeout", type=float, default=10.0)
+    ap.add_argument("--read-ratio", type=float, default=0.9, help="Fraction of requests that are reads")
+    ap.add_argument("--read-sql", default=bench.FIXED_READ_SQL)
+    ap.add_argument("--write-sql", default=bench.FIXED_WRITE_SQL)
+    ap.add_argument("--db-connections", type=int, default=40,
+                    help="DB connections shared by all workers of a variant (POOL_SIZE = this // workers)")
+    ap.add_argument("--procs", type=int, default=1,
+                    help="Load-generating processes (use >1 when testing multi-worker variants)")
+    ap.add_argument("--startup-timeout", type=float, default=30.0)
+    ap.add_argument("--outdir", default="./benchmarking/gateway")
+    args = ap.parse_args(argv)
+
+    args.steps = [int(x) for x in args.steps.split(",") if x.strip()]
+    variants = args.variant or [parse_variant("sync:mode=sync"), parse_variant("async:mode=async")]
+    bench.ensure_dir(args.outdir)
+
+    rows: List[Dict[str, Any]] = []
+    for v in variants:
+        rows.extend(run_variant(args, v))
+
+    path = os.path.join(args.outdir, "gateway_bench.csv")
+    bench.write_csv(path, rows)
+    print_comparison(rows, [v[0] for v in variants])
+    print(f"\nwrote: {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+check_lexer.py — Regression checks for the Gatekeeper's SQL lexer
+
+Generates server.py with def_server_code(), imports it, and checks what
+analyze_sql() reports for statements that were once misread: statement type,
+referenced tables and the flags that decide what may be cached or shared.
+Tables feed result-cache and singleflight invalidation, so a table missed
+here means stale reads. No database or network is involved.
+
+Needs the Gatekeeper's own dependencies (fastapi, mysql-connector-python).
+
+Usage:
+  python3 check_lexer.py
+"""
+
+import sys
+from typing import Any, Dict, List, Sequence, Tuple
+
+from bench_fetch import load_server
+
+
+# ------------------------
+# Cases: (statement, expected SqlInfo fields)
+# ------------------------
+
+CASES: List[Tuple[str, Dict[str, Any]]] = [
+    ("SELECT * FROM sakila.actor WHERE actor_id = 1", {"kind": "select", "tables": ("actor",)}),
+    ("SELECT a.x FROM a, b WHERE a.id = b.id", {"kind": "select", "tables": ("a", "b")}),
+    ("UPDATE sakila.a, sakila.b SET a.x=1, b.y=2 WHERE a.id=b.id", {"kind": "update", "tables": ("a", "b")}),
+    ("UPDATE a x, b y SET x.v = 1 WHERE x.id = y.id", {"kind": "update", "tables": ("a", "b")}),
+    ("UPDATE LOW_PRIORITY a SET v = (SELECT 1 FROM c) WHERE id = 1", {"kind": "update", "tables": ("a", "c")}),
+    ("UPDATE a JOIN b ON a.id = b.id SET a.x = 1", {"kind": "update", "tables": ("a", "b")}),
+    ("DELETE a, b FROM a JOIN b ON a.id = b.id WHERE a.id = 1", {"kind": "delete", "tables": ("a", "b")}),
+    ("INSERT INTO sakila.bench_events (created_at, payload) VALUES (NOW(6), 'x')",
+     {"kind": "insert", "tables": ("bench_events",), "nondeterministic": True}),
+    # Never served from the result cache:
+    ("SELECT NOW()", {"kind": "select", "nondeterministic": True}),
+    ("SELECT * FROM sakila.actor ORDER BY RAND() LIMIT 1", {"tables": ("actor",), "nondeterministic": True}),
+    ("SELECT * FROM sakila.actor WHERE first_name = 'now()'", {"nondeterministic": False, "replica_safe": True}),
+    ("SELECT * FROM sakila.actor WHERE actor_id = 1 FOR UPDATE", {"kind": "select", "replica_safe": False}),
+    ("SELECT @x := actor_id FROM sakila.actor", {"kind": "select", "replica_safe": False}),
+]
+
+
+# ------------------------
+# Main
+# ------------------------
+
+def main(argv: Sequence[str] = None) -> int:
+    server = load_server()
+    failures = 0
+    for sql, expected in CASES:
+        info = server.analyze_sql(sql)
+        got = {field: getattr(info, field) for field in expected}
+        ok = got == expected
+        failures += not ok
+        print(f"  {'ok  ' if ok else 'FAIL'} {sql}")
+        if not ok:
+            print(f"       expected {expected}, got {got}")
+    print(f"{len(CASES) - failures}/{len(CASES)} passed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,7 @@
 import textwrap
 import base64
+import re
+from typing import Dict, Optional
 
 
 def _ensure_mysqld_option_block(option_lines: str) -> str:
@@ -494,20 +496,48 @@ systemctl enable --now proxysql-ping-controller.service
 
     return base_code_proxy(manager_ip, worker_ips, mysql_user, mysql_pass) + extra
 
-def def_server_code(api_key, proxy_host, proxy_port, db_user, db_password) -> str:
+def def_server_code(api_key, proxy_host, proxy_port, db_user, db_password, mode: str = "sync") -> str:
+    """
+    Gatekeeper server.py source. mode="sync" serves /query from FastAPI's
+    threadpool with mysql-connector; mode="async" uses an async endpoint and
+    an aiomysql pool, so concurrency is bounded by the pool, not by threads.
+    """
+    if mode not in ("sync", "async"):
+        raise ValueError(f"Unknown gateway mode: {mode}")
     template = r'''from __future__ import annotations
 
 import os
 import re
+import json
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import datetime as dt
+import decimal
 import time
+import functools
+import itertools
 import logging
-from typing import Any, Optional, List, Dict, Tuple
+import math
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait as wait_futures
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, Optional, List, Dict, NamedTuple, Sequence, Set, Tuple
 
 from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
 
 import mysql.connector
-from mysql.connector import pooling, Error as MySQLError
+from mysql.connector import Error as MySQLError
+from mysql.connector import errors as mysql_errors
+
+try:
+    import orjson
+except ImportError:  # NDJSON streaming falls back to the stdlib encoder
+    orjson = None
 
 
 # ----------------------------
@@ -519,19 +549,117 @@ PROXY_PORT = int({PROXY_PORT})
 DB_USER = {DB_USER!r}
 DB_PASSWORD = {DB_PASSWORD!r}
 
+# "sync": def endpoint in the threadpool + mysql-connector
+# "async": async endpoint on the event loop + aiomysql
+EXEC_MODE = {EXEC_MODE!r}
+
 DB_NAME = None
 
 MAX_ROWS = 500
 MAX_RESULT_BYTES = 2_000_000
-
-# Pool sizing
+# Rows per fetchmany() call on the buffered path.
+FETCH_BATCH_ROWS = int(os.environ.get("FETCH_BATCH_ROWS", "100"))
+# Append LIMIT MAX_ROWS+1 (STREAM_MAX_ROWS+1 when streaming) to SELECTs without one.
+LIMIT_PUSHDOWN = os.environ.get("LIMIT_PUSHDOWN", "true").lower() in ("1", "true", "yes")
+
+# Streaming ({{"stream": true}}): NDJSON rows fetched and sent STREAM_BATCH_ROWS
+# at a time, so nothing is buffered beyond one batch. STREAM_MAX_ROWS caps it.
+STREAM_BATCH_ROWS = int(os.environ.get("STREAM_BATCH_ROWS", "500"))
+STREAM_MAX_ROWS = int(os.environ.get("STREAM_MAX_ROWS", "100000"))
+
+# Pool sizing: the pool grows from POOL_MIN_SIZE up to POOL_SIZE under load
+# and shrinks back once connections sit idle for POOL_IDLE_TIMEOUT_S.
 POOL_NAME = os.environ.get("POOL_NAME", "gatekeeper_pool")
 POOL_SIZE = int(os.environ.get("POOL_SIZE", "10"))
-POOL_RESET_SESSION = os.environ.get("POOL_RESET_SESSION", "true").lower() in ("1", "true", "yes")
+POOL_MIN_SIZE = min(POOL_SIZE, int(os.environ.get("POOL_MIN_SIZE", "2")))
+# Session reset when a connection goes back to the pool: "always", "never",
+# or "auto" = only after a statement that may leave state behind (user
+# variables, anything but SELECT/INSERT/UPDATE/DELETE). A reset also drops
+# the connection's prepared statements.
+_reset = os.environ.get("POOL_RESET_SESSION", "auto").lower()
+POOL_RESET_SESSION = (
+    "always" if _reset in ("1", "true", "yes", "always")
+    else "never" if _reset in ("0", "false", "no", "never")
+    else "auto"
+)
+# Requests with "params" run as server-side prepared statements (sync mode);
+# each connection keeps this many prepared, LRU by SQL text.
+PREPARED_CACHE_SIZE = int(os.environ.get("PREPARED_CACHE_SIZE", "64"))
+
+# /batch: statements per request
+BATCH_MAX_STATEMENTS = int(os.environ.get("BATCH_MAX_STATEMENTS", "100"))
+# Checkouts wait in FIFO order for at most this long (then 503) ...
+POOL_CHECKOUT_TIMEOUT_S = float(os.environ.get("POOL_CHECKOUT_TIMEOUT_S", "2.0"))
+# ... and at most this many may wait at once (the rest get 503 right away).
+POOL_MAX_WAITERS = int(os.environ.get("POOL_MAX_WAITERS", "256"))
+POOL_IDLE_TIMEOUT_S = float(os.environ.get("POOL_IDLE_TIMEOUT_S", "60"))
+POOL_VALIDATE_INTERVAL_S = float(os.environ.get("POOL_VALIDATE_INTERVAL_S", "30"))
+POOL_PREWARM = os.environ.get("POOL_PREWARM", "true").lower() in ("1", "true", "yes")
+
+# SELECT result cache: off unless RESULT_CACHE_TTL_S > 0. Writes through this
+# process evict cached reads of the tables they touch; writes through other
+# workers or clients only become visible once the TTL runs out.
+RESULT_CACHE_TTL_S = float(os.environ.get("RESULT_CACHE_TTL_S", "0"))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Singleflight reads: off unless SINGLEFLIGHT=true. Identical plain SELECTs
+# (same normalised text and params) in flight at the same time share one
+# execution; the result goes to every caller.
+SINGLEFLIGHT = os.environ.get("SINGLEFLIGHT", "false").lower() in ("1", "true", "yes")
+
+# Write coalescing (group commit): off unless WRITE_COALESCE_WINDOW_MS > 0.
+# Concurrent single-row INSERTs into the same table and columns are merged
+# into one multi-row INSERT (one commit) once the first has waited this long,
+# or as soon as WRITE_COALESCE_MAX_ROWS rows are waiting.
+WRITE_COALESCE_WINDOW_MS = float(os.environ.get("WRITE_COALESCE_WINDOW_MS", "0"))
+WRITE_COALESCE_MAX_ROWS = int(os.environ.get("WRITE_COALESCE_MAX_ROWS", "50"))
+
+# Hedged reads: off unless HEDGE_READ_HOSTS lists the read replicas
+# ("host[:port],..."), which the Gatekeeper then also connects to directly.
+# A SELECT that is safe to run on a replica and has not answered after the
+# tracked HEDGE_QUANTILE latency is sent to the next replica as well; the first
+# answer wins and the other attempt is killed. At most HEDGE_BUDGET_PCT % of
+# reads are hedged.
+HEDGE_READ_HOSTS = [
+    (host, int(port or 3306))
+    for host, _, port in (h.strip().partition(":") for h in os.environ.get("HEDGE_READ_HOSTS", "").split(","))
+    if host
+]
+HEDGE_QUANTILE = float(os.environ.get("HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_DELAY_MS = float(os.environ.get("HEDGE_MIN_DELAY_MS", "2"))
+HEDGE_BUDGET_PCT = float(os.environ.get("HEDGE_BUDGET_PCT", "5"))
+HEDGE_POOL_SIZE = int(os.environ.get("HEDGE_POOL_SIZE", "4"))  # connections per replica
+
+# Adaptive concurrency limits (AIMD): off unless ADAPTIVE_CONCURRENCY=true.
+# Reads and writes each get an in-flight limit that grows by ~1 per round
+# trip while latency is normal, and shrinks by CONCURRENCY_LIMIT_BACKOFF when
+# latency passes CONCURRENCY_LIMIT_TARGET_MS (0 = CONCURRENCY_LIMIT_TOLERANCE x
+# the long-run average) or the pool/database fails. Over the limit: 503 at once.
+ADAPTIVE_CONCURRENCY = os.environ.get("ADAPTIVE_CONCURRENCY", "false").lower() in ("1", "true", "yes")
+CONCURRENCY_LIMIT_INITIAL = int(os.environ.get("CONCURRENCY_LIMIT_INITIAL", "20"))
+CONCURRENCY_LIMIT_MIN = int(os.environ.get("CONCURRENCY_LIMIT_MIN", "2"))
+CONCURRENCY_LIMIT_READ_MAX = int(os.environ.get("CONCURRENCY_LIMIT_READ_MAX", "200"))
+CONCURRENCY_LIMIT_WRITE_MAX = int(os.environ.get("CONCURRENCY_LIMIT_WRITE_MAX", "100"))
+CONCURRENCY_LIMIT_BACKOFF = float(os.environ.get("CONCURRENCY_LIMIT_BACKOFF", "0.9"))
+CONCURRENCY_LIMIT_TOLERANCE = float(os.environ.get("CONCURRENCY_LIMIT_TOLERANCE", "2.0"))
+CONCURRENCY_LIMIT_TARGET_MS = float(os.environ.get("CONCURRENCY_LIMIT_TARGET_MS", "0"))
+
+# More API keys, each its own client: "name=key[:rate[:burst[:max_inflight]]],...".
+# rate is requests/s (a token bucket holding up to burst, default max(1, rate));
+# max_inflight caps the key's requests at the database at once; 0 = unlimited.
+# Omitted fields, and the inlined API_KEY (client "default"), use the
+# API_KEY_* values. A key over its quota gets 429 with Retry-After.
+API_KEYS = os.environ.get("API_KEYS", "")
+API_KEY_RATE = float(os.environ.get("API_KEY_RATE", "0"))
+API_KEY_BURST = float(os.environ.get("API_KEY_BURST", "0"))
+API_KEY_MAX_INFLIGHT = int(os.environ.get("API_KEY_MAX_INFLIGHT", "0"))
 
 # Policy: allowlist toggle
 STRICT_ALLOWLIST = os.environ.get("STRICT_ALLOWLIST", "true").lower() in ("1", "true", "yes")
 
+if EXEC_MODE == "async":
+    import aiomysql
+
 # Logging
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
 
@@ -541,75 +669,296 @@ logging.basicConfig(
 )
 log = logging.getLogger("gatekeeper")
 
-DENY_REGEX = re.compile(
+# ----------------------------
+# SQL lexer: validation + classification in one pass
+# ----------------------------
+# MySQL tokens that matter for policy. Comments are skipped, except /*! ... */
+# version comments, whose body MySQL executes (so it is lexed as code).
+# String literals and `quoted` identifiers are single tokens, so keywords or
+# ';' inside them don't count.
+TOKEN_RE = re.compile(
     r"""
-    \b(
-        DROP
-        |^DELETE\s+FROM\s+\w+\s*(?:;|\z)
-        |TRUNCATE
-        |ALTER
-        |GRANT
-        |REVOKE
-        |CREATE\s+USER
-        |CREATE\s+ROLE
-        |SET\s+PASSWORD
-        |SHUTDOWN
-        |RELOAD
-        |SUPER
-        |FILE
-        |LOAD\s+DATA
-        |OUTFILE
-        |INFILE
-        |XA
-    )\b
+      (?P<ws>\s+)
+    | (?P<comment>--(?:[ \t\r\n][^\n]*|$)|\#[^\n]*|/\*(?!!).*?\*/)
+    | (?P<vcomment>/\*!\d*|\*/)
+    | (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+    | (?P<quoted>`(?:[^`]|``)*`)
+    | (?P<word>[^\W\d][\w$]*)
+    | (?P<number>\d[\w.]*|\.\d+\w*)
+    | (?P<bad>['"`]|/\*)
+    | (?P<punct>.)
     """,
-    re.IGNORECASE | re.VERBOSE,
+    re.VERBOSE | re.DOTALL,
 )
 
-ALLOW_TOPLEVEL = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE)\b", re.IGNORECASE)
+ALLOWED_STATEMENTS = ("SELECT", "INSERT", "UPDATE", "DELETE")
+FORBIDDEN_WORDS = frozenset((
+    "DROP", "TRUNCATE", "ALTER", "GRANT", "REVOKE", "SHUTDOWN", "RELOAD",
+    "SUPER", "FILE", "OUTFILE", "INFILE", "XA",
+))
+FORBIDDEN_PAIRS = frozenset((("CREATE", "USER"), ("CREATE", "ROLE"), ("SET", "PASSWORD"), ("LOAD", "DATA")))
+# Words after which a table name follows (UPDATE only as the statement itself,
+# not in "ON DUPLICATE KEY UPDATE").
+TABLE_INTRODUCERS = frozenset(("FROM", "JOIN", "INTO"))
+TABLE_MODIFIERS = frozenset(("LOW_PRIORITY", "HIGH_PRIORITY", "DELAYED", "IGNORE", "QUICK"))
+# Words that end a FROM list (after which ',' no longer separates tables).
+FROM_LIST_END = frozenset((
+    "WHERE", "GROUP", "ORDER", "LIMIT", "HAVING", "UNION", "SET", "VALUES",
+    "FOR", "WINDOW", "LOCK", "INTO", "SELECT",
+))
+
+# Top-level words after which "<stmt> LIMIT n" is not valid or not wanted.
+NO_LIMIT_PUSHDOWN = frozenset(("LIMIT", "FOR", "LOCK", "INTO"))
+# A SELECT containing any of these must run where ProxySQL sends it (locking
+# reads go to the manager), never on a replica picked by the Gatekeeper.
+NOT_REPLICA_SAFE = frozenset(("FOR", "LOCK", "INTO", "GET_LOCK", "RELEASE_LOCK", "RELEASE_ALL_LOCKS"))
+# Results depend on when or on which connection they run: never cached, and
+# evaluated once per statement, so never merged into a multi-row INSERT.
+NON_DETERMINISTIC_FUNCTIONS = frozenset((
+    "NOW", "SYSDATE", "CURRENT_TIMESTAMP", "CURRENT_DATE", "CURRENT_TIME", "CURDATE", "CURTIME",
+    "LOCALTIME", "LOCALTIMESTAMP", "UTC_TIMESTAMP", "UTC_DATE", "UTC_TIME", "UNIX_TIMESTAMP",
+    "RAND", "UUID", "UUID_SHORT", "LAST_INSERT_ID", "CONNECTION_ID", "ROW_COUNT", "FOUND_ROWS",
+))
+
+LEX_CACHE_SIZE = int(os.environ.get("LEX_CACHE_SIZE", "4096"))
+LEX_CACHE_MAX_LEN = 4096  # longer statements are lexed every time (keeps the cache small)
+
+
+class SqlInfo(NamedTuple):
+    kind: str                 # "select" | "insert" | "update" | "delete" | "other"
+    tables: Tuple[str, ...]   # referenced tables, lower-case, without schema
+    error_status: int = 0     # HTTP status when the statement is rejected
+    error_detail: str = ""
+    limit_pos: int = -1       # SELECT without LIMIT: offset where one can be appended
+    session_state: bool = False  # may leave state on the connection (see POOL_RESET_SESSION)
+    replica_safe: bool = False   # plain SELECT: any read replica may answer it (hedged reads)
+    nondeterministic: bool = False  # calls NOW(), RAND(), UUID(), ... (never cached)
+
+
+def _reject(status: int, detail: str) -> SqlInfo:
+    return SqlInfo("other", (), status, detail)
+
+
+def _ident(kind: str, text: str) -> str:
+    return text[1:-1].replace("``", "`").lower() if kind == "quoted" else text.lower()
+
+
+def analyze_sql(s: str) -> SqlInfo:
+    """Lex a (stripped) statement once; validate it and extract type and tables."""
+    if not s:
+        return _reject(400, "empty query")
+    if len(s) > 50_000:
+        return _reject(413, "query too large")
+
+    tokens: List[Tuple[str, str]] = []  # (kind, text) for code tokens only
+    pos, n = 0, len(s)
+    end = prev_end = 0  # end offsets of the last two code tokens
+    match = TOKEN_RE.match
+    while pos < n:
+        m = match(s, pos)
+        kind = m.lastgroup
+        pos = m.end()
+        if kind in ("ws", "comment", "vcomment"):
+            continue
+        if kind == "bad":
+            return _reject(400, "unterminated string, identifier or comment")
+        tokens.append((kind, m.group()))
+        prev_end, end = end, pos
+
+    if not tokens:
+        return _reject(400, "empty query")
+    if tokens[-1] == ("punct", ";"):
+        tokens.pop()
+        end = prev_end
+    if ("punct", ";") in tokens:
+        return _reject(403, "query rejected: multiple statements")
+
+    first = tokens[0][1].upper() if tokens[0][0] == "word" else ""
+    qtype = first.lower() if first in ALLOWED_STATEMENTS else "other"
+    if STRICT_ALLOWLIST and qtype == "other":
+        return _reject(403, "query rejected: statement not allowed")
+
+    tables: List[str] = []
+    prev = ""
+    has_where = False
+    expect_table = qtype == "update"
+    # Paren depths of the FROM lists still open; an UPDATE's table list is one too (up to SET).
+    from_lists: List[int] = [0] if qtype == "update" else []
+    depth = 0
+    pushdown = qtype == "select"
+    user_vars = False
+    locking = False
+    volatile = False
+    i = 1 if qtype == "update" else 0
+    while i < len(tokens):
+        kind, text = tokens[i]
+        i += 1
+        if kind == "word":
+            up = text.upper()
+            if up in FORBIDDEN_WORDS or (prev, up) in FORBIDDEN_PAIRS:
+                return _reject(403, "query rejected: forbidden keyword")
+            prev = up
+            if up in NOT_REPLICA_SAFE:
+                locking = True
+            elif up in NON_DETERMINISTIC_FUNCTIONS:
+                volatile = True
+            if depth == 0:
+                if up == "WHERE":
+                    has_where = True
+                elif up in NO_LIMIT_PUSHDOWN:
+                    pushdown = False
+            if up in TABLE_INTRODUCERS:
+                expect_table = True
+                if up == "FROM":
+                    from_lists.append(depth)
+                continue
+            if up in FROM_LIST_END and from_lists and from_lists[-1] == depth:
+                from_lists.pop()
+            if expect_table and up in TABLE_MODIFIERS:
+                continue
+        else:
+            prev = ""
+            if text == "(":
+                depth += 1
+            elif text == ")":
+                depth -= 1
+                while from_lists and from_lists[-1] > depth:
+                    from_lists.pop()
+            elif text == "," and from_lists and from_lists[-1] == depth:
+                expect_table = True
+                continue
+            elif text == "@":
+                user_vars = True
+
+        if expect_table:
+            expect_table = False
+            if kind in ("word", "quoted"):
+                name = _ident(kind, text)
+                # schema.table -> table
+                while (i + 1 < len(tokens) and tokens[i] == ("punct", ".")
+                       and tokens[i + 1][0] in ("word", "quoted")):
+                    name = _ident(*tokens[i + 1])
+                    i += 2
+                if name not in tables:
+                    tables.append(name)
+
+    if qtype == "delete" and not has_where:
+        return _reject(403, "query rejected: DELETE without WHERE")
+    return SqlInfo(
+        qtype,
+        tuple(tables),
+        limit_pos=end if pushdown else -1,
+        session_state=user_vars or qtype == "other",
+        replica_safe=qtype == "select" and not (user_vars or locking),
+        nondeterministic=volatile,
+    )
 
 
-def is_single_statement(sql: str) -> bool:
-    s = sql.strip()
-    if not s:
-        return False
-    if s.endswith(";"):
-        s = s[:-1].rstrip()
-    return ";" not in s
+analyze_sql_cached = functools.lru_cache(maxsize=LEX_CACHE_SIZE)(analyze_sql)
+
+
+def split_insert_row(s: str) -> Optional[Tuple[str, str]]:
+    """
+    "INSERT INTO t (a, b) VALUES (1, 'x')" -> ("INSERT INTO t (a, b) VALUES", "(1, 'x')")
+    for a plain single-row INSERT that can be merged with others into one
+    multi-row INSERT; None for anything else (IGNORE, SET, SELECT, several
+    rows, ON DUPLICATE KEY UPDATE, NOW() or RAND() in the row, ...).
+    """
+    pos, n = 0, len(s)
+    code = 0  # code tokens seen so far
+    head_end = row_start = row_end = -1
+    depth = 0
+    match = TOKEN_RE.match
+    while pos < n:
+        m = match(s, pos)
+        kind = m.lastgroup
+        pos = m.end()
+        if kind in ("ws", "comment"):
+            continue
+        if kind in ("vcomment", "bad"):
+            return None
+        text = m.group()
+        code += 1
+        if row_end >= 0:
+            if text == ";":
+                continue
+            return None
+        if head_end < 0:
+            up = text.upper() if kind == "word" else text
+            if (code == 1 and up != "INSERT") or (code == 2 and up != "INTO"):
+                return None
+            if up == "(":
+                depth += 1
+            elif up == ")":
+                depth -= 1
+            elif depth == 0 and up in ("VALUES", "VALUE"):
+                head_end = pos
+            elif up in ("SELECT", "SET"):
+                return None
+        elif row_start < 0:
+            if text != "(":
+                return None
+            row_start, depth = m.start(), 1
+        elif kind == "word" and text.upper() in NON_DETERMINISTIC_FUNCTIONS:
+            return None
+        elif text == "(":
+            depth += 1
+        elif text == ")":
+            depth -= 1
+            if depth == 0:
+                row_end = pos
+    if row_end < 0:
+        return None
+    return s[:head_end], s[row_start:row_end]
+
+
+split_insert_row_cached = functools.lru_cache(maxsize=LEX_CACHE_SIZE)(split_insert_row)
 
 
 def normalize_sql(sql: str) -> str:
     return sql.strip()
 
 
-def validate_query(sql: str) -> None:
+def with_row_limit(sql: str, info: SqlInfo, limit: int) -> str:
+    """
+    `sql` with LIMIT `limit` appended if it is a SELECT without one, so the
+    backend never produces rows the Gatekeeper would throw away.
+    """
+    if not LIMIT_PUSHDOWN or info.limit_pos < 0:
+        return sql
     s = normalize_sql(sql)
-    if not s:
-        raise HTTPException(status_code=400, detail="empty query")
-    if not is_single_statement(s):
-        raise HTTPException(status_code=403, detail="query rejected: multiple statements")
-    if DENY_REGEX.search(s):
-        raise HTTPException(status_code=403, detail="query rejected: forbidden keyword")
-    if STRICT_ALLOWLIST and not ALLOW_TOPLEVEL.match(s):
-        raise HTTPException(status_code=403, detail="query rejected: statement not allowed")
-    if len(s) > 50_000:
-        raise HTTPException(status_code=413, detail="query too large")
+    return f"{{s[:info.limit_pos]}} LIMIT {{limit}}{{s[info.limit_pos:]}}"
+
+
+def validate_params(params: Optional[List[Any]]) -> None:
+    if params is not None and not all(p is None or isinstance(p, (bool, int, float, str)) for p in params):
+        _metrics.count_rejection("invalid_params")
+        raise HTTPException(status_code=400, detail="params must be a list of numbers, strings, booleans or null")
 
 
-def classify_query(sql: str) -> str:
-    s = normalize_sql(sql).lstrip()
-    m = re.match(r"^(SELECT|INSERT|UPDATE|DELETE)\b", s, flags=re.IGNORECASE)
-    return m.group(1).lower() if m else "other"
+def validate_query(sql: str) -> SqlInfo:
+    """Type and tables of an allowed statement; HTTPException if it is rejected."""
+    s = normalize_sql(sql)
+    info = analyze_sql_cached(s) if len(s) <= LEX_CACHE_MAX_LEN else analyze_sql(s)
+    if info.error_status:
+        _metrics.count_rejection(rejection_reason(info.error_detail))
+        raise HTTPException(status_code=info.error_status, detail=info.error_detail)
+    return info
 
 
 class QueryRequest(BaseModel):
     query: str = Field(..., min_length=1, max_length=50_000)
+    stream: bool = False  # SELECT only: NDJSON rows instead of one JSON document
+    # Values for %s placeholders in `query` (scalars only). Sync mode runs the
+    # statement as a server-side prepared statement; async mode binds them
+    # client-side with the driver's escaping.
+    params: Optional[List[Any]] = None
 
 
 class SelectResponse(BaseModel):
     type: str = "select"
     columns: List[str]
-    rows: List[List[Any]]
+    rows: List[Sequence[Any]]
     row_count: int
     truncated: bool
 
@@ -619,16 +968,1374 @@ class WriteResponse(BaseModel):
     affected_rows: int
 
 
+class BatchStatement(BaseModel):
+    query: str = Field(..., min_length=1, max_length=50_000)
+    params: Optional[List[Any]] = None
+
+
+class BatchRequest(BaseModel):
+    statements: List[BatchStatement]
+    transaction: bool = False  # all or nothing: stop and roll back at the first error
+
+
+class BatchResponse(BaseModel):
+    type: str = "batch"
+    transaction: bool
+    committed: Optional[bool] = None  # transactions only
+    # One entry per statement: {{"status": 200, ...select/write result}} or
+    # {{"status": <http status>, "detail": ...}}; 424 = not run after an earlier failure.
+    results: List[Dict[str, Any]]
+
+
+class StageTimer:
+    """Per-stage durations (monotonic clock) for the Server-Timing header."""
+
+    __slots__ = ("t0", "last", "stages")
+
+    def __init__(self) -> None:
+        self.t0 = self.last = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+
+    def mark(self, name: str) -> None:
+        now = time.perf_counter()
+        self.stages.append((name, (now - self.last) * 1000.0))
+        self.last = now
+
+    def header(self) -> str:
+        total = (time.perf_counter() - self.t0) * 1000.0
+        parts = [f"{{name}};dur={{ms:.3f}}" for name, ms in self.stages]
+        parts.append(f"total;dur={{total:.3f}}")
+        return ", ".join(parts)
+
+
+def timed_json_response(
+    result: BaseModel, timer: StageTimer, headers: Optional[Dict[str, str]] = None
+) -> Response:
+    # Serialise here (same encoding as FastAPI's JSONResponse) so the cost
+    # shows up as its own stage in Server-Timing.
+    body = json.dumps(
+        jsonable_encoder(result),
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+    timer.mark("serialize")
+    return Response(
+        content=body, media_type="application/json", headers={{**(headers or {{}}), "Server-Timing": timer.header()}}
+    )
+
+
+# ----------------------------
+# NDJSON streaming
+# ----------------------------
+# Body: {{"type":"select","columns":[...]}}, then one JSON array per row, then
+# {{"row_count":N,"truncated":bool}}. A database error after the headers went
+# out ends the body with {{"error":"..."}} instead.
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def _json_default(v: Any) -> Any:
+    # Same conversions jsonable_encoder applies to what MySQL drivers return.
+    if isinstance(v, decimal.Decimal):
+        return float(v)
+    if isinstance(v, (dt.datetime, dt.date, dt.time)):
+        return v.isoformat()
+    if isinstance(v, dt.timedelta):
+        return v.total_seconds()
+    if isinstance(v, (bytes, bytearray)):
+        return bytes(v).decode("utf-8", errors="replace")
+    if isinstance(v, (set, frozenset)):
+        return list(v)
+    raise TypeError(f"not JSON serialisable: {{type(v).__name__}}")
+
+
+if orjson is not None:
+    def ndjson_lines(objs: Sequence[Any]) -> bytes:
+        return b"".join([orjson.dumps(o, default=_json_default) + b"\n" for o in objs])
+else:
+    _ndjson_encode = json.JSONEncoder(
+        ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=_json_default
+    ).encode
+
+    def ndjson_lines(objs: Sequence[Any]) -> bytes:
+        return "".join([_ndjson_encode(o) + "\n" for o in objs]).encode("utf-8")
+
+
+class RowStream:
+    """Row cap and framing shared by the sync and async NDJSON generators."""
+
+    __slots__ = ("count", "truncated")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.truncated = False
+
+    def header(self, description) -> bytes:
+        return ndjson_lines([{{"type": "select", "columns": [d[0] for d in (description or [])]}}])
+
+    def batch(self, rows: Sequence[Any]) -> bytes:
+        room = STREAM_MAX_ROWS - self.count
+        if len(rows) > room:
+            rows = rows[:room]
+            self.truncated = True
+        self.count += len(rows)
+        return ndjson_lines(rows)
+
+    def footer(self) -> bytes:
+        return ndjson_lines([{{"row_count": self.count, "truncated": self.truncated}}])
+
+    def error(self, e: Exception) -> bytes:
+        log.warning("stream aborted after %d rows: %s", self.count, e)
+        return ndjson_lines([{{"error": f"sql error: {{e}}"}}])
+
+
+def ndjson_response(body: Any, timer: StageTimer) -> StreamingResponse:
+    # Server-Timing can only cover what happened before the first byte.
+    return StreamingResponse(body, media_type=NDJSON_MEDIA_TYPE, headers={{"Server-Timing": timer.header()}})
+
+
+# ----------------------------
+# Connection pool
+# ----------------------------
+WAIT_BUCKETS_MS = (0.1, 0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class PoolTimeout(Exception):
+    """No connection became free in time, or the wait queue is full."""
+
+
+class WaitStats:
+    """Checkout wait-time histogram (cumulative buckets, ms) and counters."""
+
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.timeouts = 0
+        self.rejected = 0
+
+    def record(self, wait_ms: float) -> None:
+        i = 0
+        while i < len(WAIT_BUCKETS_MS) and wait_ms > WAIT_BUCKETS_MS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.sum_ms += wait_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        hist: Dict[str, int] = {{}}
+        running = 0
+        for le, n in zip(list(WAIT_BUCKETS_MS) + ["+Inf"], self.buckets):
+            running += n
+            hist[str(le)] = running
+        return {{
+            "checkouts": self.count,
+            "wait_ms_sum": round(self.sum_ms, 3),
+            "wait_ms_le": hist,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+        }}
+
+
+class _Waiter:
+    __slots__ = ("event", "cnx", "may_open")
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.cnx: Any = None
+        self.may_open = False  # a slot was freed: open a new connection instead
+
+
+class PooledConnection:
+    """A checked-out connection; close() gives it back to the pool."""
+
+    def __init__(self, pool: "GatekeeperPool", cnx: Any) -> None:
+        self._pool = pool
+        self._cnx = cnx
+        self._returned = False
+        self.session_dirty = False  # a statement may have left session state behind
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cnx, name)
+
+    @property
+    def released(self) -> bool:
+        return self._returned
+
+    def prepared_cursor(self, sql: str) -> Any:
+        return self._pool.prepared_cursor(self._cnx, sql)
+
+    def close(self, discard: bool = False) -> None:
+        if not self._returned:
+            self._returned = True
+            self._pool.release(self._cnx, discard, self.session_dirty)
+
+
+class GatekeeperPool:
+    """
+    mysql-connector pool with a bounded FIFO wait queue.
+
+    get_connection() takes the most recently used idle connection, opens a new
+    one while below max_size, or queues behind earlier callers until one is
+    released (PoolTimeout after checkout_timeout_s, or immediately when
+    max_waiters are already queued). A maintenance thread pings idle
+    connections every validate_interval_s and closes those idle for longer
+    than idle_timeout_s, down to min_size.
+
+    Each connection keeps up to prepared_cache_size prepared cursors (one
+    statement handle each), LRU by SQL text, until it is reset or closed.
+    """
+
+    def __init__(
+        self,
+        connect,
+        min_size: int,
+        max_size: int,
+        checkout_timeout_s: float,
+        max_waiters: int,
+        idle_timeout_s: float,
+        validate_interval_s: float,
+        reset_session: str = "always",
+        prepared_cache_size: int = 64,
+    ) -> None:
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout_s = checkout_timeout_s
+        self.max_waiters = max_waiters
+        self.idle_timeout_s = idle_timeout_s
+        self.validate_interval_s = validate_interval_s
+        self.reset_session = reset_session
+        self.prepared_cache_size = prepared_cache_size
+
+        self._lock = threading.Lock()
+        self._idle: deque = deque()  # (cnx, last_used, last_validated), oldest last_used on the left
+        self._waiters: deque = deque()
+        self._total = 0  # open connections + slots reserved for connections being opened
+        self._in_use = 0
+        self.waits = WaitStats()
+        self.created = 0
+        self.closed = 0
+        self.connect_errors = 0
+        self.validation_failures = 0
+        self._stop = threading.Event()
+        # Only touched by the thread holding the connection, except pop() in _close().
+        self._statements: Dict[Any, "OrderedDict[str, Any]"] = {{}}
+        self.prepared_hits = 0
+        self.prepared_misses = 0
+        self.prepared_evictions = 0
+
+    # -- checkout / release --
+
+    def get_connection(self, timeout_s: Optional[float] = None) -> PooledConnection:
+        t0 = time.perf_counter()
+        waiter = None
+        with self._lock:
+            cnx = self._idle.pop()[0] if self._idle else None
+            may_open = cnx is None and self._total < self.max_size
+            if may_open:
+                self._total += 1
+            elif cnx is None:
+                if len(self._waiters) >= self.max_waiters:
+                    self.waits.rejected += 1
+                    raise PoolTimeout("connection pool wait queue is full")
+                waiter = _Waiter()
+                self._waiters.append(waiter)
+
+        if waiter is not None:
+            waiter.event.wait(self.checkout_timeout_s if timeout_s is None else timeout_s)
+            with self._lock:
+                if waiter.cnx is None and not waiter.may_open:
+                    self._waiters.remove(waiter)
+                    self.waits.timeouts += 1
+                    raise PoolTimeout("no database connection became free in time")
+            cnx, may_open = waiter.cnx, waiter.may_open
+
+        if may_open:
+            try:
+                cnx = self._connect()
+            except Exception:
+                with self._lock:
+                    self.connect_errors += 1
+                    self._free_slot()
+                raise
+            with self._lock:
+                self.created += 1
+
+        with self._lock:
+            self._in_use += 1
+            self.waits.record((time.perf_counter() - t0) * 1000.0)
+        return PooledConnection(self, cnx)
+
+    def release(self, cnx: Any, discard: bool = False, dirty: bool = False) -> None:
+        reset = self.reset_session == "always" or (self.reset_session == "auto" and dirty)
+        if not discard and reset:
+            self._statements.pop(cnx, None)  # the server deallocates them on reset
+            try:
+                cnx.reset_session()
+            except Exception:
+                discard = True
+        if discard:
+            self._close(cnx)
+        with self._lock:
+            self._in_use -= 1
+            if discard:
+                self._free_slot()
+            else:
+                self._put_idle(cnx)
+
+    def _put_idle(self, cnx: Any) -> None:
+        # Caller holds the lock. Hand over to the longest waiter first.
+        if self._waiters:
+            waiter = self._waiters.popleft()
+            waiter.cnx = cnx
+            waiter.event.set()
+        else:
+            now = time.monotonic()
+            self._idle.append((cnx, now, now))
+
+    def _free_slot(self) -> None:
+        # Caller holds the lock. A connection went away: let the longest waiter open a new one.
+        if self._waiters:
+            waiter = self._waiters.popleft()
+            waiter.may_open = True
+            waiter.event.set()
+        else:
+            self._total -= 1
+
+    def prepared_cursor(self, cnx: Any, sql: str) -> Any:
+        stmts = self._statements.get(cnx)
+        if stmts is None:
+            stmts = self._statements[cnx] = OrderedDict()
+        cur = stmts.get(sql)
+        if cur is not None:
+            stmts.move_to_end(sql)
+            with self._lock:
+                self.prepared_hits += 1
+            return cur
+        # Prepared on its first execute() and reused for as long as it stays cached.
+        cur = cnx.cursor(prepared=True)
+        stmts[sql] = cur
+        evicted = None
+        if len(stmts) > self.prepared_cache_size:
+            _, evicted = stmts.popitem(last=False)
+        with self._lock:
+            self.prepared_misses += 1
+            if evicted is not None:
+                self.prepared_evictions += 1
+        if evicted is not None:
+            try:
+                evicted.close()  # COM_STMT_CLOSE
+            except Exception:
+                pass
+        return cur
+
+    def _close(self, cnx: Any) -> None:
+        self._statements.pop(cnx, None)
+        try:
+            cnx.close()
+        except Exception:
+            pass
+        with self._lock:
+            self.closed += 1
+
+    # -- lifecycle --
+
+    def prewarm(self) -> None:
+        """Open min_size connections up front so the first requests don't pay for the handshakes."""
+        opened = []
+        for _ in range(self.min_size):
+            try:
+                opened.append(self._connect())
+            except Exception as e:
+                log.warning("pool prewarm: connect failed: %s", e)
+                break
+        with self._lock:
+            self._total += len(opened)
+            self.created += len(opened)
+            now = time.monotonic()
+            for cnx in opened:
+                self._idle.append((cnx, now, now))
+
+    def start_maintenance(self) -> None:
+        threading.Thread(target=self._maintain, name="pool-maintenance", daemon=True).start()
+
+    def close(self) -> None:
+        self._stop.set()
+        with self._lock:
+            idle = [entry[0] for entry in self._idle]
+            self._idle.clear()
+            self._total -= len(idle)
+        for cnx in idle:
+            self._close(cnx)
+
+    def _maintain(self) -> None:
+        interval = max(0.5, min(self.validate_interval_s, self.idle_timeout_s / 2))
+        while not self._stop.wait(interval):
+            now = time.monotonic()
+            # Shrink: drop the oldest idle connections beyond min_size.
+            expired = []
+            with self._lock:
+                while (self._idle and self._total > self.min_size
+                       and now - self._idle[0][1] > self.idle_timeout_s):
+                    expired.append(self._idle.popleft()[0])
+                    self._total -= 1
+            for cnx in expired:
+                self._close(cnx)
+
+            # Validate: ping idle connections not checked for a while. They are
+            # out of the idle list meanwhile and go back with their last_used
+            # unchanged, so validation alone never keeps a connection alive.
+            with self._lock:
+                stale = [e for e in self._idle if now - e[2] > self.validate_interval_s]
+                for e in stale:
+                    self._idle.remove(e)
+            for cnx, last_used, _ in stale:
+                try:
+                    cnx.ping(reconnect=False)
+                except Exception:
+                    self._close(cnx)
+                    with self._lock:
+                        self.validation_failures += 1
+                        self._free_slot()
+                    continue
+                with self._lock:
+                    if self._waiters:
+                        self._put_idle(cnx)
+                    else:
+                        self._idle.append((cnx, last_used, time.monotonic()))
+                        self._idle = deque(sorted(self._idle, key=lambda e: e[1]))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {{
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "total": self._total,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiters": len(self._waiters),
+                "max_waiters": self.max_waiters,
+                "created": self.created,
+                "closed": self.closed,
+                "connect_errors": self.connect_errors,
+                "validation_failures": self.validation_failures,
+                "prepared_hits": self.prepared_hits,
+                "prepared_misses": self.prepared_misses,
+                "prepared_evictions": self.prepared_evictions,
+                **self.waits.to_dict(),
+            }}
+
+
+# ----------------------------
+# Result cache
+# ----------------------------
+CACHE_ENTRY_OVERHEAD = 256  # rough per-entry bookkeeping cost, in bytes
+
+
+class _CacheEntry:
+    __slots__ = ("body", "tables", "expires", "size")
+
+    def __init__(self, body: bytes, tables: Tuple[str, ...], expires: float, size: int) -> None:
+        self.body = body
+        self.tables = tables
+        self.expires = expires
+        self.size = size
+
+
+class ResultCache:
+    """
+    LRU of serialised SELECT responses keyed by statement text, bounded by
+    bytes, with a TTL and invalidation by table name.
+
+    Every invalidation bumps a per-table generation. A SELECT notes the
+    generations of its tables before it runs and put() drops the result if
+    any of them moved, so a read racing a write never caches stale rows.
+    """
+
+    def __init__(self, ttl_s: float, max_bytes: int) -> None:
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._by_table: Dict[str, Set[str]] = {{}}
+        self._gen: Dict[str, int] = {{}}
+        self._epoch = 0  # bumped by invalidate_all()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= now:
+                self._remove(key, entry)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.body
+
+    def generation(self, tables: Sequence[str]) -> Tuple[int, ...]:
+        with self._lock:
+            return self._generation(tables)
+
+    def _generation(self, tables: Sequence[str]) -> Tuple[int, ...]:
+        return (self._epoch, *(self._gen.get(t, 0) for t in tables))
+
+    def put(self, key: str, tables: Tuple[str, ...], generation: Tuple[int, ...], body: bytes) -> None:
+        size = len(body) + len(key) + CACHE_ENTRY_OVERHEAD
+        if size > self.max_bytes // 4:
+            return  # one huge result would flush most of the cache
+        with self._lock:
+            if self._generation(tables) != generation:
+                return
+            old = self._entries.get(key)
+            if old is not None:
+                self._remove(key, old)
+            self._entries[key] = _CacheEntry(body, tables, time.monotonic() + self.ttl_s, size)
+            self.bytes += size
+            for t in tables:
+                self._by_table.setdefault(t, set()).add(key)
+            while self.bytes > self.max_bytes:
+                oldest, entry = next(iter(self._entries.items()))
+                self._remove(oldest, entry)
+                self.evictions += 1
+
+    def invalidate(self, tables: Sequence[str]) -> None:
+        """Evict results that read any of `tables`; no tables -> evict everything."""
+        if not tables:
+            self.invalidate_all()
+            return
+        with self._lock:
+            for t in tables:
+                self._gen[t] = self._gen.get(t, 0) + 1
+                for key in list(self._by_table.get(t, ())):
+                    self._remove(key, self._entries[key])
+                    self.invalidations += 1
+
+    def invalidate_all(self) -> None:
+        with self._lock:
+            self._epoch += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._by_table.clear()
+            self.bytes = 0
+
+    def _remove(self, key: str, entry: _CacheEntry) -> None:
+        del self._entries[key]
+        self.bytes -= entry.size
+        for t in entry.tables:
+            keys = self._by_table.get(t)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[t]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {{
+                "ttl_s": self.ttl_s,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }}
+
+
+# ----------------------------
+# Write coalescing (group commit)
+# ----------------------------
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class _WriteBatch:
+    __slots__ = ("key", "head", "rows", "params", "full", "done", "results", "started")
+
+    def __init__(self, key: str, head: str, full: Any, done: Any) -> None:
+        self.key = key
+        self.head = head
+        self.rows: List[str] = []
+        self.params: List[Optional[List[Any]]] = []
+        self.full = full  # set once max_rows callers joined: run now
+        self.done = done  # set once results are in
+        self.results: List[Any] = []  # per row: WriteResponse, or the exception to raise
+        self.started = 0.0
+
+    def statement(self) -> Tuple[str, Optional[List[Any]]]:
+        """The merged multi-row INSERT and its parameters."""
+        sql = f"{{self.head}} {{', '.join(self.rows)}}"
+        if self.params[0] is None:
+            return sql, None
+        return sql, [v for p in self.params for v in p]
+
+
+class WriteCoalescer:
+    """
+    Group commit for single-row INSERTs. The first caller for a given
+    "INSERT INTO t (cols) VALUES" opens a batch; callers arriving within
+    window_s (up to max_rows of them) join it. Then one multi-row INSERT
+    runs for all of them and each caller gets its own result.
+
+    The batch runs on the caller that opened it (sync) or on its own task
+    (async), so waiting callers are released even if a request goes away.
+    """
+
+    def __init__(self, window_s: float, max_rows: int) -> None:
+        self.window_s = window_s
+        self.max_rows = max(1, max_rows)
+        self._lock = threading.Lock()
+        self._open: Dict[str, _WriteBatch] = {{}}
+        self.batches = 0
+        self.rows = 0
+        self.fallbacks = 0  # merged INSERT failed; its rows were retried one by one
+        self.sizes = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+        self.added = WaitStats()  # arrival -> batch starts running, per row (ms)
+
+    def _join(self, head: str, row: str, params: Optional[List[Any]], event: Any) -> Tuple[_WriteBatch, int, bool]:
+        # Bound and inline rows can't share a statement.
+        key = head if params is None else head + "\0"
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._open[key] = _WriteBatch(key, head, event(), event())
+            index = len(batch.rows)
+            batch.rows.append(row)
+            batch.params.append(params)
+            if len(batch.rows) >= self.max_rows:
+                del self._open[key]
+                batch.full.set()
+        return batch, index, leader
+
+    def _seal(self, batch: _WriteBatch) -> None:
+        with self._lock:
+            if self._open.get(batch.key) is batch:
+                del self._open[batch.key]
+            # Read under the lock: until the batch left _open, callers could still join it.
+            size = len(batch.rows)
+            i = bisect.bisect_left(BATCH_SIZE_BUCKETS, size)
+            self.batches += 1
+            self.rows += size
+            self.sizes[i] += 1
+        batch.started = time.perf_counter()
+
+    def count_fallback(self) -> None:
+        with self._lock:
+            self.fallbacks += 1
+
+    def _result(self, batch: _WriteBatch, index: int, t0: float) -> BaseModel:
+        with self._lock:
+            self.added.record((batch.started - t0) * 1000.0)
+        result = batch.results[index]
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    def submit(
+        self, head: str, row: str, params: Optional[List[Any]], execute: Callable[[_WriteBatch], List[Any]]
+    ) -> BaseModel:
+        t0 = time.perf_counter()
+        batch, index, leader = self._join(head, row, params, threading.Event)
+        if leader:
+            batch.full.wait(self.window_s)
+            self._seal(batch)
+            try:
+                batch.results = execute(batch)
+            except Exception as e:
+                batch.results = [e] * len(batch.rows)
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+        return self._result(batch, index, t0)
+
+    async def submit_async(
+        self, head: str, row: str, params: Optional[List[Any]], execute: Callable[[_WriteBatch], Awaitable[List[Any]]]
+    ) -> BaseModel:
+        t0 = time.perf_counter()
+        batch, index, leader = self._join(head, row, params, asyncio.Event)
+        if leader:
+            asyncio.ensure_future(self._lead_async(batch, execute))
+        await batch.done.wait()
+        return self._result(batch, index, t0)
+
+    async def _lead_async(self, batch: _WriteBatch, execute: Callable[[_WriteBatch], Awaitable[List[Any]]]) -> None:
+        try:
+            await asyncio.wait_for(batch.full.wait(), self.window_s)
+        except asyncio.TimeoutError:
+            pass
+        self._seal(batch)
+        try:
+            batch.results = await execute(batch)
+        except Exception as e:
+            batch.results = [e] * len(batch.rows)
+        finally:
+            batch.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hist: Dict[str, int] = {{}}
+            running = 0
+            for le, n in zip(list(BATCH_SIZE_BUCKETS) + ["+Inf"], self.sizes):
+                running += n
+                hist[str(le)] = running
+            added = self.added.to_dict()
+            return {{
+                "window_ms": self.window_s * 1000.0,
+                "max_rows": self.max_rows,
+                "open_batches": len(self._open),
+                "batches": self.batches,
+                "rows": self.rows,
+                "mean_batch_size": round(self.rows / self.batches, 3) if self.batches else 0.0,
+                "batch_size_le": hist,
+                "fallbacks": self.fallbacks,
+                "added_wait_ms_sum": added["wait_ms_sum"],
+                "added_wait_ms_le": added["wait_ms_le"],
+            }}
+
+
+# ----------------------------
+# Singleflight reads
+# ----------------------------
+class _Flight:
+    __slots__ = ("tables", "done", "task", "result", "error")
+
+    def __init__(self, tables: Tuple[str, ...]) -> None:
+        self.tables = tables
+        self.done = threading.Event()
+        self.task: Any = None  # async mode: the shared execution
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Identical SELECTs in flight at the same time share one execution: the
+    first caller runs it (sync) or starts it as a task (async), and callers
+    arriving before it finishes get its result or its error.
+
+    A write to a table a flight reads stops new callers from joining it, so
+    a client that saw its write succeed never gets a result started earlier.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {{}}
+        self.executions = 0
+        self.coalesced = 0
+
+    def _join(self, key: str, tables: Tuple[str, ...]) -> Tuple[_Flight, bool]:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = _Flight(tables)
+            self.executions += 1
+            return flight, True
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def do(self, key: str, tables: Tuple[str, ...], fn: Callable[[], Any]) -> Any:
+        flight, leader = self._join(key, tables)
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._forget(key, flight)
+            flight.done.set()
+
+    async def do_async(self, key: str, tables: Tuple[str, ...], fn: Callable[[], Awaitable[Any]]) -> Any:
+        flight, leader = self._join(key, tables)
+        if leader:
+            # Its own task, so a caller that goes away does not cancel the others.
+            flight.task = asyncio.ensure_future(fn())
+            flight.task.add_done_callback(lambda t: self._forget(key, flight) or t.cancelled() or t.exception())
+        return await asyncio.shield(flight.task)
+
+    def invalidate(self, tables: Sequence[str]) -> None:
+        """New callers start a new execution for reads of any of `tables`; no tables -> all reads."""
+        with self._lock:
+            for key, flight in list(self._flights.items()):
+                if not tables or any(t in flight.tables for t in tables):
+                    del self._flights[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {{
+                "in_flight": len(self._flights),
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+            }}
+
+
+# ----------------------------
+# Hedged reads
+# ----------------------------
+HEDGE_WINDOW = 1000        # latency samples kept for the quantile
+HEDGE_MIN_SAMPLES = 100    # no hedging until this many reads were seen
+HEDGE_RECOMPUTE_EVERY = 64
+HEDGE_BUDGET_BURST = 10.0  # hedges that may be saved up while traffic is calm
+
+
+class HedgeCancelled(Exception):
+    """The other attempt already answered."""
+
+
+class _Attempt:
+    """One execution of a hedged read; `cancel()` kills it on the server."""
+
+    __slots__ = ("pool", "lock", "cnx", "running", "cancelled", "elapsed")
+
+    def __init__(self, pool: Any) -> None:
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.cnx: Any = None
+        self.running = False
+        self.cancelled = False
+        self.elapsed = 0.0
+
+
+class Hedger:
+    """
+    Hedging policy: the delay before a read is duplicated (the HEDGE_QUANTILE
+    of recent primary latencies, at least HEDGE_MIN_DELAY_MS), the replica the
+    duplicate goes to (round robin), and the budget. Every eligible read adds
+    budget_ratio tokens and a hedge costs one, so hedges stay below that share
+    of reads even when the backend is slow across the board.
+    """
+
+    def __init__(self, pools: List[Any], quantile: float, min_delay_s: float, budget_ratio: float) -> None:
+        self.pools = pools
+        self.quantile = quantile
+        self.min_delay_s = min_delay_s
+        self.budget_ratio = budget_ratio
+        self._lock = threading.Lock()
+        self._samples: "deque[float]" = deque(maxlen=HEDGE_WINDOW)
+        self._since_recompute = 0
+        self._delay_s: Optional[float] = None
+        self._tokens = 0.0
+        self._next = itertools.count()
+        self.reads = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+        self.cancelled = 0
+
+    def observe(self, latency_s: float, hedge_won: bool = False) -> None:
+        with self._lock:
+            self.hedge_wins += hedge_won
+            self._samples.append(latency_s)
+            self._since_recompute += 1
+            if self._since_recompute >= HEDGE_RECOMPUTE_EVERY and len(self._samples) >= HEDGE_MIN_SAMPLES:
+                self._since_recompute = 0
+                ordered = sorted(self._samples)
+                q = ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+                self._delay_s = max(self.min_delay_s, q)
+
+    def admit(self) -> Optional[float]:
+        """Count a read; its hedge delay, or None while there is no estimate yet."""
+        with self._lock:
+            self.reads += 1
+            self._tokens = min(HEDGE_BUDGET_BURST, self._tokens + self.budget_ratio)
+            return self._delay_s
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens < 1.0:
+                self.budget_denied += 1
+                return False
+            self._tokens -= 1.0
+            self.hedged += 1
+            return True
+
+    def next_pool(self) -> Any:
+        return self.pools[next(self._next) % len(self.pools)]
+
+    def count_cancel(self) -> None:
+        with self._lock:
+            self.cancelled += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {{
+                "replicas": len(self.pools),
+                "delay_ms": round(self._delay_s * 1000.0, 3) if self._delay_s is not None else None,
+                "quantile": self.quantile,
+                "budget_pct": self.budget_ratio * 100.0,
+                "reads": self.reads,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "budget_denied": self.budget_denied,
+                "cancelled": self.cancelled,
+            }}
+
+
+# ----------------------------
+# Adaptive concurrency limits
+# ----------------------------
+LIMIT_SHORT_ALPHA = 0.1    # recent latency (~10 requests)
+LIMIT_LONG_ALPHA = 0.002   # long-run latency (~500 requests), when rising
+
+
+class AdaptiveLimiter:
+    """
+    AIMD in-flight limit for one class of requests. A request that completes
+    while the limit is at least half used adds 1/limit (about +1 per round
+    trip). When the recent latency average passes the threshold, or a request
+    fails with a pool timeout or upstream error, the limit is multiplied by
+    `backoff`, at most once per recent round trip so one slow burst is not
+    punished many times over.
+    """
+
+    def __init__(
+        self, name: str, initial: int, min_limit: int, max_limit: int,
+        backoff: float, tolerance: float, target_s: float,
+    ) -> None:
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.target_s = target_s
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self._short: Optional[float] = None
+        self._long: Optional[float] = None
+        self._last_decrease = 0.0
+        self.admitted = 0
+        self.rejected = 0
+        self.decreases = 0
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.inflight >= int(self.limit):
+                self.rejected += 1
+                return False
+            self.inflight += 1
+            self.admitted += 1
+            return True
+
+    def release(self, latency_s: float, dropped: bool) -> None:
+        now = time.monotonic()
+        with self._lock:
+            saturated = self.inflight * 2 >= self.limit
+            self.inflight -= 1
+            if not dropped:
+                if self._short is None:
+                    self._short = self._long = latency_s
+                else:
+                    self._short += LIMIT_SHORT_ALPHA * (latency_s - self._short)
+                    # The baseline follows improvements quickly and slowdowns slowly, so
+                    # it settles near the unloaded latency even if we start under load.
+                    alpha = LIMIT_SHORT_ALPHA if latency_s < self._long else LIMIT_LONG_ALPHA
+                    self._long += alpha * (latency_s - self._long)
+            threshold = self.target_s or self.tolerance * (self._long or 0.0)
+            slow = self._short is not None and threshold > 0 and self._short > threshold
+            if dropped or slow:
+                if now - self._last_decrease >= (self._short or 0.0):
+                    self.limit = max(float(self.min_limit), self.limit * self.backoff)
+                    self._last_decrease = now
+                    self.decreases += 1
+            elif saturated:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {{
+                "limit": int(self.limit),
+                "inflight": self.inflight,
+                "latency_ms": round(self._short * 1000.0, 3) if self._short is not None else None,
+                "baseline_ms": round(self._long * 1000.0, 3) if self._long is not None else None,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "decreases": self.decreases,
+            }}
+
+
+# ----------------------------
+# API keys and per-key quotas
+# ----------------------------
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`. Refilled lazily on take(): O(1)."""
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def take(self, now: float) -> float:
+        """0 when a token was taken; otherwise the seconds until one will be there."""
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+class ApiClient:
+    """
+    One API key: a request rate (token bucket) and a quota of requests at the
+    database at once. 0 means unlimited for either. Both checks are a few
+    arithmetic operations under the key's own lock, so keys do not contend.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, max_inflight: int) -> None:
+        self.name = name
+        self.rate = rate
+        self.bucket = TokenBucket(rate, burst or max(1.0, rate)) if rate > 0 else None
+        self.max_inflight = max_inflight
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self.admitted = 0
+        self.rate_limited = 0
+        self.concurrency_limited = 0
+
+    def try_admit(self) -> float:
+        """Charge one request: 0 if admitted, otherwise the seconds to wait."""
+        with self._lock:
+            wait = self.bucket.take(time.monotonic()) if self.bucket is not None else 0.0
+            if wait:
+                self.rate_limited += 1
+            else:
+                self.admitted += 1
+            return wait
+
+    def try_enter(self) -> bool:
+        with self._lock:
+            if self.max_inflight and self.inflight >= self.max_inflight:
+                self.concurrency_limited += 1
+                return False
+            self.inflight += 1
+            return True
+
+    def leave(self) -> None:
+        with self._lock:
+            self.inflight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {{
+                "rate": self.rate or None,
+                "burst": self.bucket.burst if self.bucket is not None else None,
+                "max_inflight": self.max_inflight or None,
+                "inflight": self.inflight,
+                "admitted": self.admitted,
+                "rate_limited": self.rate_limited,
+                "concurrency_limited": self.concurrency_limited,
+            }}
+
+
+def parse_api_keys(spec: str, default_key: str) -> Dict[str, ApiClient]:
+    """{{key: client}} for API_KEYS plus the inlined key as "default" (unless API_KEYS lists it)."""
+    clients: Dict[str, ApiClient] = {{}}
+    names: Set[str] = set()
+    for entry in filter(None, (e.strip() for e in spec.split(","))):
+        name, sep, rest = entry.partition("=")
+        key, *limits = rest.split(":")
+        if not sep or not name or not key or len(limits) > 3:
+            raise ValueError(f"API_KEYS: expected name=key[:rate[:burst[:max_inflight]]], got {{name or entry!r}}")
+        if name in names or key in clients:
+            raise ValueError(f"API_KEYS: duplicate name or key for {{name!r}}")
+        limits += [""] * (3 - len(limits))
+        clients[key] = ApiClient(
+            name,
+            float(limits[0]) if limits[0] else API_KEY_RATE,
+            float(limits[1]) if limits[1] else API_KEY_BURST,
+            int(limits[2]) if limits[2] else API_KEY_MAX_INFLIGHT,
+        )
+        names.add(name)
+    if default_key not in clients:
+        if "default" in names:
+            raise ValueError("API_KEYS: the name 'default' is taken by the inlined API_KEY")
+        clients[default_key] = ApiClient("default", API_KEY_RATE, API_KEY_BURST, API_KEY_MAX_INFLIGHT)
+    return clients
+
+
+# ----------------------------
+# Metrics (Prometheus text format)
+# ----------------------------
+METRIC_BUCKETS_S = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Statement type of the request being served, for the request metrics.
+_request_kind: contextvars.ContextVar[str] = contextvars.ContextVar("request_kind", default="none")
+
+
+class _MetricShard:
+    __slots__ = ("requests", "latency", "rejections", "upstream_errors")
+
+    def __init__(self) -> None:
+        self.requests: Dict[Tuple[str, str, int], int] = {{}}
+        self.latency: Dict[Tuple[str, str], List[float]] = {{}}  # per-bucket counts, +Inf, then sum
+        self.rejections: Dict[str, int] = {{}}
+        self.upstream_errors: Dict[str, int] = {{}}
+
+
+class Metrics:
+    """
+    Request counters and latency histograms for /metrics. Each thread writes
+    only to its own shard, so recording takes no lock (the lock guards the
+    shard list: once per thread, and once per scrape). A scrape sums copies
+    of the shards.
+    """
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[_MetricShard] = []
+
+    def _shard(self) -> _MetricShard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = _MetricShard()
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def observe_request(self, endpoint: str, kind: str, status: int, seconds: float) -> None:
+        shard = self._shard()
+        key = (endpoint, kind, status)
+        shard.requests[key] = shard.requests.get(key, 0) + 1
+        hist = shard.latency.get((endpoint, kind))
+        if hist is None:
+            hist = shard.latency[(endpoint, kind)] = [0] * (len(METRIC_BUCKETS_S) + 1) + [0.0]
+        hist[bisect.bisect_left(METRIC_BUCKETS_S, seconds)] += 1
+        hist[-1] += seconds
+
+    def count_rejection(self, reason: str) -> None:
+        shard = self._shard()
+        shard.rejections[reason] = shard.rejections.get(reason, 0) + 1
+
+    def count_upstream_error(self, error: str) -> None:
+        shard = self._shard()
+        shard.upstream_errors[error] = shard.upstream_errors.get(error, 0) + 1
+
+    def snapshot(self) -> Tuple[Dict[Any, int], Dict[Any, List[float]], Dict[str, int], Dict[str, int]]:
+        with self._lock:
+            shards = list(self._shards)
+        requests: Dict[Any, int] = {{}}
+        latency: Dict[Any, List[float]] = {{}}
+        rejections: Dict[str, int] = {{}}
+        upstream: Dict[str, int] = {{}}
+        for shard in shards:
+            for total, part in ((requests, shard.requests), (rejections, shard.rejections),
+                                (upstream, shard.upstream_errors)):
+                for key, n in part.copy().items():
+                    total[key] = total.get(key, 0) + n
+            for key, hist in shard.latency.copy().items():
+                merged = latency.setdefault(key, [0] * len(hist))
+                for i, v in enumerate(list(hist)):
+                    merged[i] += v
+        return requests, latency, rejections, upstream
+
+
+def _labels(**labels: Any) -> str:
+    def esc(v: Any) -> str:
+        return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{{" + ",".join(f'{{k}}="{{esc(v)}}"' for k, v in labels.items()) + "}}"
+
+
+def rejection_reason(detail: str) -> str:
+    """'query rejected: forbidden keyword' -> 'forbidden_keyword'."""
+    return re.sub(r"\W+", "_", detail.split(": ", 1)[-1]).strip("_").lower()
+
+
+def render_metrics(
+    metrics: Metrics,
+    pool: Dict[str, Any],
+    limiters: Optional[Dict[str, AdaptiveLimiter]] = None,
+    clients: Sequence[ApiClient] = (),
+    flights: Optional[SingleFlight] = None,
+) -> str:
+    requests, latency, rejections, upstream = metrics.snapshot()
+    out: List[str] = []
+
+    def family(name: str, kind: str, help_text: str) -> None:
+        out.append(f"# HELP {{name}} {{help_text}}")
+        out.append(f"# TYPE {{name}} {{kind}}")
+
+    family("gatekeeper_requests_total", "counter", "Requests by endpoint, statement type and HTTP status.")
+    for (endpoint, kind, status), n in sorted(requests.items()):
+        out.append(f"gatekeeper_requests_total{{_labels(endpoint=endpoint, type=kind, status=status)}} {{n}}")
+
+    family("gatekeeper_request_duration_seconds", "histogram", "Time spent in the Gatekeeper per request.")
+    for (endpoint, kind), hist in sorted(latency.items()):
+        running = 0
+        for le, n in zip(list(METRIC_BUCKETS_S) + ["+Inf"], hist[:-1]):
+            running += n
+            labels = _labels(endpoint=endpoint, type=kind, le=le)
+            out.append(f"gatekeeper_request_duration_seconds_bucket{{labels}} {{running}}")
+        labels = _labels(endpoint=endpoint, type=kind)
+        out.append(f"gatekeeper_request_duration_seconds_sum{{labels}} {{hist[-1]:.6f}}")
+        out.append(f"gatekeeper_request_duration_seconds_count{{labels}} {{running}}")
+
+    family("gatekeeper_rejections_total", "counter", "Requests refused before reaching the database, by reason.")
+    for reason, n in sorted(rejections.items()):
+        out.append(f"gatekeeper_rejections_total{{_labels(reason=reason)}} {{n}}")
+
+    family("gatekeeper_upstream_errors_total", "counter", "Errors from ProxySQL/MySQL or the pool, by error class.")
+    for error, n in sorted(upstream.items()):
+        out.append(f"gatekeeper_upstream_errors_total{{_labels(error=error)}} {{n}}")
+
+    family("gatekeeper_pool_connections", "gauge", "Database connections by state.")
+    out.append(f'gatekeeper_pool_connections{{{{state="in_use"}}}} {{pool["in_use"]}}')
+    out.append(f'gatekeeper_pool_connections{{{{state="idle"}}}} {{pool["idle"]}}')
+    family("gatekeeper_pool_max_connections", "gauge", "Pool size limit.")
+    out.append(f"gatekeeper_pool_max_connections {{pool['max_size']}}")
+    family("gatekeeper_pool_waiters", "gauge", "Requests waiting for a connection.")
+    out.append(f"gatekeeper_pool_waiters {{pool['waiters']}}")
+    family("gatekeeper_pool_checkout_timeouts_total", "counter", "Checkouts that gave up waiting.")
+    out.append(f"gatekeeper_pool_checkout_timeouts_total {{pool['timeouts']}}")
+    family("gatekeeper_pool_checkout_rejected_total", "counter", "Checkouts refused because the wait queue was full.")
+    out.append(f"gatekeeper_pool_checkout_rejected_total {{pool['rejected']}}")
+    family("gatekeeper_pool_checkout_wait_seconds", "histogram", "Time spent waiting for a connection.")
+    for le, n in pool["wait_ms_le"].items():
+        le_s = le if le == "+Inf" else float(le) / 1000.0
+        out.append(f"gatekeeper_pool_checkout_wait_seconds_bucket{{_labels(le=le_s)}} {{n}}")
+    out.append(f"gatekeeper_pool_checkout_wait_seconds_sum {{pool['wait_ms_sum'] / 1000.0:.6f}}")
+    out.append(f"gatekeeper_pool_checkout_wait_seconds_count {{pool['checkouts']}}")
+
+    if limiters:
+        family("gatekeeper_concurrency_limit", "gauge", "Adaptive in-flight limit, by request class.")
+        for name, limiter in limiters.items():
+            out.append(f"gatekeeper_concurrency_limit{{_labels(request_class=name)}} {{int(limiter.limit)}}")
+        family("gatekeeper_concurrency_inflight", "gauge", "Requests holding a concurrency slot, by request class.")
+        for name, limiter in limiters.items():
+            out.append(f"gatekeeper_concurrency_inflight{{_labels(request_class=name)}} {{limiter.inflight}}")
+        family("gatekeeper_concurrency_shed_total", "counter", "Requests refused with 503 by the concurrency limit.")
+        for name, limiter in limiters.items():
+            out.append(f"gatekeeper_concurrency_shed_total{{_labels(request_class=name)}} {{limiter.rejected}}")
+
+    if clients:
+        family("gatekeeper_api_key_requests_total", "counter",
+               "Requests by API key name: admitted, or refused with 429 by its rate or in-flight quota.")
+        for client in clients:
+            for outcome, n in (("admitted", client.admitted), ("rate_limited", client.rate_limited),
+                               ("concurrency_limited", client.concurrency_limited)):
+                out.append(f"gatekeeper_api_key_requests_total{{_labels(key=client.name, outcome=outcome)}} {{n}}")
+        family("gatekeeper_api_key_inflight", "gauge", "Requests at the database, by API key name.")
+        for client in clients:
+            out.append(f"gatekeeper_api_key_inflight{{_labels(key=client.name)}} {{client.inflight}}")
+
+    if flights is not None:
+        family("gatekeeper_singleflight_executions_total", "counter", "SELECTs executed on behalf of a flight.")
+        out.append(f"gatekeeper_singleflight_executions_total {{flights.executions}}")
+        family("gatekeeper_singleflight_coalesced_total", "counter",
+               "SELECTs answered by joining an identical one already in flight.")
+        out.append(f"gatekeeper_singleflight_coalesced_total {{flights.coalesced}}")
+    return "\n".join(out) + "\n"
+
+
+def instrumented(endpoint: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Wrap an endpoint so its requests show up in /metrics (status and latency)."""
+
+    def record(t0: float, status: int) -> None:
+        _metrics.observe_request(endpoint, _request_kind.get(), status, time.perf_counter() - t0)
+
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            t0, status = time.perf_counter(), 500
+            token = _request_kind.set("none")
+            try:
+                response = await fn(*args, **kwargs)
+                status = getattr(response, "status_code", 200)
+                return response
+            except HTTPException as e:
+                status = e.status_code
+                raise
+            finally:
+                record(t0, status)
+                _request_kind.reset(token)
+    else:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            t0, status = time.perf_counter(), 500
+            token = _request_kind.set("none")
+            try:
+                response = fn(*args, **kwargs)
+                status = getattr(response, "status_code", 200)
+                return response
+            except HTTPException as e:
+                status = e.status_code
+                raise
+            finally:
+                record(t0, status)
+                _request_kind.reset(token)
+    return wrapper
+
+
 app = FastAPI(title="DB Gatekeeper", version="1.0")
-_pool: Optional[pooling.MySQLConnectionPool] = None
+_pool: Optional[GatekeeperPool] = None
+_apool: Any = None  # aiomysql.Pool in async mode
+_apool_waits = WaitStats()
+_apool_waiting = 0
+_cache: Optional[ResultCache] = (
+    ResultCache(RESULT_CACHE_TTL_S, RESULT_CACHE_MAX_BYTES) if RESULT_CACHE_TTL_S > 0 else None
+)
+_metrics = Metrics()
+_clients = parse_api_keys(API_KEYS, API_KEY)
+_limiters: Optional[Dict[str, AdaptiveLimiter]] = {{
+    "read": AdaptiveLimiter(
+        "read", CONCURRENCY_LIMIT_INITIAL, CONCURRENCY_LIMIT_MIN, CONCURRENCY_LIMIT_READ_MAX,
+        CONCURRENCY_LIMIT_BACKOFF, CONCURRENCY_LIMIT_TOLERANCE, CONCURRENCY_LIMIT_TARGET_MS / 1000.0,
+    ),
+    "write": AdaptiveLimiter(
+        "write", CONCURRENCY_LIMIT_INITIAL, CONCURRENCY_LIMIT_MIN, CONCURRENCY_LIMIT_WRITE_MAX,
+        CONCURRENCY_LIMIT_BACKOFF, CONCURRENCY_LIMIT_TOLERANCE, CONCURRENCY_LIMIT_TARGET_MS / 1000.0,
+    ),
+}} if ADAPTIVE_CONCURRENCY else None
+_hedger: Optional[Hedger] = None  # created at startup when HEDGE_READ_HOSTS is set
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+_flights: Optional[SingleFlight] = SingleFlight() if SINGLEFLIGHT else None
+_coalescer: Optional[WriteCoalescer] = (
+    WriteCoalescer(WRITE_COALESCE_WINDOW_MS / 1000.0, WRITE_COALESCE_MAX_ROWS) if WRITE_COALESCE_WINDOW_MS > 0 else None
+)
+
 
+def require_env() -> None:
+    missing = [name for name, value in (("PROXY_HOST", PROXY_HOST), ("DB_USER", DB_USER)) if not value]
+    if missing:
+        raise RuntimeError(f"missing gatekeeper config: {{', '.join(missing)}}")
 
 
-def create_pool() -> pooling.MySQLConnectionPool:
+def create_pool(
+    host: str = PROXY_HOST, port: int = PROXY_PORT, max_size: int = POOL_SIZE, min_size: int = POOL_MIN_SIZE
+) -> GatekeeperPool:
     require_env()
     conn_kwargs = dict(
-        host=PROXY_HOST,
-        port=PROXY_PORT,
+        host=host,
+        port=port,
         user=DB_USER,
         password=DB_PASSWORD,
         autocommit=True,
@@ -637,23 +2344,120 @@ def create_pool() -> pooling.MySQLConnectionPool:
     if DB_NAME:
         conn_kwargs["database"] = DB_NAME
 
-    return mysql.connector.pooling.MySQLConnectionPool(
-        pool_name=POOL_NAME,
-        pool_size=POOL_SIZE,
-        pool_reset_session=POOL_RESET_SESSION,
-        **conn_kwargs,
+    pool = GatekeeperPool(
+        connect=lambda: mysql.connector.connect(**conn_kwargs),
+        min_size=min_size,
+        max_size=max_size,
+        checkout_timeout_s=POOL_CHECKOUT_TIMEOUT_S,
+        max_waiters=POOL_MAX_WAITERS,
+        idle_timeout_s=POOL_IDLE_TIMEOUT_S,
+        validate_interval_s=POOL_VALIDATE_INTERVAL_S,
+        reset_session=POOL_RESET_SESSION,
+        prepared_cache_size=PREPARED_CACHE_SIZE,
     )
+    if POOL_PREWARM:
+        pool.prewarm()
+    pool.start_maintenance()
+    return pool
 
 
-@app.on_event("startup")
-def on_startup() -> None:
-    global _pool
-    _pool = create_pool()
-    log.info("Gatekeeper started. proxy=%s:%s pool_size=%s", PROXY_HOST, PROXY_PORT, POOL_SIZE)
+async def create_async_pool(
+    host: str = PROXY_HOST, port: int = PROXY_PORT, maxsize: int = POOL_SIZE, minsize: int = POOL_MIN_SIZE
+) -> Any:
+    require_env()
+    return await aiomysql.create_pool(
+        host=host,
+        port=port,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        db=DB_NAME,
+        autocommit=True,
+        connect_timeout=5,
+        minsize=minsize if POOL_PREWARM else 0,
+        maxsize=maxsize,
+        pool_recycle=POOL_IDLE_TIMEOUT_S,
+    )
 
 
-@app.get("/health")
-def health() -> Dict[str, Any]:
+async def acquire_async() -> Any:
+    """aiomysql checkout with the same timeout (and wait stats) as the sync pool."""
+    global _apool_waiting
+    assert _apool is not None
+    if _apool.freesize == 0 and _apool.size >= _apool.maxsize and _apool_waiting >= POOL_MAX_WAITERS:
+        _apool_waits.rejected += 1
+        raise PoolTimeout("connection pool wait queue is full")
+    t0 = time.perf_counter()
+    _apool_waiting += 1
+    try:
+        cnx = await asyncio.wait_for(_apool.acquire(), POOL_CHECKOUT_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        _apool_waits.timeouts += 1
+        raise PoolTimeout("no database connection became free in time")
+    finally:
+        _apool_waiting -= 1
+    _apool_waits.record((time.perf_counter() - t0) * 1000.0)
+    return cnx
+
+
+def pool_stats() -> Dict[str, Any]:
+    if EXEC_MODE == "async":
+        assert _apool is not None
+        return {{
+            "min_size": _apool.minsize,
+            "max_size": _apool.maxsize,
+            "total": _apool.size,
+            "in_use": _apool.size - _apool.freesize,
+            "idle": _apool.freesize,
+            "waiters": _apool_waiting,
+            "max_waiters": POOL_MAX_WAITERS,
+            **_apool_waits.to_dict(),
+        }}
+    assert _pool is not None
+    return _pool.stats()
+
+
+@app.on_event("startup")
+async def on_startup() -> None:
+    global _pool, _apool, _hedger, _hedge_executor
+    if EXEC_MODE == "async":
+        _apool = await create_async_pool()
+        replicas = [await create_async_pool(h, p, HEDGE_POOL_SIZE, 1) for h, p in HEDGE_READ_HOSTS]
+    else:
+        _pool = create_pool()
+        replicas = [create_pool(h, p, HEDGE_POOL_SIZE, 1) for h, p in HEDGE_READ_HOSTS]
+        if replicas:
+            # Both attempts of a hedged read run here; the request thread waits for the first.
+            _hedge_executor = ThreadPoolExecutor(
+                max_workers=POOL_SIZE + HEDGE_POOL_SIZE * len(replicas), thread_name_prefix="hedge"
+            )
+    if replicas:
+        _hedger = Hedger(replicas, HEDGE_QUANTILE, HEDGE_MIN_DELAY_MS / 1000.0, HEDGE_BUDGET_PCT / 100.0)
+        log.info("Hedged reads enabled across %s", ", ".join(f"{{h}}:{{p}}" for h, p in HEDGE_READ_HOSTS))
+    log.info("Gatekeeper started. mode=%s proxy=%s:%s pool_size=%s", EXEC_MODE, PROXY_HOST, PROXY_PORT, POOL_SIZE)
+
+
+@app.on_event("shutdown")
+async def on_shutdown() -> None:
+    if _pool is not None:
+        _pool.close()
+    if _apool is not None:
+        _apool.close()
+        await _apool.wait_closed()
+    if _hedger is not None:
+        for replica in _hedger.pools:
+            replica.close()
+            if EXEC_MODE == "async":
+                await replica.wait_closed()
+    if _hedge_executor is not None:
+        _hedge_executor.shutdown(wait=False)
+
+
+def health(deep: bool = False) -> Dict[str, Any]:
+    """Cheap liveness check; ?deep=true also runs SELECT 1 through the pool."""
+    if not deep:
+        if _pool is None:
+            raise HTTPException(status_code=503, detail="unhealthy: pool not started")
+        return {{"ok": True}}
     try:
         assert _pool is not None
         cnx = _pool.get_connection()
@@ -668,29 +2472,110 @@ def health() -> Dict[str, Any]:
         raise HTTPException(status_code=503, detail=f"unhealthy: {{e}}")
 
 
-def auth_or_401(x_api_key: Optional[str]) -> None:
-    if not x_api_key or x_api_key != API_KEY:
+async def health_async(deep: bool = False) -> Dict[str, Any]:
+    if not deep:
+        if _apool is None:
+            raise HTTPException(status_code=503, detail="unhealthy: pool not started")
+        return {{"ok": True}}
+    try:
+        cnx = await acquire_async()
+        try:
+            async with cnx.cursor() as cur:
+                await cur.execute("SELECT 1")
+                await cur.fetchone()
+        finally:
+            _apool.release(cnx)
+        return {{"ok": True}}
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"unhealthy: {{e}}")
+
+
+def auth_or_401(x_api_key: Optional[str], charge: bool = True) -> ApiClient:
+    """The caller's client. 401 for an unknown key; with `charge`, 429 when it is over its rate."""
+    client = _clients.get(x_api_key) if x_api_key else None
+    if client is None:
+        _metrics.count_rejection("unauthorized")
         raise HTTPException(status_code=401, detail="unauthorized")
+    if charge:
+        wait = client.try_admit()
+        if wait:
+            _metrics.count_rejection("rate_limit")
+            raise HTTPException(
+                status_code=429, detail=f"rate limit exceeded for key {{client.name!r}}",
+                headers={{"Retry-After": str(math.ceil(wait))}},
+            )
+    return client
+
+
+def enter_or_429(client: ApiClient) -> None:
+    """Take one of the key's in-flight slots (give it back with client.leave())."""
+    if not client.try_enter():
+        _metrics.count_rejection("key_concurrency_limit")
+        raise HTTPException(
+            status_code=429, detail=f"too many concurrent requests for key {{client.name!r}}",
+            headers={{"Retry-After": "1"}},
+        )
+
+
+def fetch_all_limited(cur) -> Tuple[List[str], List[Sequence[Any]], bool]:
+    return limit_rows(cur.description, itertools.chain.from_iterable(iter_batches(cur.fetchmany, MAX_ROWS + 1)))
+
+
+async def fetch_all_limited_async(cur) -> Tuple[List[str], List[Sequence[Any]], bool]:
+    # aiomysql's default cursor has already buffered the result in execute().
+    return limit_rows(cur.description, await cur.fetchmany(MAX_ROWS + 1))
+
+
+def iter_batches(fetchmany, total: int, size: int = FETCH_BATCH_ROWS) -> Iterator[Sequence[Any]]:
+    """fetchmany() batches until `total` rows or the end of the result."""
+    while total > 0:
+        rows = fetchmany(min(size, total))
+        if not rows:
+            return
+        total -= len(rows)
+        yield rows
+
+
+# Rough JSON size of fixed-width values; str/bytes are measured, anything
+# else falls back to len(str(v)).
+VALUE_SIZES = {{
+    int: 8,
+    float: 12,
+    bool: 5,
+    type(None): 4,
+    decimal.Decimal: 16,
+    dt.datetime: 28,
+    dt.date: 12,
+    dt.time: 17,
+    dt.timedelta: 12,
+}}
+
 
+def row_size(row: Sequence[Any]) -> int:
+    get = VALUE_SIZES.get
+    n = 0
+    for v in row:
+        size = get(type(v))
+        if size is None:
+            size = len(v) if isinstance(v, (str, bytes, bytearray)) else len(str(v))
+        n += size
+    return n
 
-def fetch_all_limited(cur) -> Tuple[List[str], List[List[Any]], bool]:
-    columns = [desc[0] for desc in (cur.description or [])]
-    rows: List[List[Any]] = []
+
+def limit_rows(description, source) -> Tuple[List[str], List[Sequence[Any]], bool]:
+    columns = [desc[0] for desc in (description or [])]
+    rows: List[Sequence[Any]] = []
     truncated = False
     approx_bytes = 0
 
-    for _ in range(MAX_ROWS + 1):
-        row = cur.fetchone()
-        if row is None:
-            break
+    for row in itertools.islice(source, MAX_ROWS + 1):
         if len(rows) >= MAX_ROWS:
             truncated = True
             break
 
-        row_list = list(row)
-        rows.append(row_list)
+        rows.append(row)
 
-        approx_bytes += sum(len(str(v)) for v in row_list)
+        approx_bytes += row_size(row)
         if approx_bytes > MAX_RESULT_BYTES:
             truncated = True
             break
@@ -698,45 +2583,847 @@ def fetch_all_limited(cur) -> Tuple[List[str], List[List[Any]], bool]:
     return columns, rows, truncated
 
 
-@app.post("/query", response_model=Any)
+def cache_key(sql: str, params: Optional[List[Any]]) -> str:
+    s = normalize_sql(sql)
+    return s if params is None else s + "\0" + json.dumps(params, separators=(",", ":"))
+
+
+def cache_probe(key: str, info: SqlInfo, timer: StageTimer) -> Tuple[Optional[Response], Optional[Tuple[int, ...]]]:
+    """
+    (cached response, None) on a hit; (None, table generations) on a cacheable
+    miss; (None, None) when the cache is off or the statement is not a plain
+    SELECT of tables with a deterministic result: locking reads, user
+    variables, NOW()/RAND()/... and table-less SELECTs (no write would ever
+    evict them) always run.
+    """
+    if _cache is None or not info.replica_safe or info.nondeterministic or not info.tables:
+        return None, None
+    body = _cache.get(key)
+    if body is None:
+        return None, _cache.generation(info.tables)
+    timer.mark("cache")
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={{"X-Cache": "HIT", "Server-Timing": timer.header()}},
+    ), None
+
+
+def cache_store(key: str, info: SqlInfo, generation: Optional[Tuple[int, ...]], response: Response) -> None:
+    if _cache is not None and generation is not None:
+        _cache.put(key, info.tables, generation, response.body)
+
+
+def cache_invalidate(info: SqlInfo) -> None:
+    # Runs after every write attempt: with autocommit a failed call may still
+    # have changed rows. Unclassified statements flush everything.
+    if info.kind == "select":
+        return
+    tables = info.tables if info.kind != "other" else ()
+    if _cache is not None:
+        _cache.invalidate(tables)
+    if _flights is not None:
+        _flights.invalidate(tables)
+
+
+@contextlib.contextmanager
+def concurrency_slot(kind: str, client: ApiClient) -> Iterator[None]:
+    """
+    Hold one of the caller's in-flight slots (429 when its key is at quota) and
+    a read (SELECT) or write slot of the adaptive limit (503 with Retry-After
+    at once when none is free) for the database part of a request.
+    """
+    enter_or_429(client)
+    try:
+        with adaptive_slot(kind):
+            yield
+    finally:
+        client.leave()
+
+
+@contextlib.contextmanager
+def adaptive_slot(kind: str) -> Iterator[None]:
+    limiter = _limiters["read" if kind == "select" else "write"] if _limiters is not None else None
+    if limiter is None:
+        yield
+        return
+    if not limiter.try_acquire():
+        _metrics.count_rejection("concurrency_limit")
+        raise HTTPException(
+            status_code=503, detail=f"overloaded: too many concurrent {{limiter.name}}s", headers={{"Retry-After": "1"}}
+        )
+    t0 = time.perf_counter()
+    dropped = True
+    try:
+        yield
+        dropped = False
+    except HTTPException as e:
+        # Pool timeouts (503) and upstream failures (502) are overload signals; SQL errors are not.
+        dropped = e.status_code in (502, 503)
+        raise
+    finally:
+        limiter.release(time.perf_counter() - t0, dropped)
+
+
+def coalescable_insert(sql: str, info: SqlInfo) -> Optional[Tuple[str, str]]:
+    """(head, row) when write coalescing is on and `sql` is a single-row INSERT it can merge."""
+    if _coalescer is None or info.kind != "insert" or info.session_state:
+        return None
+    s = normalize_sql(sql)
+    return split_insert_row_cached(s) if len(s) <= LEX_CACHE_MAX_LEN else split_insert_row(s)
+
+
+def run_insert_batch(batch: _WriteBatch) -> List[Any]:
+    """One multi-row INSERT for a coalesced batch; row by row if it fails, so one bad row fails alone."""
+    assert _pool is not None and _coalescer is not None
+    cnx = _pool.get_connection()
+    try:
+        if len(batch.rows) > 1:
+            try:
+                cnx.cursor().execute(*batch.statement())
+                return [WriteResponse(affected_rows=1)] * len(batch.rows)
+            except (mysql_errors.OperationalError, mysql_errors.InterfaceError):
+                raise
+            except MySQLError:
+                _coalescer.count_fallback()
+        results: List[Any] = []
+        for i, (row, params) in enumerate(zip(batch.rows, batch.params)):
+            try:
+                cur = cnx.cursor()
+                cur.execute(f"{{batch.head}} {{row}}", params)
+                results.append(WriteResponse(affected_rows=max(0, int(cur.rowcount or 0))))
+            except (mysql_errors.OperationalError, mysql_errors.InterfaceError) as e:
+                cnx.close(discard=True)
+                results.extend([e] * (len(batch.rows) - i))
+                break
+            except MySQLError as e:
+                results.append(e)
+        return results
+    except (mysql_errors.OperationalError, mysql_errors.InterfaceError):
+        cnx.close(discard=True)
+        raise
+    finally:
+        cnx.close()
+
+
+async def run_insert_batch_async(batch: _WriteBatch) -> List[Any]:
+    assert _coalescer is not None
+    cnx = await acquire_async()
+    try:
+        if len(batch.rows) > 1:
+            try:
+                async with cnx.cursor() as cur:
+                    await cur.execute(*batch.statement())
+                return [WriteResponse(affected_rows=1)] * len(batch.rows)
+            except aiomysql.OperationalError:
+                raise
+            except aiomysql.MySQLError:
+                _coalescer.count_fallback()
+        results: List[Any] = []
+        for i, (row, params) in enumerate(zip(batch.rows, batch.params)):
+            try:
+                async with cnx.cursor() as cur:
+                    await cur.execute(f"{{batch.head}} {{row}}", params)
+                    results.append(WriteResponse(affected_rows=max(0, int(cur.rowcount or 0))))
+            except aiomysql.OperationalError as e:
+                cnx.close()
+                results.extend([e] * (len(batch.rows) - i))
+                break
+            except aiomysql.MySQLError as e:
+                results.append(e)
+        return results
+    except aiomysql.OperationalError:
+        cnx.close()
+        raise
+    finally:
+        _apool.release(cnx)
+
+
+def run_statement(
+    cnx: PooledConnection,
+    sql: str,
+    params: Optional[List[Any]],
+    info: SqlInfo,
+    timer: Optional[StageTimer] = None,
+    keep_connection: bool = False,
+) -> BaseModel:
+    """
+    Execute one validated statement on a checked-out connection. With
+    `keep_connection` a truncated result is always read to the end, so the
+    connection stays usable for the next statement (/batch).
+    """
+    stmt = with_row_limit(sql, info, MAX_ROWS + 1)
+    cur = cnx.prepared_cursor(stmt) if params is not None else cnx.cursor()
+    cur.execute(stmt, params)
+    if timer is not None:
+        timer.mark("execute")
+
+    if info.kind != "select":
+        affected = cur.rowcount if cur.rowcount is not None else 0
+        return WriteResponse(affected_rows=int(affected))
+    cols, rows, truncated = fetch_all_limited(cur)
+    if truncated:
+        if keep_connection:
+            cur.fetchall()
+        else:
+            drain_or_discard(cnx, cur, info)
+    if timer is not None:
+        timer.mark("fetch")
+    return SelectResponse(columns=cols, rows=rows, row_count=len(rows), truncated=truncated)
+
+
+async def run_statement_async(
+    cnx: Any, sql: str, params: Optional[List[Any]], info: SqlInfo, timer: Optional[StageTimer] = None
+) -> BaseModel:
+    async with cnx.cursor() as cur:
+        await cur.execute(with_row_limit(sql, info, MAX_ROWS + 1), params)
+        if timer is not None:
+            timer.mark("execute")
+
+        if info.kind != "select":
+            affected = cur.rowcount if cur.rowcount is not None else 0
+            return WriteResponse(affected_rows=max(0, int(affected)))
+        cols, rows, truncated = await fetch_all_limited_async(cur)
+        if timer is not None:
+            timer.mark("fetch")
+        return SelectResponse(columns=cols, rows=rows, row_count=len(rows), truncated=truncated)
+
+
+def select_attempt(attempt: _Attempt, sql: str, params: Optional[List[Any]], info: SqlInfo) -> BaseModel:
+    t0 = time.perf_counter()
+    cnx = attempt.pool.get_connection()
+    discard = False
+    try:
+        with attempt.lock:
+            if attempt.cancelled:
+                raise HedgeCancelled("the other attempt already answered")
+            attempt.cnx, attempt.running = cnx, True
+        result = run_statement(cnx, sql, params, info)
+        attempt.elapsed = time.perf_counter() - t0
+        return result
+    except (mysql_errors.OperationalError, mysql_errors.InterfaceError):
+        discard = True
+        raise
+    finally:
+        with attempt.lock:
+            # A connection that is (or is about to be) killed never goes back to the pool.
+            discard = discard or (attempt.cancelled and attempt.running)
+            attempt.running = False
+        cnx.close(discard=discard)
+
+
+def cancel_attempt(attempt: _Attempt) -> None:
+    """Stop a losing attempt with KILL QUERY, sent over another connection of the same pool."""
+    assert _hedger is not None
+    with attempt.lock:
+        attempt.cancelled = True
+        if not attempt.running:
+            return
+        thread_id = int(attempt.cnx.connection_id)
+    try:
+        killer = attempt.pool.get_connection(timeout_s=0.1)
+        try:
+            killer.cursor().execute(f"KILL QUERY {{thread_id}}")
+        finally:
+            killer.close()
+        _hedger.count_cancel()
+    except Exception as e:
+        log.debug("could not cancel hedged read on thread %s: %s", thread_id, e)
+
+
+def hedged_select(sql: str, params: Optional[List[Any]], info: SqlInfo) -> BaseModel:
+    """A replica-safe SELECT through ProxySQL, duplicated to a replica if it is slower than the hedge delay."""
+    assert _hedger is not None and _hedge_executor is not None
+    delay = _hedger.admit()
+    t0 = time.perf_counter()
+    primary = _Attempt(_pool)
+    attempts = {{_hedge_executor.submit(select_attempt, primary, sql, params, info): primary}}
+    if delay is not None:
+        done, _ = wait_futures(list(attempts), timeout=delay)
+        if not done and _hedger.try_spend():
+            hedge = _Attempt(_hedger.next_pool())
+            attempts[_hedge_executor.submit(select_attempt, hedge, sql, params, info)] = hedge
+
+    winner: Optional[_Attempt] = None
+    error: Optional[Exception] = None
+    pending = set(attempts)
+    try:
+        while pending:
+            done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                try:
+                    result = fut.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                winner = attempts[fut]
+                if winner is primary:
+                    _hedger.observe(primary.elapsed)
+                else:
+                    # The primary's latency is at least this; keeps the quantile honest.
+                    _hedger.observe(time.perf_counter() - t0, hedge_won=True)
+                return result
+        assert error is not None
+        raise error
+    finally:
+        for attempt in attempts.values():
+            if attempt is not winner:
+                _hedge_executor.submit(cancel_attempt, attempt)
+
+
+async def select_attempt_async(
+    pool: Any, acquire: Callable[[], Awaitable[Any]], sql: str, params: Optional[List[Any]], info: SqlInfo
+) -> Tuple[BaseModel, float]:
+    t0 = time.perf_counter()
+    cnx = await acquire()
+    try:
+        result = await run_statement_async(cnx, sql, params, info)
+        return result, time.perf_counter() - t0
+    except asyncio.CancelledError:
+        # Lost the race: stop the query on the server and drop the connection.
+        asyncio.ensure_future(kill_query_async(pool, cnx.thread_id()))
+        cnx.close()
+        raise
+    except aiomysql.OperationalError:
+        cnx.close()
+        raise
+    finally:
+        pool.release(cnx)
+
+
+async def kill_query_async(pool: Any, thread_id: int) -> None:
+    assert _hedger is not None
+    try:
+        cnx = await asyncio.wait_for(pool.acquire(), 0.1)
+        try:
+            async with cnx.cursor() as cur:
+                await cur.execute(f"KILL QUERY {{int(thread_id)}}")
+        finally:
+            pool.release(cnx)
+        _hedger.count_cancel()
+    except Exception as e:
+        log.debug("could not cancel hedged read on thread %s: %s", thread_id, e)
+
+
+async def hedged_select_async(sql: str, params: Optional[List[Any]], info: SqlInfo) -> BaseModel:
+    assert _hedger is not None
+    delay = _hedger.admit()
+    t0 = time.perf_counter()
+    primary = asyncio.ensure_future(select_attempt_async(_apool, acquire_async, sql, params, info))
+    tasks = [primary]
+    if delay is not None:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done and _hedger.try_spend():
+            replica = _hedger.next_pool()
+            tasks.append(asyncio.ensure_future(select_attempt_async(
+                replica, lambda: asyncio.wait_for(replica.acquire(), POOL_CHECKOUT_TIMEOUT_S), sql, params, info
+            )))
+    for task in tasks:
+        # Losers may fail after we returned; don't log that as an unretrieved exception.
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    error: Optional[BaseException] = None
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = error or task.exception()
+                    continue
+                result, elapsed = task.result()
+                if task is primary:
+                    _hedger.observe(elapsed)
+                else:
+                    _hedger.observe(time.perf_counter() - t0, hedge_won=True)
+                return result
+        assert error is not None
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+def drain_or_discard(cnx: Any, cur: Any, info: SqlInfo) -> None:
+    """
+    A truncated fetch leaves rows unread, which breaks the next statement on
+    the connection. With LIMIT push-down the rest is small: read it.
+    Otherwise drop the connection.
+    """
+    if LIMIT_PUSHDOWN and info.limit_pos >= 0:
+        cur.fetchall()
+    else:
+        cnx.close(discard=True)
+
+
+def stream_rows(cnx: Any, cur: Any, on_close: Callable[[], None]) -> Iterator[bytes]:
+    """NDJSON body of an executed SELECT; gives the connection back, then calls on_close()."""
+    out = RowStream()
+    finished = False
+    try:
+        yield out.header(cur.description)
+        while not out.truncated:
+            rows = cur.fetchmany(STREAM_BATCH_ROWS)
+            if not rows:
+                finished = True
+                break
+            yield out.batch(rows)
+        yield out.footer()
+    except MySQLError as e:
+        yield out.error(e)
+    finally:
+        # Unread rows (cap hit, error, client gone) leave the connection unusable.
+        cnx.close(discard=not finished)
+        on_close()
+
+
+def stream_query(
+    sql: str, params: Optional[List[Any]], info: SqlInfo, timer: StageTimer, on_close: Callable[[], None]
+) -> StreamingResponse:
+    try:
+        assert _pool is not None
+        cnx = _pool.get_connection()
+        timer.mark("pool")
+        cnx.session_dirty = info.session_state
+        try:
+            cur = cnx.prepared_cursor(sql) if params is not None else cnx.cursor()
+            cur.execute(sql, params)
+            timer.mark("execute")
+        except (mysql_errors.OperationalError, mysql_errors.InterfaceError):
+            cnx.close(discard=True)
+            raise
+        except BaseException:
+            cnx.close()
+            raise
+    except PoolTimeout as e:
+        raise pool_timeout_to_http(e)
+    except MySQLError as e:
+        raise db_error_to_http(e)
+    except Exception:
+        raise HTTPException(status_code=500, detail="internal error")
+    return ndjson_response(stream_rows(cnx, cur, on_close), timer)
+
+
+async def stream_rows_async(cnx: Any, cur: Any, on_close: Callable[[], None]) -> AsyncIterator[bytes]:
+    out = RowStream()
+    finished = False
+    try:
+        yield out.header(cur.description)
+        while not out.truncated:
+            rows = await cur.fetchmany(STREAM_BATCH_ROWS)
+            if not rows:
+                finished = True
+                break
+            yield out.batch(rows)
+        yield out.footer()
+    except aiomysql.MySQLError as e:
+        yield out.error(e)
+    finally:
+        if not finished:
+            cnx.close()  # drop it rather than drain the rest of the result
+        _apool.release(cnx)
+        on_close()
+
+
+async def stream_query_async(
+    sql: str, params: Optional[List[Any]], timer: StageTimer, on_close: Callable[[], None]
+) -> StreamingResponse:
+    try:
+        cnx = await acquire_async()
+        timer.mark("pool")
+        try:
+            # Unbuffered cursor: rows are read from the socket batch by batch.
+            cur = await cnx.cursor(aiomysql.SSCursor)
+            await cur.execute(sql, params)
+            timer.mark("execute")
+        except BaseException:
+            cnx.close()
+            _apool.release(cnx)
+            raise
+    except PoolTimeout as e:
+        raise pool_timeout_to_http(e)
+    except aiomysql.MySQLError as e:
+        raise db_error_to_http(e)
+    except Exception:
+        raise HTTPException(status_code=500, detail="internal error")
+    return ndjson_response(stream_rows_async(cnx, cur, on_close), timer)
+
+
+def db_error_to_http(e: Exception) -> HTTPException:
+    _metrics.count_upstream_error(type(e).__name__)
+    msg = str(e)
+    if ("Can't connect" in msg or "Connection refused" in msg or "Lost connection" in msg
+            or "timeout" in msg.lower()):
+        return HTTPException(status_code=502, detail="upstream database unavailable")
+    return HTTPException(status_code=400, detail=f"sql error: {{msg}}")
+
+
+def pool_timeout_to_http(e: PoolTimeout) -> HTTPException:
+    _metrics.count_upstream_error("PoolTimeout")
+    return HTTPException(status_code=503, detail=f"database busy: {{e}}", headers={{"Retry-After": "1"}})
+
+
+@app.get("/metrics")
+def metrics_endpoint(
+    x_api_key: Optional[str] = Header(default=None, alias="X-API-Key"),
+    authorization: Optional[str] = Header(default=None),
+) -> Response:
+    # Prometheus can only send Authorization, so "Bearer <API_KEY>" works too.
+    if authorization and authorization.startswith("Bearer "):
+        x_api_key = authorization[len("Bearer "):]
+    auth_or_401(x_api_key, charge=False)
+    # Per process, like /stats.
+    return PlainTextResponse(
+        render_metrics(_metrics, pool_stats(), _limiters, list(_clients.values()), _flights),
+        media_type=PROMETHEUS_MEDIA_TYPE,
+    )
+
+
+@app.get("/stats")
+def stats_endpoint(x_api_key: Optional[str] = Header(default=None, alias="X-API-Key")) -> Dict[str, Any]:
+    auth_or_401(x_api_key, charge=False)
+    # Per process: with several uvicorn workers, each answers for its own pool.
+    return {{
+        "mode": EXEC_MODE,
+        "pid": os.getpid(),
+        "pool": pool_stats(),
+        "lexer_cache": analyze_sql_cached.cache_info()._asdict(),
+        "result_cache": _cache.stats() if _cache is not None else None,
+        "singleflight": _flights.stats() if _flights is not None else None,
+        "write_coalescer": _coalescer.stats() if _coalescer is not None else None,
+        "hedging": _hedger.stats() if _hedger is not None else None,
+        "concurrency_limits": {{k: v.stats() for k, v in _limiters.items()}} if _limiters is not None else None,
+        "api_keys": {{c.name: c.stats() for c in _clients.values()}},
+    }}
+
+
+def execute_query(sql: str, params: Optional[List[Any]], info: SqlInfo, timer: StageTimer) -> BaseModel:
+    """Hedged when possible, otherwise on a pooled connection through ProxySQL."""
+    if _hedger is not None and info.replica_safe:
+        result = hedged_select(sql, params, info)
+        timer.mark("execute")
+        return result
+    assert _pool is not None
+    cnx = _pool.get_connection()
+    timer.mark("pool")
+    cnx.session_dirty = info.session_state
+    try:
+        return run_statement(cnx, sql, params, info, timer)
+    except (mysql_errors.OperationalError, mysql_errors.InterfaceError):
+        # The connection itself may be gone: don't hand it to the next request.
+        cnx.close(discard=True)
+        raise
+    finally:
+        cnx.close()
+
+
+async def execute_query_async(sql: str, params: Optional[List[Any]], info: SqlInfo, timer: StageTimer) -> BaseModel:
+    if _hedger is not None and info.replica_safe:
+        result = await hedged_select_async(sql, params, info)
+        timer.mark("execute")
+        return result
+    cnx = await acquire_async()
+    timer.mark("pool")
+    try:
+        return await run_statement_async(cnx, sql, params, info, timer)
+    finally:
+        _apool.release(cnx)
+
+
 def query_endpoint(
     req: QueryRequest,
     request: Request,
     x_api_key: Optional[str] = Header(default=None, alias="X-API-Key"),
 ) -> Any:
-    auth_or_401(x_api_key)
+    timer = StageTimer()
+    client = auth_or_401(x_api_key)
+    timer.mark("auth")
 
     sql = req.query
-    validate_query(sql)
+    info = validate_query(sql)
+    validate_params(req.params)
+    qtype = info.kind
+    _request_kind.set(qtype)
+    timer.mark("validate")
+
+    if req.stream and qtype == "select":
+        # The stream holds the key's in-flight slot until the last row is sent.
+        enter_or_429(client)
+        try:
+            return stream_query(with_row_limit(sql, info, STREAM_MAX_ROWS + 1), req.params, info, timer, client.leave)
+        except BaseException:
+            client.leave()
+            raise
+
+    key = cache_key(sql, req.params)
+    cached, cache_gen = cache_probe(key, info, timer)
+    if cached is not None:
+        return cached
+
+    with concurrency_slot(qtype, client):
+        insert = coalescable_insert(sql, info)
+        try:
+            if insert is not None:
+                result = _coalescer.submit(*insert, req.params, run_insert_batch)
+                timer.mark("execute")
+            elif _flights is not None and info.replica_safe:
+                result = _flights.do(key, info.tables, lambda: execute_query(sql, req.params, info, timer))
+            else:
+                result = execute_query(sql, req.params, info, timer)
+
+        except HTTPException:
+            raise
+        except PoolTimeout as e:
+            raise pool_timeout_to_http(e)
+        except MySQLError as e:
+            raise db_error_to_http(e)
+        except Exception:
+            raise HTTPException(status_code=500, detail="internal error")
+        finally:
+            cache_invalidate(info)
 
-    qtype = classify_query(sql)
-    start = time.time()
+    response = timed_json_response(result, timer, {{"X-Cache": "MISS"}} if cache_gen is not None else None)
+    cache_store(key, info, cache_gen, response)
+    return response
 
-    try:
-        assert _pool is not None
-        cnx = _pool.get_connection()
+
+async def query_endpoint_async(
+    req: QueryRequest,
+    request: Request,
+    x_api_key: Optional[str] = Header(default=None, alias="X-API-Key"),
+) -> Any:
+    timer = StageTimer()
+    client = auth_or_401(x_api_key)
+    timer.mark("auth")
+
+    sql = req.query
+    info = validate_query(sql)
+    validate_params(req.params)
+    qtype = info.kind
+    _request_kind.set(qtype)
+    timer.mark("validate")
+
+    if req.stream and qtype == "select":
+        enter_or_429(client)
         try:
-            cur = cnx.cursor()
-            cur.execute(sql)
+            return await stream_query_async(
+                with_row_limit(sql, info, STREAM_MAX_ROWS + 1), req.params, timer, client.leave
+            )
+        except BaseException:
+            client.leave()
+            raise
+
+    key = cache_key(sql, req.params)
+    cached, cache_gen = cache_probe(key, info, timer)
+    if cached is not None:
+        return cached
+
+    with concurrency_slot(qtype, client):
+        insert = coalescable_insert(sql, info)
+        try:
+            if insert is not None:
+                result = await _coalescer.submit_async(*insert, req.params, run_insert_batch_async)
+                timer.mark("execute")
+            elif _flights is not None and info.replica_safe:
+                result = await _flights.do_async(
+                    key, info.tables, lambda: execute_query_async(sql, req.params, info, timer)
+                )
+            else:
+                result = await execute_query_async(sql, req.params, info, timer)
+
+        except HTTPException:
+            raise
+        except PoolTimeout as e:
+            raise pool_timeout_to_http(e)
+        except aiomysql.MySQLError as e:
+            raise db_error_to_http(e)
+        except Exception:
+            raise HTTPException(status_code=500, detail="internal error")
+        finally:
+            cache_invalidate(info)
 
-            if qtype == "select":
-                cols, rows, truncated = fetch_all_limited(cur)
-                return SelectResponse(columns=cols, rows=rows, row_count=len(rows), truncated=truncated)
+    response = timed_json_response(result, timer, {{"X-Cache": "MISS"}} if cache_gen is not None else None)
+    cache_store(key, info, cache_gen, response)
+    return response
 
-            affected = cur.rowcount if cur.rowcount is not None else 0
-            return WriteResponse(affected_rows=int(affected))
+
+# ----------------------------
+# /batch: many statements, one round-trip, one connection
+# ----------------------------
+BATCH_SKIPPED = {{"status": 424, "detail": "not executed: an earlier statement failed"}}
+
+
+def validate_batch(req: BatchRequest) -> List[SqlInfo]:
+    """Every statement must pass the /query rules, or the whole batch is rejected."""
+    if not req.statements:
+        _metrics.count_rejection("empty_batch")
+        raise HTTPException(status_code=400, detail="empty batch")
+    if len(req.statements) > BATCH_MAX_STATEMENTS:
+        _metrics.count_rejection("batch_too_large")
+        raise HTTPException(status_code=413, detail=f"batch too large (max {{BATCH_MAX_STATEMENTS}} statements)")
+    infos = []
+    for i, st in enumerate(req.statements):
+        try:
+            infos.append(validate_query(st.query))
+            validate_params(st.params)
+        except HTTPException as e:
+            raise HTTPException(status_code=e.status_code, detail=f"statement {{i}}: {{e.detail}}")
+    return infos
+
+
+def batch_kind(infos: List[SqlInfo]) -> str:
+    """'select' for a read-only batch (read limit); otherwise it counts as a write."""
+    return "select" if all(info.kind == "select" for info in infos) else "write"
+
+
+def batch_entry(result: BaseModel) -> Dict[str, Any]:
+    return {{"status": 200, **jsonable_encoder(result)}}
+
+
+def batch_error(e: HTTPException) -> Dict[str, Any]:
+    return {{"status": e.status_code, "detail": e.detail}}
+
+
+def batch_endpoint(
+    req: BatchRequest,
+    x_api_key: Optional[str] = Header(default=None, alias="X-API-Key"),
+) -> Any:
+    timer = StageTimer()
+    client = auth_or_401(x_api_key)
+    timer.mark("auth")
+    infos = validate_batch(req)
+    _request_kind.set("batch")
+    timer.mark("validate")
+
+    with concurrency_slot(batch_kind(infos), client):
+        results: List[Dict[str, Any]] = []
+        committed: Optional[bool] = None
+        try:
+            assert _pool is not None
+            cnx = _pool.get_connection()
+            timer.mark("pool")
+            cnx.session_dirty = any(info.session_state for info in infos)
+            try:
+                if req.transaction:
+                    cnx.start_transaction()
+                failed = False
+                for st, info in zip(req.statements, infos):
+                    if failed or cnx.released:
+                        results.append(BATCH_SKIPPED)
+                        continue
+                    try:
+                        results.append(batch_entry(run_statement(cnx, st.query, st.params, info, keep_connection=True)))
+                    except (mysql_errors.OperationalError, mysql_errors.InterfaceError) as e:
+                        cnx.close(discard=True)
+                        results.append(batch_error(db_error_to_http(e)))
+                        failed = True
+                    except MySQLError as e:
+                        results.append(batch_error(db_error_to_http(e)))
+                        failed = req.transaction
+                timer.mark("execute")
+                if req.transaction and not cnx.released:
+                    if failed:
+                        cnx.rollback()
+                    else:
+                        cnx.commit()
+                    committed = not failed
+                elif req.transaction:
+                    committed = False  # connection lost: the server rolls back
+            except (mysql_errors.OperationalError, mysql_errors.InterfaceError):
+                cnx.close(discard=True)
+                raise
+            finally:
+                cnx.close()
+
+        except HTTPException:
+            raise
+        except PoolTimeout as e:
+            raise pool_timeout_to_http(e)
+        except MySQLError as e:
+            raise db_error_to_http(e)
+        except Exception:
+            raise HTTPException(status_code=500, detail="internal error")
         finally:
-            cnx.close()
+            for info in infos:
+                cache_invalidate(info)
 
-    except HTTPException:
-        raise
-    except MySQLError as e:
-        msg = str(e)
-        if "Can't connect" in msg or "Connection refused" in msg or "timeout" in msg.lower():
-            raise HTTPException(status_code=502, detail="upstream database unavailable")
-        raise HTTPException(status_code=400, detail=f"sql error: {{msg}}")
-    except Exception:
-        raise HTTPException(status_code=500, detail="internal error")
+    return timed_json_response(BatchResponse(transaction=req.transaction, committed=committed, results=results), timer)
+
+
+async def batch_endpoint_async(
+    req: BatchRequest,
+    x_api_key: Optional[str] = Header(default=None, alias="X-API-Key"),
+) -> Any:
+    timer = StageTimer()
+    client = auth_or_401(x_api_key)
+    timer.mark("auth")
+    infos = validate_batch(req)
+    _request_kind.set("batch")
+    timer.mark("validate")
+
+    with concurrency_slot(batch_kind(infos), client):
+        results: List[Dict[str, Any]] = []
+        committed: Optional[bool] = None
+        try:
+            cnx = await acquire_async()
+            timer.mark("pool")
+            try:
+                if req.transaction:
+                    await cnx.begin()
+                failed = broken = False
+                for st, info in zip(req.statements, infos):
+                    if failed:
+                        results.append(BATCH_SKIPPED)
+                        continue
+                    try:
+                        results.append(batch_entry(await run_statement_async(cnx, st.query, st.params, info)))
+                    except aiomysql.OperationalError as e:
+                        cnx.close()
+                        results.append(batch_error(db_error_to_http(e)))
+                        failed = broken = True
+                    except aiomysql.MySQLError as e:
+                        results.append(batch_error(db_error_to_http(e)))
+                        failed = req.transaction
+                timer.mark("execute")
+                if req.transaction:
+                    if broken:
+                        committed = False
+                    elif failed:
+                        await cnx.rollback()
+                        committed = False
+                    else:
+                        await cnx.commit()
+                        committed = True
+            except BaseException:
+                cnx.close()
+                raise
+            finally:
+                _apool.release(cnx)
+
+        except HTTPException:
+            raise
+        except PoolTimeout as e:
+            raise pool_timeout_to_http(e)
+        except aiomysql.MySQLError as e:
+            raise db_error_to_http(e)
+        except Exception:
+            raise HTTPException(status_code=500, detail="internal error")
+        finally:
+            for info in infos:
+                cache_invalidate(info)
+
+    return timed_json_response(BatchResponse(transaction=req.transaction, committed=committed, results=results), timer)
+
+
+if EXEC_MODE == "async":
+    app.get("/health")(health_async)
+    app.post("/query", response_model=Any)(instrumented("/query", query_endpoint_async))
+    app.post("/batch", response_model=Any)(instrumented("/batch", batch_endpoint_async))
+else:
+    app.get("/health")(health)
+    app.post("/query", response_model=Any)(instrumented("/query", query_endpoint))
+    app.post("/batch", response_model=Any)(instrumented("/batch", batch_endpoint))
 '''
 
     return template.format(
@@ -745,15 +3432,55 @@ def query_endpoint(
         PROXY_PORT=int(proxy_port),
         DB_USER=db_user,
         DB_PASSWORD=db_password,
+        EXEC_MODE=mode,
     )
 
+def env_file_line(key: str, value: str) -> str:
+    """KEY="value" line for a systemd EnvironmentFile; systemd reads the value back verbatim."""
+    if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", key) or "\n" in value or "\r" in value:
+        raise ValueError(f"Invalid environment setting: {key!r}")
+    escaped = "".join("\\" + c if c in '\\"`$' else c for c in value)
+    return f'{key}="{escaped}"\n'
+
+
 def build_gateway_user_data(
     server_code: str,
     listen_port: int = 80,
     app_dir: str = "/opt/gatekeeper",
     service_name: str = "gatekeeper",
+    mode: str = "sync",
+    workers: Optional[int] = None,
+    db_connections: int = 40,
+    loop: str = "auto",
+    http: str = "auto",
+    env: Optional[Dict[str, str]] = None,
 ) -> str:
-    
+    """
+    User data for the Gateway; `mode` must match the def_server_code() mode.
+
+    uvicorn runs `workers` processes (default: one per vCPU, read with nproc
+    at boot). Each worker has its own pool, so POOL_SIZE is set to
+    db_connections // workers to keep the total towards ProxySQL fixed.
+    `loop` (auto|asyncio|uvloop) and `http` (auto|h11|httptools) pick
+    uvicorn's event loop and HTTP parser. `env` adds Gatekeeper settings
+    (e.g. RESULT_CACHE_TTL_S) to the service's environment file.
+    """
+    if loop not in ("auto", "asyncio", "uvloop"):
+        raise ValueError(f"Unknown uvicorn loop: {loop}")
+    if http not in ("auto", "h11", "httptools"):
+        raise ValueError(f"Unknown uvicorn http implementation: {http}")
+
+    packages = ["fastapi", "uvicorn", "mysql-connector-python", "orjson"]
+    if mode == "async":
+        packages.append("aiomysql")
+    if loop == "uvloop":
+        packages.append("uvloop")
+    if http == "httptools":
+        packages.append("httptools")
+
+    workers_expr = str(int(workers)) if workers else "$(nproc)"
+    extra_env = "".join(env_file_line(k, v) for k, v in (env or {}).items())
+
     code_b64 = base64.b64encode(server_code.encode("utf-8")).decode("ascii")
 
     systemd_unit = f"""\
@@ -765,7 +3492,8 @@ Wants=network-online.target
 [Service]
 Type=simple
 WorkingDirectory={app_dir}
-ExecStart=/opt/gatekeeper/venv/bin/python -m uvicorn server:app --host 0.0.0.0 --port {listen_port}
+EnvironmentFile={app_dir}/{service_name}.env
+ExecStart=/opt/gatekeeper/venv/bin/python -m uvicorn server:app --host 0.0.0.0 --port {listen_port} --workers ${{UVICORN_WORKERS}} --loop {loop} --http {http}
 Restart=always
 RestartSec=2
 
@@ -792,13 +3520,27 @@ source venv/bin/activate
 
 # Instalar dependencias dentro del venv
 pip install --upgrade pip
-pip install fastapi uvicorn mysql-connector-python
+pip install {" ".join(packages)}
 
 
 # Escribir app
 mkdir -p {app_dir}
 echo "{code_b64}" | base64 -d > {app_dir}/server.py
 
+# Workers (one per vCPU unless fixed) and per-worker pool size
+WORKERS={workers_expr}
+POOL_PER_WORKER=$(( {db_connections} / WORKERS ))
+if [ "$POOL_PER_WORKER" -lt 1 ]; then
+  POOL_PER_WORKER=1
+fi
+cat > {app_dir}/{service_name}.env <<EOE
+UVICORN_WORKERS=${{WORKERS}}
+POOL_SIZE=${{POOL_PER_WORKER}}
+EOE
+# User-supplied settings (API keys...): quoted heredoc, nothing is expanded
+cat >> {app_dir}/{service_name}.env <<'EOE'
+{extra_env}EOE
+
 # Systemd service
 cat > /etc/systemd/system/{service_name}.service <<'EOS'
 {systemd_unit}
@@ -809,7 +3551,7 @@ systemctl enable --now {service_name}
 
 # Smoke check local
 sleep 2
-curl -fsS http://127.0.0.1:{listen_port}/health || (journalctl -u {service_name} -n 200 --no-pager; exit 1)
+curl -fsS "http://127.0.0.1:{listen_port}/health?deep=true" || (journalctl -u {service_name} -n 200 --no-pager; exit 1)
 """
 
     return textwrap.dedent(user_data)
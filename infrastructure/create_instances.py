@@ -107,16 +107,17 @@ def create_proxy_instance(sg_proxy_name: str, instances: dict, strategy: str):
 
     return instance
 
-def create_gateway_instance(sg_gateway_name, proxy_private_ip):
+def create_gateway_instance(sg_gateway_name, proxy_private_ip, mode="sync", workers=None, env=None):
     code_server = def_server_code(
                     api_key=API_GATEWAY,
                     proxy_host=proxy_private_ip,
                     proxy_port=3306,
                     db_user=SQL_USER,
-                    db_password=SQL_PASSWORD
+                    db_password=SQL_PASSWORD,
+                    mode=mode
     )
 
-    user_data_gateway = build_gateway_user_data(code_server)
+    user_data_gateway = build_gateway_user_data(code_server, mode=mode, workers=workers, env=env)
 
     gateway_instance = create_instance(
                             instance_type="t2.large",
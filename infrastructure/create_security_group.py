@@ -27,6 +27,27 @@ def add_self_mysql_ingress(sg_id: str):
             "UserIdGroupPairs": [{"GroupId": sg_id}],
         }]
     )
+def add_mysql_ingress_from(sg_id: str, source_sg_id: str):
+    try:
+        ec2_client.authorize_security_group_ingress(
+            GroupId=sg_id,
+            IpPermissions=[{
+                "IpProtocol": "tcp",
+                "FromPort": 3306,
+                "ToPort": 3306,
+                "UserIdGroupPairs": [{"GroupId": source_sg_id}],
+            }]
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "InvalidPermission.Duplicate":
+            raise
+
+def get_security_group_id(SECURITY_GROUP_NAME):
+    resp = ec2_client.describe_security_groups(
+        Filters=[{"Name": "group-name", "Values": [SECURITY_GROUP_NAME]}]
+    )
+    return resp["SecurityGroups"][0]["GroupId"]
+
 def add_icmp_protocol_sg(sg_id:str):
     ec2_client.authorize_security_group_ingress(
         GroupId=sg_id,
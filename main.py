@@ -4,7 +4,7 @@ import json
 import requests
 import pathlib
 import argparse
-from infrastructure.create_security_group import create_security_group, add_self_mysql_ingress, add_icmp_protocol_sg
+from infrastructure.create_security_group import create_security_group, add_self_mysql_ingress, add_icmp_protocol_sg, add_mysql_ingress_from, get_security_group_id
 from infrastructure.destroy_infrastructure import destroy_all
 from infrastructure.constants import SG_MAIN_NAME, build_main_permissions, SG_PROXY_NAME, build_proxy_permissions, _REPO_ROOT, SG_GATEWAY_NAME, IP_PERMISSIONS_GATEWAY
 from infrastructure.create_instances import create_main_instances, create_proxy_instance, create_gateway_instance, create_gateway_instance
@@ -24,6 +24,22 @@ if __name__ == "__main__":
     parser.add_argument("--gateway", action="store_true", help="Destroy Infrastructure")
     parser.add_argument("--destroy", action="store_true", help="Destroy Infrastructure")
     parser.add_argument("--strategy",choices=["customized", "directhit", "random"], default="directhit")
+    parser.add_argument("--gateway-mode", choices=["sync", "async"], default="sync",
+                        help="Gatekeeper request path: threadpool + mysql-connector, or async + aiomysql")
+    parser.add_argument("--gateway-workers", type=int, default=None,
+                        help="uvicorn worker processes on the Gateway (default: one per vCPU)")
+    parser.add_argument("--gateway-cache-ttl", type=float, default=0.0,
+                        help="Seconds the Gatekeeper caches SELECT results (0 = cache off)")
+    parser.add_argument("--gateway-write-coalesce-ms", type=float, default=0.0,
+                        help="Window in ms for merging concurrent single-row INSERTs into one (0 = off)")
+    parser.add_argument("--gateway-hedge-reads", action="store_true",
+                        help="Let the Gatekeeper hedge slow SELECTs to the workers directly (random/customized only)")
+    parser.add_argument("--gateway-adaptive-concurrency", action="store_true",
+                        help="Shed load with 503 past an adaptive (AIMD) in-flight limit for reads and for writes")
+    parser.add_argument("--gateway-singleflight", action="store_true",
+                        help="Let concurrent identical SELECTs share one execution in the Gatekeeper")
+    parser.add_argument("--gateway-api-keys", default="",
+                        help="Extra Gatekeeper API keys with quotas: name=key[:rate[:burst[:max_inflight]]],...")
 
     args = parser.parse_args()
 
@@ -109,8 +125,25 @@ if __name__ == "__main__":
         with open(path, "r", encoding="utf-8") as f:
             data = json.load(f)
         private_ip_proxy = data["proxy"]["private_ip"]
-        
-        gateway = create_gateway_instance(SG_GATEWAY_NAME, private_ip_proxy)
+
+        gateway_env = {"RESULT_CACHE_TTL_S": str(args.gateway_cache_ttl),
+                       "WRITE_COALESCE_WINDOW_MS": str(args.gateway_write_coalesce_ms),
+                       "ADAPTIVE_CONCURRENCY": str(args.gateway_adaptive_concurrency).lower(),
+                       "SINGLEFLIGHT": str(args.gateway_singleflight).lower()}
+        if args.gateway_api_keys:
+            gateway_env["API_KEYS"] = args.gateway_api_keys
+        if args.gateway_hedge_reads:
+            if args.strategy == "directhit":
+                # directhit reads from the manager: a replica answer could be stale
+                print("--gateway-hedge-reads ignored with --strategy directhit")
+            else:
+                worker_ips = [data[key]["private_ip"] for key in data.keys() if key.startswith("worker")]
+                gateway_env["HEDGE_READ_HOSTS"] = ",".join(f"{ip}:3306" for ip in worker_ips)
+                add_mysql_ingress_from(get_security_group_id(SG_MAIN_NAME), get_security_group_id(SG_GATEWAY_NAME))
+                print("Hedged reads to: ", worker_ips)
+
+        gateway = create_gateway_instance(SG_GATEWAY_NAME, private_ip_proxy, mode=args.gateway_mode, workers=args.gateway_workers,
+                                          env=gateway_env)
         print("gateway instance created: ", gateway)
         save_instance_ips({"gateway" : gateway})
 